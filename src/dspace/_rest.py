@@ -1,4 +1,5 @@
 import logging
+import threading
 # from json import JSONDecodeError
 from ._http import response_to_json
 
@@ -33,14 +34,19 @@ class rest:
         Serves as proxy to Dspace REST API.
         Mostly uses attribute d which represents (slightly modified) dspace_client from
         original python rest api by dspace developers
+
+        Every thread uses its own client (session, CSRF token, acceptable responses),
+        clients of other threads than the creating one log in on their first request.
     """
 
     def __init__(self, endpoint: str, user: str, password: str, auth: bool = True):
         _logger.info(f"Initialise connection to DSpace REST backend [{endpoint}]")
 
-        self._acceptable_resp = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
         self._get_cnt = 0
         self._post_cnt = 0
+        self._listeners = []
 
         client.check_response = lambda x, y: self._resp_check(x, y)
         self._response_map = {
@@ -50,15 +56,42 @@ class rest:
             400: lambda r: self._resp_error(r)
         }
 
-        self.client = client.DSpaceClient(
+        self._login = (endpoint, user, password, auth)
+        self._local.client = self._create_client()
+        _logger.info(f"DSpace REST backend is available at [{endpoint}]")
+        self.endpoint = endpoint.rstrip("/")
+
+    def _create_client(self):
+        endpoint, user, password, auth = self._login
+        c = client.DSpaceClient(
             api_endpoint=endpoint, username=user, password=password)
         if auth:
-            if not self.client.authenticate():
+            if not c.authenticate():
                 _logger.error(f'Error auth to dspace REST API at [{endpoint}]!')
                 raise ConnectionError("Cannot connect to dspace!")
-            _logger.debug(f"Successfully logged in to [{endpoint}]")
-        _logger.info(f"DSpace REST backend is available at [{endpoint}]")
-        self.endpoint = endpoint.rstrip("/")
+            _logger.debug(f"Successfully logged in to [{endpoint}] in [{threading.current_thread().name}]")
+        return c
+
+    @property
+    def client(self):
+        c = getattr(self._local, "client", None)
+        if c is None:
+            c = self._create_client()
+            self._local.client = c
+        return c
+
+    @property
+    def _acceptable_resp(self) -> list:
+        if not hasattr(self._local, "acceptable_resp"):
+            self._local.acceptable_resp = []
+        return self._local.acceptable_resp
+
+    def _inc(self, get: bool):
+        with self._lock:
+            if get:
+                self._get_cnt += 1
+            else:
+                self._post_cnt += 1
 
     # =======
 
@@ -70,6 +103,30 @@ class rest:
     def post_cnt(self):
         return self._post_cnt
 
+    def add_listener(self, listener):
+        """
+            Listener of every REST request, `request_start(method, command)` returns a token
+            which is passed to `request_end(token, response, error)` when the request finishes.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def after_fork(self):
+        """
+            Drop pooled http connections inherited from the parent process,
+            the authenticated session (cookies, headers) is kept.
+        """
+        session = getattr(self.client, "session", None)
+        if session is not None:
+            session.close()
+        # the lock could be held by another thread of the parent
+        self._lock = threading.Lock()
+        self._get_cnt = 0
+        self._post_cnt = 0
+
     # =======
 
     def push_acceptable(self, arr: list):
@@ -435,6 +492,24 @@ class rest:
         _logger.debug(f"Importing [][{param}] using [{url}]")
         return list(self._iput(url, [data], [param]))[0]
 
+    def update_item(self, uuid: str, data: dict):
+        """
+            Replace metadata and flags of an existing item.
+        """
+        url = f'core/items/{uuid}'
+        _logger.debug(f"Updating [{uuid}] using [{url}]")
+        r = self.put(url, data=data)
+        if not r.ok:
+            raise Exception(r)
+        return response_to_json(r)
+
+    def delete_item(self, uuid: str):
+        url = f'core/items/{uuid}'
+        _logger.debug(f"Deleting [{uuid}] using [{url}]")
+        r = self.delete(url)
+        if not r.ok:
+            raise Exception(r)
+
     def put_item_to_col(self, item_uuid: str, data: list):
         url = f'clarin/import/item/{item_uuid}/mappedCollections'
         _logger.debug(f"Importing [{data}] using [{url}]")
@@ -539,15 +614,49 @@ class rest:
         url = command + '/' + str(object_id)
         return self.get(url, {})
 
+    def _call(self, method: str, command: str, fnc):
+        if len(self._listeners) == 0:
+            return fnc()
+        tokens = []
+        for listener in self._listeners:
+            try:
+                tokens.append((listener, listener.request_start(method, command)))
+            except Exception as e:
+                _logger.error(f"REST listener [{type(listener).__name__}] failed: [{str(e)}]")
+        r = None
+        error = None
+        try:
+            r = fnc()
+            return r
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            for listener, token in tokens:
+                try:
+                    listener.request_end(token, r, error)
+                except Exception as e:
+                    _logger.error(f"REST listener [{type(listener).__name__}] failed: [{str(e)}]")
+
     def get(self, command: str, params=None, data=None):
         url = self.endpoint + '/' + command
-        self._get_cnt += 1
-        return self.client.api_get(url, params, data)
+        self._inc(True)
+        return self._call("GET", command, lambda: self.client.api_get(url, params, data))
 
     def post(self, command: str, params=None, data=None):
         url = self.endpoint + '/' + command
-        self._post_cnt += 1
-        return self.client.api_post(url, params or {}, data or {})
+        self._inc(False)
+        return self._call("POST", command, lambda: self.client.api_post(url, params or {}, data or {}))
+
+    def put(self, command: str, params=None, data=None):
+        url = self.endpoint + '/' + command
+        self._inc(False)
+        return self._call("PUT", command, lambda: self.client.api_put(url, params or {}, data or {}))
+
+    def delete(self, command: str, params=None):
+        url = self.endpoint + '/' + command
+        self._inc(False)
+        return self._call("DELETE", command, lambda: self.client.api_delete(url, params or {}))
 
     # =======
 
@@ -1,7 +1,37 @@
 __all__ = [
     "repo",
     "db",
+    "wal",
+    "idstore",
+    "phase",
+    "scheduler",
+    "pipeline",
+    "plan",
+    "validation_pool",
+    "subset",
+    "delta",
+    "fingerprint",
+    "fingerprints",
+    "perf",
+    "metrics",
+    "profiler",
+    "memory",
+    "tracer",
 ]
 
 from ._repo import repo
 from ._db import db
+from ._wal import wal
+from ._idstore import idstore
+from ._phase import phase, scheduler
+from ._pipeline import pipeline
+from ._plan import plan
+from ._validation import validation_pool
+from ._subset import subset
+from ._delta import delta
+from ._fingerprint import fingerprint, fingerprints
+from ._perf import perf
+from ._metrics import metrics
+from ._profiler import profiler
+from ._memory import memory
+from ._tracing import tracer
@@ -1,6 +1,10 @@
 import os
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
+from ._shard import sharded, shard_by
+from ._tracing import span
 
 _logger = logging.getLogger("pump.bitstream")
 
@@ -41,12 +45,14 @@ class bitstreams:
         self._bs = read_json(bitstream_file_str) or []
         self._bundle2bs = read_json(bundle2bitstream_file_str) or []
 
-        self._id2uuid = {}
+        self._id2uuid = idmap()
         self._imported = {
             "bitstream": 0,
             "com_logo": 0,
             "col_logo": 0,
         }
+        # bundle id -> bitstreams, built on first use
+        self._bundle2bs_objs = None
 
         if not self._bundle2bs:
             _logger.info(f"Empty input: [{bundle2bitstream_file_str}].")
@@ -55,14 +61,19 @@ class bitstreams:
             _logger.info(f"Empty input: [{bitstream_file_str}].")
             return
 
-        self._bs2bundle = {}
-        for e in self._bundle2bs:
-            self._bs2bundle[e['bitstream_id']] = e['bundle_id']
+        self._bs2bundle = self._index()
         self._done = []
 
+    def _index(self) -> dict:
+        return {e['bitstream_id']: e['bundle_id'] for e in self._bundle2bs or []}
+
     def __len__(self):
         return len(self._bs or {})
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, b_id: int):
         return self._id2uuid.get(str(b_id), None)
 
@@ -83,13 +94,16 @@ class bitstreams:
         return self._imported['col_logo']
 
     @time_method
-    def import_to(self, env, cache_file, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections):
+    def import_to(self, env, cache_file, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections,
+                  wal=None, ids=None, shards: int = 1):
+        wal = ensure_wal(wal)
         if "bs" in self._done:
             _logger.info("Skipping bitstream import")
         else:
             self._done.append("bs")
             self._bitstream_import_to(env, dspace, metadatas,
-                                      bitstreamformatregistry, bundles, communities, collections)
+                                      bitstreamformatregistry, bundles, communities, collections, wal,
+                                      ids, shards)
             self.serialize(cache_file)
 
         if "logos" in self._done:
@@ -97,11 +111,11 @@ class bitstreams:
         else:
             self._done.append("logos")
             # add logos (bitstreams) to collections and communities
-            self._logo2com_import_to(dspace, communities)
-            self._logo2col_import_to(dspace, collections)
+            self._logo2com_import_to(dspace, communities, wal)
+            self._logo2col_import_to(dspace, collections, wal)
             self.serialize(cache_file)
 
-    def _logo2col_import_to(self, dspace, collections):
+    def _logo2col_import_to(self, dspace, collections, wal):
         if not collections.logos:
             _logger.info("There are no logos for collections.")
             return
@@ -110,7 +124,11 @@ class bitstreams:
         log_key = "collection logos"
         log_before_import(log_key, expected)
 
+        self._imported["col_logo"] += len(wal.records("col_logo"))
+
         for key, value in progress_bar(collections.logos.items()):
+            if wal.done("col_logo", key):
+                continue
             col_uuid = collections.uuid(key)
             bs_uuid = self.uuid(value)
             if col_uuid is None or bs_uuid is None:
@@ -123,12 +141,13 @@ class bitstreams:
             try:
                 resp = dspace.put_col_logo(params)
                 self._imported["col_logo"] += 1
+                wal.append("col_logo", key, bs_uuid)
             except Exception as e:
                 _logger.error(f'put_col_logo [{col_uuid}]: failed. Exception: [{str(e)}]')
 
         log_after_import(log_key, expected, self.imported_col_logos)
 
-    def _logo2com_import_to(self, dspace, communities):
+    def _logo2com_import_to(self, dspace, communities, wal):
         """
             Add bitstream to community as community logo.
             Logo has to exist in database.
@@ -141,7 +160,11 @@ class bitstreams:
         log_key = "communities logos"
         log_before_import(log_key, expected)
 
+        self._imported["com_logo"] += len(wal.records("com_logo"))
+
         for key, value in progress_bar(communities.logos.items()):
+            if wal.done("com_logo", key):
+                continue
             com_uuid = communities.uuid(key)
             bs_uuid = self.uuid(value)
             if com_uuid is None or bs_uuid is None:
@@ -154,104 +177,82 @@ class bitstreams:
             try:
                 resp = dspace.put_com_logo(params)
                 self._imported["com_logo"] += 1
+                wal.append("com_logo", key, bs_uuid)
             except Exception as e:
                 _logger.error(f'put_com_logo [{com_uuid}]: failed. Exception: [{str(e)}]')
 
         log_after_import(log_key, expected, self.imported_com_logos)
 
-    def _bitstream_import_to(self, env, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections):
+    def _bitstream_import_to(self, env, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections,
+                             wal, ids=None, shards=1):
         expected = len(self)
         log_key = "bitstreams"
         log_before_import(log_key, expected)
 
+        # replay bitstreams created before the crash
+        self._imported["bitstream"] += wal.replay_into("bitstream", self._id2uuid)
+
         test_instance = env["backend"].get("testing", False)
         path_assetstore = env["assetstore"]
         if test_instance and path_assetstore == "":
             _logger.critical(
                 'Location of assetstore dir is not defined but it should be checked!')
 
-        for i, b in enumerate(progress_bar(self._bs)):
-            b_id = b['bitstream_id']
-            b_deleted = b['deleted']
+        if shards > 1 and ids is not None:
+            stats = self._bitstream_import_sharded(
+                env, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections, wal,
+                ids, shards)
+        else:
+            stats = self._bitstream_import_objs(
+                self._bs, env, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections,
+                wal)
+        self._imported["bitstream"] += stats.get("imported", 0)
+
+        log_after_import(log_key, expected, self.imported)
 
+    def _bitstream_import_sharded(self, env, dspace, metadatas, bitstreamformatregistry, bundles, communities,
+                                  collections, wal, ids, shards):
+        """
+            Import bitstreams in `shards` worker processes, bitstreams of one bundle
+            are imported by one worker.
+        """
+        todo = [x for x in self._bs if not wal.done("bitstream", x['bitstream_id'])]
+        sh = sharded("bitstreams", "bitstream", wal, ids, dspace)
+        stats = sh.run(
+            shard_by(todo, lambda x: self._bs2bundle.get(x['bitstream_id'], f"bs-{x['bitstream_id']}"), shards),
+            lambda objs, w: self._bitstream_import_objs(
+                objs, env, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections, w))
+        created = sh.id2uuid()
+        for b in todo:
+            b_id = str(b['bitstream_id'])
+            if b_id in created and b_id not in self._id2uuid:
+                self._id2uuid[b_id] = created[b_id]
+        return stats
+
+    def _bitstream_import_objs(self, objs, env, dspace, metadatas, bitstreamformatregistry, bundles, communities,
+                               collections, wal, checksums: bool = True) -> dict:
+        stats = {}
+        test_instance = env["backend"].get("testing", False)
+        path_assetstore = env["assetstore"]
+        for i, b in enumerate(progress_bar(objs)):
             # do bitstream checksum
             # do this after every 500 imported bitstreams,
             # because the server may be out of memory
-            if (i + 1) % 500 == 0:
+            if checksums and (i + 1) % 500 == 0:
                 try:
                     dspace.add_checksums()
                 except Exception as e:
                     _logger.error(f'add_checksums failed: [{str(e)}]')
 
-            data = {}
-            b_meta = metadatas.filter_res_d(metadatas.value(
-                bitstreams.TYPE, b_id, log_missing=b_deleted is False), self.ignored_fields)
-            if b_meta is not None:
-                data['metadata'] = b_meta
-            else:
-                com_logo = b_id in communities.logos.values()
-                col_logo = b_id in collections.logos.values()
-                if b_deleted or com_logo or col_logo:
-                    log_fnc = _logger.debug
-                else:
-                    log_fnc = _logger.warning
-                log_fnc(
-                    f'No metadata for bitstream [{b_id}] deleted: [{b_deleted}] com logo:[{com_logo}] col logo:[{col_logo}]')
-
-            data['sizeBytes'] = b['size_bytes']
-            data['checkSum'] = {
-                'checkSumAlgorithm': b['checksum_algorithm'],
-                'value': b['checksum']
-            }
-
-            if not b['bitstream_format_id']:
-                unknown_id = bitstreamformatregistry.unknown_format_id
-                _logger.info(f'Using unknown format for bitstream {b_id}')
-                b['bitstream_format_id'] = unknown_id
-
-            bformat_mimetype = bitstreamformatregistry.mimetype(b['bitstream_format_id'])
-            if bformat_mimetype is None:
-                _logger.critical(f'Bitstream format not found for [{b_id}]')
+            with span("bitstream", v5_id=b['bitstream_id']):
+                res = self._bitstream_import_one(
+                    b, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections, wal,
+                    test_instance, path_assetstore)
+            if res is not None:
+                stats[res] = stats.get(res, 0) + 1
 
-            params = {
-                'internal_id': b['internal_id'],
-                'storeNumber': b['store_number'],
-                'bitstreamFormat': bformat_mimetype,
-                'deleted': b['deleted'],
-                'sequenceId': b['sequence_id'],
-                'bundle_id': None,
-                'primaryBundle_id': None
-            }
-
-            path = self.bitstream_path(params['internal_id'])
-            full_path = os.path.join(path_assetstore, path)
-            # NOTE: if it is the testing instance AND we do not have the bitstream
-            # use our testing one
-            if test_instance and not os.path.exists(full_path):
-                data['sizeBytes'] = 1748
-                data['checkSum'] = {
-                    'checkSumAlgorithm': b['checksum_algorithm'],
-                    'value': 'bb9bdc0b3349e4284e09149f943790b4'
-                }
-                params['internal_id'] = '57024294293009067626820405177604023574'
-
-            # if bitstream has bundle, set bundle_id from None to id
-            if b_id in self._bs2bundle:
-                bundle_int_id = self._bs2bundle[b_id]
-                params['bundle_id'] = bundles.uuid(bundle_int_id)
-
-            # if bitstream is primary bitstream of some bundle,
-            # set primaryBundle_id from None to id
-            if b_id in bundles.primary:
-                params['primaryBundle_id'] = bundles.uuid(bundles.primary[b_id])
-            try:
-                resp = dspace.put_bitstream(params, data)
-                self._id2uuid[str(b_id)] = resp['id']
-                self._imported["bitstream"] += 1
-                if b['deleted']:
-                    logging.warning(f'Imported bitstream is deleted! UUID: {resp["id"]}')
-            except Exception as e:
-                _logger.error(f'put_bitstream [{b_id}]: failed. Exception: [{str(e)}]')
+        if not checksums:
+            return stats
 
         # do bitstream checksum for the last imported bitstreams
         # these bitstreams can be less than 500, so it is not calculated in a loop
@@ -260,7 +261,146 @@ class bitstreams:
         except Exception as e:
             _logger.error(f'add_checksums failed: [{str(e)}]')
 
-        log_after_import(log_key, expected, self.imported)
+        return stats
+
+    def bundle_id(self, b_id: int):
+        return self._bs2bundle.get(b_id, None)
+
+    def bundled_bitstreams(self) -> list:
+        """
+            Bitstreams stored in some bundle (i.e., not logos).
+        """
+        return [b for b in self._bs if b['bitstream_id'] in self._bs2bundle]
+
+    def bundle_bitstreams(self, bundle_id: int) -> list:
+        if self._bundle2bs_objs is None:
+            id2bs = {b['bitstream_id']: b for b in self._bs}
+            self._bundle2bs_objs = {}
+            for e in self._bundle2bs:
+                b = id2bs.get(e['bitstream_id'], None)
+                if b is not None:
+                    self._bundle2bs_objs.setdefault(e['bundle_id'], []).append(b)
+        return self._bundle2bs_objs.get(int(bundle_id), [])
+
+    def import_bundles(self, bundle_ids: list, env, dspace, metadatas, bitstreamformatregistry, bundles,
+                       communities, collections, wal=None) -> list:
+        """
+            Import bitstreams of the listed bundles, checksums are not computed.
+            @return: ids of the bitstreams which exist in v7
+        """
+        wal = ensure_wal(wal)
+        test_instance = env["backend"].get("testing", False)
+        path_assetstore = env["assetstore"]
+        res = []
+        for bundle_id in bundle_ids:
+            for b in self.bundle_bitstreams(bundle_id):
+                with span("bitstream", v5_id=b['bitstream_id']):
+                    st = self._bitstream_import_one(
+                        b, dspace, metadatas, bitstreamformatregistry, bundles, communities, collections, wal,
+                        test_instance, path_assetstore)
+                if st == "imported":
+                    self._imported["bitstream"] += 1
+                if st != "error":
+                    res.append(b['bitstream_id'])
+        return res
+
+    def _bitstream_import_one(self, b, dspace, metadatas, bitstreamformatregistry, bundles, communities,
+                              collections, wal, test_instance, path_assetstore):
+        """
+            Import one bitstream.
+            @return: "imported", "error" or None if already done
+        """
+        b_id = b['bitstream_id']
+        if wal.done("bitstream", b_id):
+            # created in the previous run, its policies need the uuid
+            if str(b_id) not in self._id2uuid:
+                self._id2uuid[str(b_id)] = wal.get("bitstream", b_id)["uuid"]
+                self._imported["bitstream"] += 1
+            return None
+
+        params, data = self.bitstream_payload(
+            b, metadatas, bitstreamformatregistry, bundles, communities, collections, test_instance, path_assetstore)
+        try:
+            resp = dspace.put_bitstream(params, data)
+            self._id2uuid[str(b_id)] = resp['id']
+            wal.append("bitstream", b_id, resp['id'])
+            if b['deleted']:
+                logging.warning(f'Imported bitstream is deleted! UUID: {resp["id"]}')
+            return "imported"
+        except Exception as e:
+            _logger.error(f'put_bitstream [{b_id}]: failed. Exception: [{str(e)}]')
+        return "error"
+
+    def bitstream_payload(self, b, metadatas, bitstreamformatregistry, bundles, communities, collections,
+                          test_instance, path_assetstore):
+        """
+            Build `put_bitstream` request.
+            @return: (params, data)
+        """
+        b_id = b['bitstream_id']
+        b_deleted = b['deleted']
+        data = {}
+        b_meta = metadatas.filter_res_d(metadatas.value(
+            bitstreams.TYPE, b_id, log_missing=b_deleted is False), self.ignored_fields)
+        if b_meta is not None:
+            data['metadata'] = b_meta
+        else:
+            com_logo = b_id in communities.logos.values()
+            col_logo = b_id in collections.logos.values()
+            if b_deleted or com_logo or col_logo:
+                log_fnc = _logger.debug
+            else:
+                log_fnc = _logger.warning
+            log_fnc(
+                f'No metadata for bitstream [{b_id}] deleted: [{b_deleted}] com logo:[{com_logo}] col logo:[{col_logo}]')
+
+        data['sizeBytes'] = b['size_bytes']
+        data['checkSum'] = {
+            'checkSumAlgorithm': b['checksum_algorithm'],
+            'value': b['checksum']
+        }
+
+        if not b['bitstream_format_id']:
+            unknown_id = bitstreamformatregistry.unknown_format_id
+            _logger.info(f'Using unknown format for bitstream {b_id}')
+            b['bitstream_format_id'] = unknown_id
+
+        bformat_mimetype = bitstreamformatregistry.mimetype(b['bitstream_format_id'])
+        if bformat_mimetype is None:
+            _logger.critical(f'Bitstream format not found for [{b_id}]')
+
+        params = {
+            'internal_id': b['internal_id'],
+            'storeNumber': b['store_number'],
+            'bitstreamFormat': bformat_mimetype,
+            'deleted': b['deleted'],
+            'sequenceId': b['sequence_id'],
+            'bundle_id': None,
+            'primaryBundle_id': None
+        }
+
+        path = self.bitstream_path(params['internal_id'])
+        full_path = os.path.join(path_assetstore, path)
+        # NOTE: if it is the testing instance AND we do not have the bitstream
+        # use our testing one
+        if test_instance and not os.path.exists(full_path):
+            data['sizeBytes'] = 1748
+            data['checkSum'] = {
+                'checkSumAlgorithm': b['checksum_algorithm'],
+                'value': 'bb9bdc0b3349e4284e09149f943790b4'
+            }
+            params['internal_id'] = '57024294293009067626820405177604023574'
+
+        # if bitstream has bundle, set bundle_id from None to id
+        if b_id in self._bs2bundle:
+            bundle_int_id = self._bs2bundle[b_id]
+            params['bundle_id'] = bundles.uuid(bundle_int_id)
+
+        # if bitstream is primary bitstream of some bundle,
+        # set primaryBundle_id from None to id
+        if b_id in bundles.primary:
+            params['primaryBundle_id'] = bundles.uuid(bundles.primary[b_id])
+        return params, data
 
     # =============
 
@@ -268,7 +408,7 @@ class bitstreams:
         data = {
             "bs": self._bs,
             "bundle2bs": self._bundle2bs,
-            "id2uuid": self._id2uuid,
+            "id2uuid": self._id2uuid.to_dict(),
             "imported": self._imported,
             "done": self._done,
         }
@@ -278,6 +418,8 @@ class bitstreams:
         data = deserialize(file_str)
         self._bs = data["bs"]
         self._bundle2bs = data["bundle2bs"]
-        self._id2uuid = data["id2uuid"]
+        self._bundle2bs_objs = None
+        self._bs2bundle = self._index()
+        self._id2uuid = idmap(data["id2uuid"])
         self._imported = data["imported"]
         self._done = data["done"]
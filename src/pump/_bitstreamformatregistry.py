@@ -45,7 +45,6 @@ class bitstreamformatregistry:
         return len(self._reg or {})
 
     def uuid(self, f_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid.get(str(f_id), None)
 
     def mimetype(self, f_id: str):
@@ -1,5 +1,7 @@
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.bundle")
 
@@ -21,7 +23,9 @@ class bundles:
         self._imported = {
             "bundles": 0,
         }
-        self._id2uuid = {}
+        self._id2uuid = idmap()
+        self._itemid2bundle = {}
+        self._primary = {}
 
         if not self._item2bundle:
             _logger.info(f"Empty input: [{item2bundle_file_str}].")
@@ -30,12 +34,15 @@ class bundles:
             _logger.info(f"Empty input: [{bundle_file_str}].")
             return
 
+        self._index()
+
+    def _index(self):
         self._itemid2bundle = {}
-        for e in self._item2bundle:
+        self._primary = {}
+        for e in self._item2bundle or []:
             self._itemid2bundle.setdefault(e['item_id'], []).append(e['bundle_id'])
 
-        self._primary = {}
-        for b in self._bundles:
+        for b in self._bundles or []:
             primary_id = b['primary_bitstream_id']
             if primary_id:
                 self._primary[primary_id] = b['bundle_id']
@@ -43,8 +50,11 @@ class bundles:
     def __len__(self):
         return len(self._bundles or {})
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, b_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid.get(str(b_id), None)
 
     @property
@@ -56,40 +66,74 @@ class bundles:
         return self._imported['bundles']
 
     @time_method
-    def import_to(self, dspace, metadatas, items):
+    def import_to(self, dspace, metadatas, items, wal=None):
         expected = len(self)
         log_key = "bundles"
         log_before_import(log_key, expected)
 
-        for item_id, bundle_arr in progress_bar(self._itemid2bundle.items()):
-            for bundle_id in bundle_arr:
-                data = {}
-                meta_bundle = metadatas.value(bundles.TYPE, bundle_id)
-                if meta_bundle:
-                    data['metadata'] = meta_bundle
-                    data['name'] = meta_bundle['dc.title'][0]['value']
-
-                try:
-                    item_uuid = items.uuid(item_id)
-                    if item_uuid is None:
-                        _logger.critical(f'Item UUID not found for [{item_id}]')
-                        continue
-                    resp = dspace.put_bundle(item_uuid, data)
-                    self._id2uuid[str(bundle_id)] = resp['uuid']
-                    self._imported["bundles"] += 1
-                except Exception as e:
-                    _logger.error(f'put_bundle: [{item_id}] failed [{str(e)}]')
+        wal = ensure_wal(wal)
+        self._imported["bundles"] += wal.replay_into("bundle", self._id2uuid)
+
+        for item_id in progress_bar(list(self._itemid2bundle.keys())):
+            self.import_item(item_id, dspace, metadatas, items, wal)
 
         log_after_import(log_key, expected, self.imported)
 
+    def items_with_bundles(self):
+        return self._itemid2bundle.keys()
+
+    def item_bundles(self, item_id: int) -> list:
+        return self._itemid2bundle.get(int(item_id), [])
+
+    def import_item(self, item_id: int, dspace, metadatas, items, wal=None) -> list:
+        """
+            Import bundles of one item.
+            @return: ids of the item bundles which exist in v7
+        """
+        wal = ensure_wal(wal)
+        res = []
+        for bundle_id in self.item_bundles(item_id):
+            if wal.done("bundle", bundle_id):
+                # created in the previous run, its bitstreams and policies need the uuid
+                if str(bundle_id) not in self._id2uuid:
+                    self._id2uuid[str(bundle_id)] = wal.get("bundle", bundle_id)["uuid"]
+                    self._imported["bundles"] += 1
+                res.append(bundle_id)
+                continue
+            data = self.bundle_payload(bundle_id, metadatas)
+            try:
+                item_uuid = items.uuid(item_id)
+                if item_uuid is None:
+                    _logger.critical(f'Item UUID not found for [{item_id}]')
+                    continue
+                resp = dspace.put_bundle(item_uuid, data)
+                self._id2uuid[str(bundle_id)] = resp['uuid']
+                self._imported["bundles"] += 1
+                wal.append("bundle", bundle_id, resp['uuid'])
+                res.append(bundle_id)
+            except Exception as e:
+                _logger.error(f'put_bundle: [{item_id}] failed [{str(e)}]')
+        return res
+
+    def bundle_payload(self, bundle_id: int, metadatas) -> dict:
+        """
+            Build `put_bundle` request data.
+        """
+        data = {}
+        meta_bundle = metadatas.value(bundles.TYPE, bundle_id)
+        if meta_bundle:
+            data['metadata'] = meta_bundle
+            data['name'] = meta_bundle['dc.title'][0]['value']
+        return data
+
     # =============
 
     def serialize(self, file_str: str):
-        # not needed _itemid2bundle, _primary
+        # _itemid2bundle, _primary are rebuilt in deserialize
         data = {
             "bundles": self._bundles,
             "item2bundle": self._item2bundle,
-            "id2uuid": self._id2uuid,
+            "id2uuid": self._id2uuid.to_dict(),
             "imported": self._imported,
         }
         serialize(file_str, data)
@@ -98,5 +142,6 @@ class bundles:
         data = deserialize(file_str)
         self._bundles = data["bundles"]
         self._item2bundle = data["item2bundle"]
-        self._id2uuid = data["id2uuid"]
+        self._id2uuid = idmap(data["id2uuid"])
         self._imported = data["imported"]
+        self._index()
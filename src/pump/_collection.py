@@ -2,6 +2,8 @@ import logging
 import re
 from ._group import groups
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.collection")
 
@@ -31,7 +33,7 @@ class collections:
             "group": 0,
         }
         self._metadata_values = read_json(metadata_file_str) or []
-        self._id2uuid = {}
+        self._id2uuid = idmap()
 
         self._logos = {}
         self._groups_id2uuid = {}
@@ -61,8 +63,11 @@ class collections:
     def __len__(self):
         return len(self._col or {})
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, com_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid.get(str(com_id), None)
 
     def group_uuid(self, g_id: int):
@@ -89,17 +94,37 @@ class collections:
     def groups_uuid2type(self):
         return self._groups_uuid2type
 
+    def _add_group(self, g_id, g_uuid, g_type=None):
+        self._groups_id2uuid.setdefault(str(g_id), []).append(g_uuid)
+        self._imported["group"] += 1
+        if g_type is not None:
+            self._groups_uuid2type[g_uuid] = g_type
+
     @time_method
-    def import_to(self, dspace, handles, metadatas, coms):
+    def import_to(self, dspace, handles, metadatas, coms, wal=None):
         expected = len(self)
         log_key = "collections"
         log_before_import(log_key, expected)
 
         coll2com = {x['collection_id']: x['community_id'] for x in self._com2col}
 
+        wal = ensure_wal(wal)
+
         for col in progress_bar(self._col):
             col_id = col['collection_id']
 
+            # replay collection created before the crash
+            rec = wal.get("collection", col_id)
+            if rec is not None:
+                if str(col_id) not in self._id2uuid:
+                    self._id2uuid[str(col_id)] = rec["uuid"]
+                    self._imported["col"] += 1
+                    for g_id, g_uuid, g_type in rec["x"]["groups"]:
+                        self._add_group(g_id, g_uuid, g_type)
+                if col['logo_bitstream_id'] is not None:
+                    self._logos[str(col_id)] = col["logo_bitstream_id"]
+                continue
+
             data = {}
             meta_col = metadatas.value(collections.TYPE, col_id)
             data['metadata'] = meta_col
@@ -132,12 +157,15 @@ class collections:
             # greate group
             # template_item_id, workflow_step_1, workflow_step_3, admin are not implemented,
             # because they are null in all data
+            # created groups are stored in WAL together with the collection
+            created_groups = []
             ws2 = col['workflow_step_2']
             if ws2:
                 try:
                     resp = dspace.put_collection_editor_group(col_uuid)
                     self._groups_id2uuid[str(ws2)] = [resp['id']]
                     self._imported["group"] += 1
+                    created_groups.append((ws2, resp['id'], None))
                 except Exception as e:
                     _logger.error(
                         f'put_collection_editor_group: [{col_id}] failed [{str(e)}]')
@@ -148,6 +176,7 @@ class collections:
                     resp = dspace.put_collection_submitter(col_uuid)
                     self._groups_id2uuid[str(subm)] = [resp['id']]
                     self._imported["group"] += 1
+                    created_groups.append((subm, resp['id'], None))
                 except Exception as e:
                     _logger.error(
                         f'put_collection_submitter: [{col_id}] failed [{str(e)}]')
@@ -156,29 +185,29 @@ class collections:
                 group_col = self._col2group[col_id]
                 try:
                     resp = dspace.put_collection_bitstream_read_group(col_uuid)
-                    self._groups_id2uuid.setdefault(str(group_col), []).append(resp['id'])
-                    self._imported["group"] += 1
-                    self._groups_uuid2type[resp['id']] = collections.BITSTREAM
+                    self._add_group(group_col, resp['id'], collections.BITSTREAM)
+                    created_groups.append((group_col, resp['id'], collections.BITSTREAM))
                 except Exception as e:
                     _logger.error(
                         f'put_collection_bitstream_read_group: [{col_id}] failed [{str(e)}]')
 
                 try:
                     resp = dspace.put_collection_item_read_group(col_uuid)
-                    self._groups_id2uuid.setdefault(str(group_col), []).append(resp['id'])
-                    self._imported["group"] += 1
-                    self._groups_uuid2type[resp['id']] = collections.ITEM
+                    self._add_group(group_col, resp['id'], collections.ITEM)
+                    created_groups.append((group_col, resp['id'], collections.ITEM))
                 except Exception as e:
                     _logger.error(
                         f'put_collection_item_read_group: [{col_id}] failed [{str(e)}]')
 
+            wal.append("collection", col_id, col_uuid, groups=created_groups)
+
         log_after_import(log_key, expected, self.imported_cols)
 
     # =============
 
     def serialize(self, file_str: str):
         data = {
-            "id2uuid": self._id2uuid,
+            "id2uuid": self._id2uuid.to_dict(),
             "logos": self._logos,
             "groups_id2uuid": self._groups_id2uuid,
             "imported": self._imported,
@@ -190,7 +219,7 @@ class collections:
         data = deserialize(file_str)
         # TODO(jm): support older cache files
         key = "id2uuid" if "id2uuid" in data else "col_created"
-        self._id2uuid = data[key]
+        self._id2uuid = idmap(data[key])
         self._logos = data["logos"]
         self._groups_id2uuid = data["groups_id2uuid"]
         self._imported = data["imported"]
@@ -1,5 +1,9 @@
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from ._utils import read_json, time_method, serialize, deserialize, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.community")
 
@@ -27,7 +31,7 @@ class communities:
             "com2com": 0,
         }
 
-        self._id2uuid = {}
+        self._id2uuid = idmap()
 
         self._logos = {}
         self._groups = {}
@@ -56,15 +60,21 @@ class communities:
     def imported_groups(self):
         return self._groups
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, com_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid.get(str(com_id), None)
 
     @time_method
-    def import_to(self, dspace, handles, metadata):
+    def import_to(self, dspace, handles, metadata, wal=None, workers: int = 4):
         """
             Import data into database.
             Mapped tables: community, community2community, metadatavalue, handle
+
+            Communities are imported level by level from the top of the tree,
+            communities of one level (and their admin groups) concurrently.
         """
         if len(self) == 0:
             _logger.info("Community JSON is empty.")
@@ -74,107 +84,161 @@ class communities:
         log_key = "communities"
         log_before_import(log_key, expected)
 
-        parents = {}
-        childs = {}
+        # replay communities created before the crash
+        wal = ensure_wal(wal)
+        for com in [x for x in self._com if wal.done("community", x['community_id'])]:
+            rec = wal.get("community", com['community_id'])
+            com_id = str(com['community_id'])
+            if com_id not in self._id2uuid:
+                self._id2uuid[com_id] = rec["uuid"]
+                self._imported["com"] += 1
+                admin_group = rec.get("x", {}).get("admin_group", None)
+                if admin_group is not None:
+                    self._groups[str(com['admin'])] = [admin_group]
+                    self._imported["group"] += 1
+            if com['logo_bitstream_id'] is not None:
+                self._logos[com_id] = com["logo_bitstream_id"]
+
+        levels, parent_of = self._levels()
+        lock = threading.Lock()
+        # one pool for all levels, every thread logs in to the REST API once (see `dspace.rest`)
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="community") as pool:
+            for depth, level in enumerate(levels):
+                # parents are in the previous level, which is finished
+                todo = []
+                for com in level:
+                    com_id = com['community_id']
+                    if wal.done("community", com_id):
+                        continue
+                    parent_id = parent_of.get(com_id, None)
+                    parent_uuid = None
+                    if parent_id is not None:
+                        parent_uuid = self.uuid(parent_id)
+                        if parent_uuid is None:
+                            _logger.error(f"Community [{com_id}] skipped, parent [{parent_id}] was not imported")
+                            continue
+                    todo.append((com, parent_uuid))
+                _logger.info(f"Importing [{len(todo)}] communities at depth [{depth}]")
+
+                list(pool.map(lambda x: self._import_one(
+                    x[0], x[1], dspace, handles, metadata, wal, lock), todo))
+
+        log_after_import(log_key, expected, self.imported_coms)
+
+    def _levels(self):
+        """
+            Communities grouped by depth in the tree (parents first) and child id -> parent id.
+            Communities with unknown parent are imported as top level, communities
+            in (or below) a cycle are not imported.
+        """
+        known = {x['community_id'] for x in self._com}
+        parent_of = {}
         for comm2comm in (self._com2com or []):
             parent_id = comm2comm['parent_comm_id']
             child_id = comm2comm['child_comm_id']
-            parents.setdefault(parent_id, []).append(child_id)
-            childs.setdefault(child_id, []).append(parent_id)
-
-        for arr in childs.values():
-            if len(arr) != 1:
-                _logger.critical(f"Strange child array: [{arr}]")
-
-        coms = self._com.copy()
-
-        counter = 0
-
-        i = 0
-        while coms:
-            counter += 1
-
-            if counter > 200:
+            if child_id in parent_of:
                 _logger.critical(
-                    "Very likely in the process of infinite loop because importing to existing db.")
-                break
-
-            data = {}
-            # process community only when:
-            # comm is not parent and child
-            # comm is parent and not child
-            # parent comm exists
-            # else process it later
-            com = coms[i]
-            com_id = com['community_id']
-
-            not_child = com_id not in childs
-            not_child_nor_parent = (com_id not in parents and not_child)
-            com_child = childs[com_id][0] if com_id in childs else None
-            com_child_uuid = self.uuid(com_child)
-            if not_child_nor_parent or not_child or com_child_uuid is not None:
-
-                # resource_type_id for community is 4
-                handle_com = handles.get(communities.TYPE, com_id)
-                if handle_com is None:
-                    _logger.critical(f"Cannot find handle for com [{com_id}]")
-                    continue
-
-                data['handle'] = handle_com
-
-                metadata_com = metadata.value(communities.TYPE, com_id)
-
-                if metadata_com:
-                    data['metadata'] = metadata_com
-
-                # create community
-                parent_d = None
-                if com_id in childs:
-                    parent_d = {'parent': self.uuid(com_child)}
-
-                try:
-                    new_com_id = dspace.put_community(parent_d, data)
-                    # error
-                    if new_com_id is None:
-                        i += 1
-                        if i == len(coms):
-                            i = 0
-                        continue
-                    # make sure the indices are str
-                    self._id2uuid[str(com_id)] = new_com_id['id']
-                    self._imported["com"] += 1
-                except Exception as e:
-                    _logger.error(
-                        f'put_community: [{com_id}] failed. Exception: [{str(e)}]')
-                    continue
-
-                # add to community2logo, if community has logo
-                if com['logo_bitstream_id'] is not None:
-                    self._logos[str(com_id)] = com["logo_bitstream_id"]
-
-                # create admingroup
-                if com['admin'] is not None:
-                    try:
-                        resp = dspace.put_community_admin_group(new_com_id['id'])
-                        self._groups[str(com['admin'])] = [resp['id']]
-                        self._imported["group"] += 1
-                    except Exception as e:
-                        _logger.error(
-                            f'put_community_admin_group: [{new_com_id["id"]}] failed. Exception: [{str(e)}]')
-                del coms[i]
+                    f"Community [{child_id}] has more parents [{parent_of[child_id]}, {parent_id}], "
+                    f"using the first one")
+                continue
+            parent_of[child_id] = parent_id
+
+        for child_id, parent_id in list(parent_of.items()):
+            if parent_id not in known:
+                _logger.warning(
+                    f"Community [{child_id}] has unknown parent [{parent_id}], importing it as top level")
+                del parent_of[child_id]
+
+        depth = {}
+        cycle = set()
+        for com_id in known:
+            path = []
+            cur = com_id
+            while cur is not None and cur not in depth and cur not in cycle and cur not in path:
+                path.append(cur)
+                cur = parent_of.get(cur, None)
+            if cur is None:
+                d = -1
+            elif cur in depth:
+                d = depth[cur]
             else:
-                i += 1
-
-            if i == len(coms):
-                i = 0
-
-        log_after_import(log_key, expected, self.imported_coms)
+                if cur in path:
+                    _logger.critical(f"Cyclic community hierarchy: {path[path.index(cur):]}")
+                cycle.update(path)
+                continue
+            for x in reversed(path):
+                d += 1
+                depth[x] = d
+
+        if len(cycle) > 0:
+            _logger.critical(f"Communities in or below a cycle are not imported: {sorted(cycle)}")
+
+        levels = [[] for _1 in range(max(depth.values(), default=-1) + 1)]
+        for com in self._com:
+            if com['community_id'] in depth:
+                levels[depth[com['community_id']]].append(com)
+        return levels, parent_of
+
+    def _import_one(self, com: dict, parent_uuid, dspace, handles, metadata, wal, lock) -> bool:
+        com_id = com['community_id']
+        data = {}
+        # resource_type_id for community is 4
+        handle_com = handles.get(communities.TYPE, com_id)
+        if handle_com is None:
+            _logger.critical(f"Cannot find handle for com [{com_id}]")
+            return False
+
+        data['handle'] = handle_com
+
+        metadata_com = metadata.value(communities.TYPE, com_id)
+
+        if metadata_com:
+            data['metadata'] = metadata_com
+
+        # create community
+        parent_d = None
+        if parent_uuid is not None:
+            parent_d = {'parent': parent_uuid}
+
+        try:
+            new_com_id = dspace.put_community(parent_d, data)
+            # error
+            if new_com_id is None:
+                _logger.error(f'put_community: [{com_id}] failed.')
+                return False
+        except Exception as e:
+            _logger.error(
+                f'put_community: [{com_id}] failed. Exception: [{str(e)}]')
+            return False
+
+        # create admingroup
+        admin_group = None
+        if com['admin'] is not None:
+            try:
+                resp = dspace.put_community_admin_group(new_com_id['id'])
+                admin_group = resp['id']
+            except Exception as e:
+                _logger.error(
+                    f'put_community_admin_group: [{new_com_id["id"]}] failed. Exception: [{str(e)}]')
+
+        with lock:
+            # make sure the indices are str
+            self._id2uuid[str(com_id)] = new_com_id['id']
+            self._imported["com"] += 1
+            # add to community2logo, if community has logo
+            if com['logo_bitstream_id'] is not None:
+                self._logos[str(com_id)] = com["logo_bitstream_id"]
+            if admin_group is not None:
+                self._groups[str(com['admin'])] = [admin_group]
+                self._imported["group"] += 1
+        wal.append("community", com_id, new_com_id['id'], admin_group=admin_group)
+        return True
 
     # =============
 
     def serialize(self, file_str: str):
         data = {
-            "com_created": self._id2uuid,
+            "com_created": self._id2uuid.to_dict(),
             "logos": self._logos,
             "groups": self._groups,
             "imported": self._imported,
@@ -183,7 +247,7 @@ class communities:
 
     def deserialize(self, file_str: str):
         data = deserialize(file_str)
-        self._id2uuid = data["com_created"]
+        self._id2uuid = idmap(data["com_created"])
         self._logos = data["logos"]
         self._groups = data["groups"]
         self._imported = data["imported"]
@@ -1,26 +1,74 @@
 import os
 import sys
+import json
+import queue
 import logging
+import weakref
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time as time_fnc
+
+from ._perf import sql_statements
+from ._pushdown import pushdown as pushdown_sql
+from ._sampling import sampler
 _logger = logging.getLogger("pump.db")
 
 
+# all `conn` objects, forked processes (shards) must not use connections of the parent
+_conns = weakref.WeakSet()
+# connections inherited from the parent, kept referenced so that they are never closed in the child
+_inherited = []
+
+
 class conn:
+    """
+        Connection to a database, every thread uses its own psycopg2 connection
+        (and cursor) so that instances can be shared by concurrently running phases.
+        A forked child process opens new connections.
+    """
+
     def __init__(self, env):
         self.name = env["name"]
         self.host = env["host"]
         self.user = env["user"]
         self.port = env.get("port", 5432)
         self.password = env["password"]
-        self._conn = None
-        self._cursor = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        _conns.add(self)
+
+    @staticmethod
+    def _after_fork():
+        # closing the inherited connections would terminate the sessions of the parent
+        for c in list(_conns):
+            _inherited.extend(c._all)
+            c._local = threading.local()
+            c._lock = threading.Lock()
+            c._all = []
+
+    @property
+    def _conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is not None and c.closed:
+            return None
+        return c
+
+    @property
+    def _cursor(self):
+        return getattr(self._local, "cursor", None)
 
     def connect(self):
         if self._conn is not None:
             return
 
         import psycopg2  # noqa
-        self._conn = psycopg2.connect(
+        c = psycopg2.connect(
             database=self.name, host=self.host, port=self.port, user=self.user, password=self.password)
+        self._local.conn = c
+        with self._lock:
+            self._all.append(c)
         _logger.debug(f"Connection to database [{self.name}] successful!")
 
     def __del__(self):
@@ -28,21 +76,58 @@ class conn:
 
     def __enter__(self):
         self.connect()
-        self._cursor = self._conn.cursor()
+        self._local.cursor = self._conn.cursor()
         return self._cursor
 
     def __exit__(self, exc_type, exc_value, traceback):
         if exc_type is not None:
             _logger.critical(
                 f"An exception of type {exc_type} occurred with message: {exc_value}")
+            # the connection stays usable
+            self._conn.rollback()
             return
         self._conn.commit()
         return self._cursor.close()
 
     def close(self):
-        if self._conn:
-            self._conn.close()
-            self._conn = None
+        with self._lock:
+            arr, self._all = self._all, []
+        for c in arr:
+            c.close()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=conn._after_fork)
+
+
+class _statement:
+    """
+        One executed SQL statement, counted and passed to `db` listeners.
+    """
+
+    def __init__(self, sql: str):
+        sql_statements.inc()
+        self._sql = sql
+        self._tokens = None
+        self.rows = None
+
+    def __enter__(self):
+        if len(db.listeners) > 0:
+            self._tokens = []
+            for listener in db.listeners:
+                try:
+                    self._tokens.append((listener, listener.statement_start(self._sql)))
+                except Exception as e:
+                    _logger.error(f"Statement listener [{type(listener).__name__}] failed: [{str(e)}]")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for listener, token in self._tokens or []:
+            try:
+                listener.statement_end(token, self.rows, exc_value)
+            except Exception as e:
+                _logger.error(f"Statement listener [{type(listener).__name__}] failed: [{str(e)}]")
+        return False
 
 
 class db:
@@ -50,23 +135,66 @@ class db:
         TODO(jm): working but should be refactored, with semantics
     """
 
+    # listeners of statements executed by all instances,
+    # `statement_start(sql)` returns a token passed to `statement_end(token, rows, error)`
+    listeners = []
+
     def __init__(self, env: dict):
+        self._env = env
         self._conn = conn(env)
 
+    @staticmethod
+    def add_listener(listener):
+        db.listeners.append(listener)
+
+    @staticmethod
+    def remove_listener(listener):
+        if listener in db.listeners:
+            db.listeners.remove(listener)
+
+    def close(self):
+        self._conn.close()
+
+    def copy(self):
+        """
+            New object with its own connection to the same database.
+        """
+        return db(self._env)
+
     # =============
 
     def fetch_all(self, sql: str, col_names: list = None):
-        with self._conn as cursor:
+        with self._conn as cursor, _statement(sql) as st:
             cursor.execute(sql)
             arr = cursor.fetchall()
+            st.rows = len(arr)
             if col_names is not None:
                 col_names += [x[0] for x in cursor.description]
             return arr
 
+    def fetch_iter(self, sql: str, batch: int = 10000):
+        """
+            Iterate rows using a server side cursor, the result is not kept in memory.
+        """
+        self._conn.connect()
+        cursor = self._conn._conn.cursor(name=f"fetch_iter_{id(self)}")
+        cursor.itersize = batch
+        try:
+            with _statement(sql) as st:
+                cursor.execute(sql)
+                st.rows = 0
+                for row in cursor:
+                    st.rows += 1
+                    yield row
+        finally:
+            cursor.close()
+            self._conn._conn.commit()
+
     def fetch_one(self, sql: str):
-        with self._conn as cursor:
+        with self._conn as cursor, _statement(sql) as st:
             cursor.execute(sql)
             res = cursor.fetchone()
+            st.rows = 0 if res is None else 1
             if res is None:
                 return None
 
@@ -77,7 +205,9 @@ class db:
             sql_lines = [x.strip()
                          for x in (sql_text or "").splitlines() if x.strip()]
             for sql in sql_lines:
-                cursor.execute(sql)
+                with _statement(sql) as st:
+                    cursor.execute(sql)
+                    st.rows = cursor.rowcount
             return
 
     # =============
@@ -87,8 +217,9 @@ class db:
             expected = self.fetch_one("SELECT COUNT(*) from public.resourcepolicy")
 
             # delete all data
-            cursor.execute("DELETE FROM public.resourcepolicy")
-            deleted = cursor.rowcount
+            with _statement("DELETE FROM public.resourcepolicy") as st:
+                cursor.execute("DELETE FROM public.resourcepolicy")
+                st.rows = deleted = cursor.rowcount
 
         # control, if we deleted all data
         if expected != deleted:
@@ -96,6 +227,29 @@ class db:
                 f"Did not remove all entries from resourcepolicy table. Expected: {expected}, deleted: {deleted}")
             sys.exit(1)
 
+    def delete_resource_policy_of(self, uuids: list):
+        """
+            Delete resource policies of the listed dspace objects.
+        """
+        if len(uuids or []) == 0:
+            return 0
+        sql = "DELETE FROM public.resourcepolicy WHERE dspace_object = ANY(%s::uuid[])"
+        with self._conn as cursor, _statement(sql) as st:
+            cursor.execute(sql, (list(uuids),))
+            st.rows = cursor.rowcount
+            return cursor.rowcount
+
+    def delete_resource_policy_except(self, uuids: list):
+        """
+            Delete resource policies of all dspace objects except the listed ones.
+        """
+        sql = "DELETE FROM public.resourcepolicy WHERE dspace_object IS NULL OR " \
+              "NOT (dspace_object = ANY(%s::uuid[]))"
+        with self._conn as cursor, _statement(sql) as st:
+            cursor.execute(sql, (list(uuids or []),))
+            st.rows = cursor.rowcount
+            return cursor.rowcount
+
     def get_admin_uuid(self, username):
         """
             Get uuid of the admin user
@@ -154,6 +308,38 @@ class db:
         _logger.info(40 * "=")
 
 
+class _pool:
+    """
+        Connections to one database used by concurrent queries, the first one is the given `db`.
+    """
+
+    def __init__(self, db_obj, size: int):
+        self._db = db_obj
+        self._size = max(1, size)
+        self._free = queue.Queue()
+        self._free.put(db_obj)
+        self._created = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._created) + 1 < self._size:
+                self._created.append(self._db.copy())
+                return self._created[-1]
+        return self._free.get()
+
+    def put(self, db_obj):
+        self._free.put(db_obj)
+
+    def close(self):
+        for x in self._created:
+            x.close()
+
+
 class tester:
     """
         A class for running tests by comparing two parts, processing them based on their type.
@@ -172,9 +358,14 @@ class tester:
                 ["sql", [DATABASE -> dspace5, utilities5, db7], [FETCH -> one, all], [SELECT QUERY]]
             For "val":
                 ["val", [VALUE]]
+
+        All parts are collected first, identical queries are run only once and distinct queries
+        run concurrently (`workers` connections per database), then the comparisons are evaluated
+        in the order of tests. If `report_file` is set, JSON pass/fail report with timings is stored.
     """
 
-    def __init__(self, raw_db_dspace_5, raw_db_utilities_5, raw_db_7, repo=None):
+    def __init__(self, raw_db_dspace_5, raw_db_utilities_5, raw_db_7, repo=None,
+                 workers: int = 4, report_file: str = None):
         """
             Repo object might be needed by `"process":` to be able to compare values.
         """
@@ -182,6 +373,9 @@ class tester:
         self.raw_db_utilities_5 = raw_db_utilities_5
         self.raw_db_7 = raw_db_7
         self._repo = repo
+        self._workers = max(1, workers)
+        self._report_file = report_file
+        self.report = None
 
     @staticmethod
     def get_list_val(part: list, pos: int):
@@ -197,6 +391,31 @@ class tester:
         _logger.error(f"Test [{test_n}] [{part_type}]: {msg}")
         return []
 
+    def query_key(self, test_n: str, part: list, part_type: str):
+        """
+            (db type, fetch type, sql) of a valid sql part, None otherwise (errors are logged).
+        """
+        db_type = self.get_list_val(part, 1)
+        if db_type not in ("dspace5", "utilities5", "db7"):
+            self.log_error("Invalid db!", test_n, part_type)
+            return None
+        sql = self.get_list_val(part, 3)
+        if not sql:
+            self.log_error("Invalid sql!", test_n, part_type)
+            return None
+        fetch_type = self.get_list_val(part, 2)
+        if fetch_type not in ("one", "all"):
+            self.log_error("Invalid fetch option!", test_n, part_type)
+            return None
+        return db_type, fetch_type, sql
+
+    def _dbs(self):
+        return {
+            "dspace5": self.raw_db_dspace_5,
+            "utilities5": self.raw_db_utilities_5,
+            "db7": self.raw_db_7
+        }
+
     def process(self, test_n: str, part: list, part_type: str):
         """
             Processes a test part based on its type.
@@ -206,30 +425,17 @@ class tester:
         part_val = self.get_list_val(part, 0)
 
         if part_val == "sql":
-            db_type = self.get_list_val(part, 1)
-            db = {
-                "dspace5": self.raw_db_dspace_5,
-                "utilities5": self.raw_db_utilities_5,
-                "db7": self.raw_db_7
-            }.get(db_type)
-
-            if not db:
-                self.log_error("Invalid db!", test_n, part_type)
+            key = self.query_key(test_n, part, part_type)
+            if key is None:
                 return
-
-            sql = self.get_list_val(part, 3)
-            if sql:
-                fetch_type = self.get_list_val(part, 2)
-                if fetch_type == "one":
-                    return db.fetch_one(sql)
-                elif fetch_type == "all":
-                    return db.fetch_all(sql, self.get_list_val(part, 4))
-                else:
-                    self.log_error("Invalid fetch option!", test_n, part_type)
-                    return
-            else:
-                self.log_error("Invalid sql!", test_n, part_type)
+            db_type, fetch_type, sql = key
+            db_obj = self._dbs().get(db_type)
+            if not db_obj:
+                self.log_error("Invalid db!", test_n, part_type)
                 return
+            if fetch_type == "one":
+                return db_obj.fetch_one(sql)
+            return db_obj.fetch_all(sql, self.get_list_val(part, 4))
 
         elif part_val == "val":
             return self.get_list_val(part, 1)
@@ -237,38 +443,136 @@ class tester:
         self.log_error("Invalid type!", test_n, part_type)
         return
 
+    # =============
+
+    def _run_queries(self, keys: list) -> dict:
+        """
+            key -> (values, column names, error, took) of distinct queries run concurrently.
+        """
+        pools = {k: _pool(v, self._workers) for k, v in self._dbs().items() if v is not None}
+
+        def run(key):
+            db_type, fetch_type, sql = key
+            pool = pools.get(db_type, None)
+            if pool is None:
+                return key, (None, None, "Invalid db!", 0.)
+            db_obj = pool.get()
+            start = time_fnc()
+            try:
+                cols = []
+                vals = db_obj.fetch_one(sql) if fetch_type == "one" else db_obj.fetch_all(sql, cols)
+                return key, (vals, cols, None, time_fnc() - start)
+            except Exception as e:
+                return key, (None, None, str(e), time_fnc() - start)
+            finally:
+                pool.put(db_obj)
+
+        # e.g., log capture of the validation job is kept in the query threads
+        ctx = contextvars.copy_context()
+        try:
+            workers = self._workers * max(1, len(pools))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tester") as executor:
+                return dict(executor.map(lambda k: ctx.copy().run(run, k), keys))
+        finally:
+            for pool in pools.values():
+                pool.close()
+
     def run_tests(self, tests: list):
         """
         Iterates over a list of test groups and runs each test.
         """
-        for test_group in tests:
-            for test in test_group:
-                self.run_test(test)
+        start = time_fnc()
+        tests = [test for test_group in tests for test in test_group]
+
+        # collect parts
+        parts = []
+        keys = {}
+        for test in tests:
+            test_n = test.get("name", "Test")
+            arr = []
+            for part_type in ("left", "right"):
+                part = test.get(part_type)
+                key = None
+                if part and self.get_list_val(part, 0) == "sql":
+                    key = self.query_key(test_n, part, part_type)
+                    if key is not None:
+                        keys.setdefault(key, None)
+                arr.append(key)
+            parts.append(arr)
+
+        results = self._run_queries(list(keys.keys()))
+        _logger.info(
+            f"Tests: [{len(tests)}], distinct queries: [{len(results)}] of "
+            f"[{sum(1 for arr in parts for x in arr if x is not None)}]")
+
+        report = []
+        for test, arr in zip(tests, parts):
+            report.append(self.run_test(test, [results.get(k, None) if k else None for k in arr]))
+
+        passed = sum(1 for x in report if x["status"] == "passed")
+        self.report = {
+            "tests": report,
+            "passed": passed,
+            "failed": len(report) - passed,
+            "queries": len(results),
+            "took": round(time_fnc() - start, 3),
+        }
+        _logger.info(f"Tests passed: [{passed}], failed: [{len(report) - passed}]")
+        if self._report_file is not None:
+            with open(self._report_file, mode="w", encoding="utf-8") as fout:
+                json.dump(self.report, fout, indent=2, default=str)
+        return self.report
 
-    def run_test(self, test: dict):
+    def _part_val(self, test_n: str, part: list, part_type: str, res):
+        """
+            Value of a part, `res` is the result of its query if it is a valid sql part.
+        """
+        if res is None:
+            return self.process(test_n, part, part_type) if self.get_list_val(part, 0) != "sql" else None
+        vals, cols, err, _1 = res
+        if err is not None:
+            self.log_error(f"Query failed: {err}", test_n, part_type)
+            return None
+        col_names = self.get_list_val(part, 4)
+        if col_names is not None:
+            col_names += cols
+        return vals
+
+    def run_test(self, test: dict, results: list = None):
         """
             Executes a test by comparing its two parts.
             If the comparison is valid, it logs the result as "OK", otherwise "FAILED."
+
+            `results` are the results of left and right queries if they were already run.
         """
         test_n = test.get("name", "Test")
         part_l = test.get("left")
         part_r = test.get("right")
+        res = {"name": test_n, "status": "failed", "took": 0., "left": None, "right": None}
 
         msg = "Incorrect executed part!"
         if not part_l:
             self.log_error(msg, test_n, "left")
-            return
+            return res
         elif not part_r:
             self.log_error(msg, test_n, "right")
-            return
+            return res
 
-        vals_l = self.process(test_n, part_l, "left")
-        vals_r = self.process(test_n, part_r, "right")
+        if results is None:
+            start = time_fnc()
+            vals_l = self.process(test_n, part_l, "left")
+            vals_r = self.process(test_n, part_r, "right")
+            res["took"] = round(time_fnc() - start, 3)
+        else:
+            vals_l = self._part_val(test_n, part_l, "left", results[0])
+            vals_r = self._part_val(test_n, part_r, "right", results[1])
+            res["took"] = round(sum(x[3] for x in results if x is not None), 3)
+        res["left"], res["right"] = vals_l, vals_r
 
         # Error msg is already logged
         if vals_l is None or vals_r is None:
             _logger.error(f"Test [{test_n}]: FAILED")
-            return
+            return res
 
         compare = test.get("compare", "=")
         ok = False
@@ -285,13 +589,38 @@ class tester:
 
         if ok:
             _logger.info(f"Test [{test_n}]: OK")
+            res["status"] = "passed"
         else:
             _logger.error(f"Test [{test_n}]: FAILED")
+        return res
 
 
 class differ:
+    """
+        Compare tables of v5 and v7.
+
+        Mode `rows` downloads the rows of both tables and compares them in Python,
+        mode `hash` compares `compare`, `nonnull` and length-only definitions in SQL:
+        distinct rows of the compared columns are split into ranges by the prefix of their md5,
+        both databases return the count and ordered hash of every range and only mismatching ranges
+        are drilled down (longer prefixes) and finally fetched.
+
+        Mode `sample` compares random samples of v5 rows with v7 through the id -> uuid maps
+        and estimates mismatch rates (see `sampler`), tables without a sampling definition are skipped.
+
+        `sql` definitions with `pushdown` ({"5": pushdown, "7": pushdown}) are normalised
+        in the databases, their `process` is used only if the normalisation cannot run.
+    """
+
+    MODES = ["rows", "hash", "sample"]
 
-    def __init__(self, raw_db_dspace_5, raw_db_utilities_5, raw_db_7, repo=None):
+    # hex digits added to the range prefix in every drill-down step (256 subranges)
+    HASH_STEP = 2
+    # mismatching ranges with at most this many rows are fetched instead of drilled down
+    HASH_FETCH_LIMIT = 1000
+
+    def __init__(self, raw_db_dspace_5, raw_db_utilities_5, raw_db_7, repo=None, mode: str = "rows",
+                 pushdown: bool = True, sample_size: int = 400, sample_seed: int = 0):
         """
             Repo object might be needed by `"process":` to be able to compare values.
         """
@@ -299,6 +628,16 @@ class differ:
         self.raw_db_utilities_5 = raw_db_utilities_5
         self.raw_db_7 = raw_db_7
         self._repo = repo
+        if mode not in differ.MODES:
+            raise ValueError(f"Unknown diff mode [{mode}], use one of {differ.MODES}")
+        self._mode = mode
+        self._pushdown = pushdown
+        self._sample_size = sample_size
+        self._sample_seed = sample_seed
+
+    @property
+    def pushdown(self) -> bool:
+        return self._pushdown
 
     def _fetch_all_vals(self, db5, table_name: str, sql: str = None):
         sql = sql or f"SELECT * FROM {table_name}"
@@ -316,7 +655,8 @@ class differ:
             filtered.append([row[idx] for idx in idxs])
         return filtered
 
-    def _cmp_values(self, table_name: str, vals5, only_in_5, vals7, only_in_7, do_not_show: bool):
+    def _cmp_values(self, table_name: str, vals5, only_in_5, vals7, only_in_7, do_not_show: bool,
+                    counts: tuple = None):
         too_many_5 = ""
         too_many_7 = ""
         LIMIT = 5
@@ -331,9 +671,10 @@ class differ:
             only_in_5 = [x if "@" not in x else "....." for x in only_in_5]
             only_in_7 = [x if "@" not in x else "....." for x in only_in_7]
 
+        len5, len7 = counts or (len(vals5 or []), len(vals7 or []))
         _logger.info(
-            f"Table [{table_name}]: v5:[{len(vals5 or [])}], "
-            f"v7:[{len(vals7 or [])}]\n"
+            f"Table [{table_name}]: v5:[{len5}], "
+            f"v7:[{len7}]\n"
             f"  {too_many_5 or ''}only in v5:[{(only_in_5[:LIMIT] if only_in_5 else [])}]\n"
             f"  {too_many_7 or ''}only in v7:[{(only_in_7[:LIMIT] if only_in_7 else [])}]"
         )
@@ -385,7 +726,138 @@ class differ:
             _logger.info(
                 f"Table [{table_name: >20}]  !!! WARN !!!  SQL request: {sql}")
 
-    def diff_table_sql(self, db5, table_name: str, sql5, sql7, compare, process_ftor):
+    # =============
+
+    @staticmethod
+    def _rows_sql(table_name: str, compare_arr: list, where: str = None) -> str:
+        """
+            Distinct rows of the compared columns as one string (NULL is `None` like in `rows` mode).
+        """
+        row = " || '|' || ".join(f"coalesce(\"{x}\"::text, 'None')" for x in compare_arr)
+        where_sql = f" WHERE {where}" if where else ""
+        return f"SELECT DISTINCT {row} AS r FROM {table_name}{where_sql}"
+
+    @staticmethod
+    def _range_hashes(db_x, rows_sql: str, prefixes: list, depth: int) -> dict:
+        """
+            prefix of length `depth` -> (count, ordered hash) of ranges below `prefixes`.
+        """
+        where = ""
+        if prefixes != [""]:
+            arr = ",".join(f"'{x}'" for x in prefixes)
+            where = f" WHERE substr(h, 1, {len(prefixes[0])}) = ANY(ARRAY[{arr}])"
+        sql = (f"SELECT substr(h, 1, {depth}) AS p, COUNT(*), md5(string_agg(h, '' ORDER BY h)) "
+               f"FROM (SELECT md5(r) AS h FROM ({rows_sql}) rs) hs{where} GROUP BY p")
+        return {p: (cnt, h) for p, cnt, h in db_x.fetch_all(sql)}
+
+    @staticmethod
+    def _range_rows(db_x, rows_sql: str, prefixes: list) -> set:
+        if len(prefixes) == 0:
+            return set()
+        arr = ",".join(f"'{x}%'" for x in prefixes)
+        return {x[0] for x in db_x.fetch_all(f"SELECT r FROM ({rows_sql}) rs WHERE md5(r) LIKE ANY(ARRAY[{arr}])")}
+
+    def diff_table_cmp_cols_hash(self, db5, table_name: str, compare_arr: list, gdpr: bool = True):
+        do_not_show = gdpr and "email" in compare_arr
+        rows_sql = self._rows_sql(table_name, compare_arr)
+        self._diff_hash(db5, table_name, rows_sql, rows_sql, do_not_show)
+
+    def _diff_hash(self, db5, table_name: str, rows_sql5: str, rows_sql7: str, do_not_show: bool):
+        """
+            Compare rows (column `r`) of both queries by range hashes.
+        """
+        counts = None
+        fetch = []
+        ranges = 0
+        prefixes = [""]
+        while len(prefixes) > 0:
+            depth = len(prefixes[0]) + differ.HASH_STEP
+            r5 = self._range_hashes(db5, rows_sql5, prefixes, depth)
+            r7 = self._range_hashes(self.raw_db_7, rows_sql7, prefixes, depth)
+            ranges += len(r5) + len(r7)
+            if counts is None:
+                counts = (sum(x[0] for x in r5.values()), sum(x[0] for x in r7.values()))
+            prefixes = []
+            for p in sorted(set(r5.keys()) | set(r7.keys())):
+                h5, h7 = r5.get(p, None), r7.get(p, None)
+                if h5 == h7:
+                    continue
+                size = max(h5[0] if h5 else 0, h7[0] if h7 else 0)
+                # one side is missing the range or it is small enough
+                if h5 is None or h7 is None or size <= differ.HASH_FETCH_LIMIT or depth >= 32:
+                    fetch.append(p)
+                else:
+                    prefixes.append(p)
+
+        vals5 = self._range_rows(db5, rows_sql5, fetch)
+        vals7 = self._range_rows(self.raw_db_7, rows_sql7, fetch)
+        only_in_5 = list(vals5.difference(vals7))
+        only_in_7 = list(vals7.difference(vals5))
+        _logger.debug(
+            f"Table [{table_name}]: compared [{ranges}] hash ranges, fetched [{len(vals5) + len(vals7)}] rows")
+        if not (only_in_5 or only_in_7):
+            _logger.info(f"Table [{table_name: >20}] is THE SAME in v5 and v7!")
+            return
+        self._cmp_values(table_name, None, only_in_5, None, only_in_7, do_not_show, counts)
+
+    def diff_table_cmp_len_hash(self, db5, table_name: str, nonnull: list = None, gdpr: bool = True,
+                                sql: str = None):
+        """
+            Counts are computed in SQL, rows are fetched only if lengths differ and `sql` is given.
+        """
+        nonnull = nonnull or []
+        cnt_sql = "SELECT " + ", ".join(
+            ["COUNT(*)"] + [f"COUNT(\"{x}\")" for x in nonnull]) + f" FROM {table_name}"
+        cnt5 = db5.fetch_all(cnt_sql)[0]
+        cnt7 = self.raw_db_7.fetch_all(cnt_sql)[0]
+        if cnt5[0] != cnt7[0] and sql:
+            self.diff_table_cmp_len(db5, table_name, nonnull, gdpr, sql)
+            return
+
+        msg = " OK " if cnt5[0] == cnt7[0] else " !!! WARN !!! "
+        _logger.info(
+            f"Table [{table_name: >20}] {msg} compared by len only v5:[{cnt5[0]}], v7:[{cnt7[0]}]")
+        for i, col_name in enumerate(nonnull, start=1):
+            msg = " OK " if cnt5[i] == cnt7[i] else " !!! WARN !!! "
+            _logger.info(
+                f"Table [{table_name: >20}] {msg}  NON NULL [{col_name:>15}] v5:[{cnt5[i]:3}], v7:[{cnt7[i]:3}]")
+
+    # =============
+
+    def _diff_table_pushdown(self, db5, table_name: str, sql5, sql7, compare, pushdown: dict,
+                             hashed: bool) -> bool:
+        """
+            Compare rows normalised in the databases, False if the normalisation cannot run.
+        """
+        try:
+            p5, p7 = pushdown.get("5", None), pushdown.get("7", None)
+            sql5 = p5.compile(sql5, self._repo) if p5 else sql5
+            sql7 = p7.compile(sql7, self._repo) if p7 else sql7
+            cols5 = pushdown_sql.probe(db5, sql5)
+            cols7 = pushdown_sql.probe(self.raw_db_7, sql7)
+        except Exception as e:
+            _logger.warning(f"Cannot normalize [{table_name}] in SQL, normalizing in Python: [{str(e)}]")
+            return False
+
+        if not hashed:
+            self.diff_table_sql(db5, table_name, sql5, sql7, compare, None)
+            return True
+
+        def rows_sql(sql, cols):
+            if compare is None:
+                return self._rows_sql(f"({sql}) q", cols)
+            col = cols[0] if compare == 0 else compare
+            return self._rows_sql(f"({sql}) q", [col], f'"{col}" IS NOT NULL')
+
+        self._diff_hash(db5, table_name, rows_sql(sql5, cols5), rows_sql(sql7, cols7), False)
+        return True
+
+    def diff_table_sql(self, db5, table_name: str, sql5, sql7, compare, process_ftor,
+                       pushdown: dict = None, hashed: bool = False):
+        if pushdown is not None and self._pushdown:
+            if self._diff_table_pushdown(db5, table_name, sql5, sql7, compare, pushdown, hashed):
+                return
+
         cols5 = []
         vals5 = db5.fetch_all(sql5, col_names=cols5)
         cols7 = []
@@ -413,7 +885,28 @@ class differ:
         only_in_7 = list(set(vals7_cmp).difference(vals5_cmp))
         self._cmp_values(table_name, vals5, only_in_5, vals7, only_in_7, False)
 
+    def sample(self, to_validate):
+        """
+            Validate the tables of definitions by samples.
+        """
+        sample = sampler(self, self._repo, self._sample_size, self._sample_seed)
+        done = set()
+        for valid_defs in to_validate:
+            for table_name, defin in valid_defs:
+                if table_name in done:
+                    continue
+                done.add(table_name)
+                db5_name = defin.get("db", "db_dspace_5")
+                db5 = self.raw_db_dspace_5 if db5_name == "db_dspace_5" else self.raw_db_utilities_5
+                if not sample.run(db5, table_name):
+                    _logger.info(f"Table [{table_name: >20}] has no sampling definition, skipped")
+        sample.log_summary()
+        return sample.report
+
     def validate(self, to_validate):
+        if self._mode == "sample":
+            self.sample(to_validate)
+            return
         for valid_defs in to_validate:
             for table_name, defin in valid_defs:
                 _logger.info("=" * 10 + f" Validating {table_name} " + "=" * 10)
@@ -421,23 +914,36 @@ class differ:
                 db5_name = defin.get("db", "db_dspace_5")
                 db5 = self.raw_db_dspace_5 if db5_name == "db_dspace_5" else self.raw_db_utilities_5
 
+                hashed = defin.get("mode", self._mode) == "hash"
+                cmp_cols = self.diff_table_cmp_cols_hash if hashed else self.diff_table_cmp_cols
+                cmp_len = self.diff_table_cmp_len_hash if hashed else self.diff_table_cmp_len
+
                 cmp = defin.get("compare", None)
                 if cmp is not None:
-                    self.diff_table_cmp_cols(db5, table_name, cmp)
+                    cmp_cols(db5, table_name, cmp)
 
                 cmp = defin.get("nonnull", None)
                 if cmp is not None:
-                    self.diff_table_cmp_len(db5, table_name, cmp)
+                    cmp_len(db5, table_name, cmp)
 
                 # compare only len
                 if not defin:
-                    self.diff_table_cmp_len(db5, table_name)
+                    cmp_len(db5, table_name)
 
                 cmp = defin.get("len", None)
                 if cmp is not None:
-                    self.diff_table_cmp_len(db5, table_name, None, True, cmp["sql"])
+                    cmp_len(db5, table_name, None, True, cmp["sql"])
+
+                # object doing the whole comparison, see `_metadatavalue_validator`
+                cmp = defin.get("validator", None)
+                if cmp is not None:
+                    if self._repo is None:
+                        _logger.critical(f"Cannot validate [{table_name}] using [{cmp.__name__}] because repo is None")
+                    else:
+                        cmp(self._repo).validate(self, db5, table_name)
 
                 cmp = defin.get("sql", None)
                 if cmp is not None:
                     self.diff_table_sql(
-                        db5, table_name, cmp["5"], cmp["7"], cmp["compare"], cmp.get("process", None))
+                        db5, table_name, cmp["5"], cmp["7"], cmp["compare"], cmp.get("process", None),
+                        cmp.get("pushdown", None), hashed)
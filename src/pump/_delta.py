@@ -0,0 +1,297 @@
+import os
+import json
+import logging
+from datetime import datetime
+
+from ._utils import progress_bar
+from ._subset import _in
+from ._fingerprint import fingerprint, fingerprints
+
+_logger = logging.getLogger("pump.delta")
+
+# v5 resource type ids
+_BITSTREAM = 0
+_BUNDLE = 1
+_ITEM = 2
+
+
+class delta:
+    """
+        Incremental migration of v5 changes made after the full import.
+
+        Watermarks are taken when an import starts (`snapshot`) and stored when it finishes (`save`):
+            - items: max item id and max `last_modified`
+            - tables without timestamps: fingerprints (md5 of every row keyed by primary key)
+              of `hashed_tables` taken by the repo `fingerprints` (shared with table exports,
+              so every table is hashed once per run), a copy is kept next to the watermark file
+
+        `compute` compares the v5 database with the watermarks and the persisted id -> uuid store:
+            - new items (archived) are imported with their bundles, bitstreams and policies
+            - changed items (`last_modified` after the watermark) are updated
+            - new bitstreams in existing bundles and new policies of existing objects are imported
+            - deleted items are deleted only if requested, changed/deleted policies and bitstreams
+              are reported only
+
+        It is used as the export filter of the repo (`where`), only the changed rows are exported.
+    """
+
+    hashed_tables = ["resourcepolicy", "bundle2bitstream"]
+
+    # tables exported fully, other tables are not needed (their objects are deserialized)
+    full_tables = ["metadatafieldregistry", "metadataschemaregistry"]
+
+    # tables of finished phases must be exported too
+    skip_finished = False
+
+    def __init__(self, file_str: str, fps, ids=None):
+        self._file_str = file_str
+        self._fps = fps
+        self._ids_store = ids
+        self._ids = None
+        self._wheres = None
+        self.changes = None
+        self.next_state = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file_str)
+
+    def load(self) -> dict:
+        with open(self._file_str, mode="r", encoding="utf-8") as fin:
+            return json.load(fin)
+
+    def _fingerprint(self, table_name: str):
+        base = os.path.splitext(self._file_str)[0]
+        return fingerprint(f"{base}.{table_name}{fingerprint.SUFFIX}")
+
+    def save(self, state: dict, db5):
+        os.makedirs(os.path.dirname(self._file_str) or ".", exist_ok=True)
+        for t in delta.hashed_tables:
+            # taken by `snapshot`, not hashed again
+            fingerprints.keep(self._fps.take(db5, t), self._fingerprint(t).file_str)
+        tmp_file = f"{self._file_str}.tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as fout:
+            json.dump(state, fout)
+        os.replace(tmp_file, self._file_str)
+        _logger.info(f"Stored watermarks [{state['item']}] into [{self._file_str}]")
+
+    def snapshot(self, db5) -> dict:
+        """
+            Watermarks of the current v5 state, take them before importing.
+            Fingerprints are taken now and replace the previous ones in `save`.
+        """
+        os.makedirs(os.path.dirname(self._file_str) or ".", exist_ok=True)
+        for t in delta.hashed_tables:
+            self._fps.take(db5, t)
+        max_id, last_modified = db5.fetch_all("SELECT MAX(item_id), MAX(last_modified) FROM item")[0]
+        return {
+            "created": datetime.now().isoformat(),
+            "item": {
+                "max_id": max_id or 0,
+                "last_modified": str(last_modified) if last_modified is not None else None,
+            },
+        }
+
+    # =============
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @staticmethod
+    def _col(db5, sql: str) -> set:
+        return {x[0] for x in db5.fetch_all(sql) if x[0] is not None}
+
+    def compute(self, db5) -> dict:
+        if not self.exists():
+            raise FileNotFoundError(f"Watermarks [{self._file_str}] do not exist, run the full import first.")
+        state = self.load()
+        self.next_state = self.snapshot(db5)
+        wm = state["item"]
+        migrated = {int(x) for x in self._ids_store.id2uuid("item").keys()}
+
+        v5_items = self._col(db5, "SELECT item_id FROM item")
+        # workspace and workflow items are not in the id store, older ones are not new
+        unarchived = self._col(db5, "SELECT item_id FROM workspaceitem UNION SELECT item_id FROM workflowitem")
+        new_items = {x for x in v5_items if x > wm["max_id"] or (x not in migrated and x not in unarchived)}
+        changed_items = set()
+        if wm["last_modified"] is not None:
+            changed_items = self._col(
+                db5, f"SELECT item_id FROM item WHERE last_modified > '{wm['last_modified']}'")
+        changed_items = {x for x in changed_items if x in migrated} - new_items
+        deleted_items = sorted(migrated - v5_items)
+
+        tables = {}
+        for t in delta.hashed_tables:
+            d = self._fingerprint(t).diff(self._fps.take(db5, t))
+            tables[t] = {"added": d["insert"], "changed": d["update"], "deleted": d["delete"]}
+
+        # bundles and bitstreams to export
+        scope_items = new_items | changed_items
+        bundles = self._col(db5, f"SELECT bundle_id FROM item2bundle WHERE {_in('item_id', scope_items)}")
+        new_b2b = tables["bundle2bitstream"]["added"]
+        new_bs = self._col(db5, f"SELECT bitstream_id FROM bundle2bitstream WHERE {_in('id', new_b2b)}")
+        bundles |= self._col(db5, f"SELECT bundle_id FROM bundle2bitstream WHERE {_in('id', new_b2b)}")
+        bitstreams = self._col(db5, f"SELECT bitstream_id FROM bundle2bitstream WHERE {_in('bundle_id', bundles)}")
+
+        new_policies = tables["resourcepolicy"]["added"]
+        policy_res = db5.fetch_all(
+            f"SELECT policy_id, resource_type_id, resource_id FROM resourcepolicy WHERE {_in('policy_id', new_policies)}")
+
+        self._ids = {_BITSTREAM: bitstreams, _BUNDLE: bundles, _ITEM: scope_items}
+        objs_where = " OR ".join(
+            f"(resource_type_id = {t} AND {_in('resource_id', ids)})" for t, ids in self._ids.items())
+        self._wheres = {
+            "item": _in("item_id", scope_items),
+            "workspaceitem": _in("item_id", scope_items),
+            "workflowitem": _in("item_id", scope_items),
+            "collection2item": _in("item_id", scope_items),
+            "handle": f"resource_type_id = {_ITEM} AND {_in('resource_id', scope_items)}",
+            "metadatavalue": f"({objs_where})",
+            "item2bundle": _in("bundle_id", bundles),
+            "bundle": _in("bundle_id", bundles),
+            "bundle2bitstream": _in("bundle_id", bundles),
+            "bitstream": _in("bitstream_id", bitstreams),
+            "resourcepolicy": f"({objs_where}) OR {_in('policy_id', new_policies)}",
+        }
+        self.changes = {
+            "new_items": sorted(new_items),
+            "changed_items": sorted(changed_items),
+            "deleted_items": deleted_items,
+            "new_bitstreams": sorted(new_bs),
+            "new_policies": policy_res,
+            "tables": tables,
+        }
+        _logger.info(
+            f"Delta since [{state['created']}]: new items:[{len(new_items)}] changed items:[{len(changed_items)}] "
+            f"deleted items:[{len(deleted_items)}] " +
+            " ".join(f"{t}:[+{len(v['added'])} ~{len(v['changed'])} -{len(v['deleted'])}]"
+                     for t, v in tables.items()))
+        return self.changes
+
+    def where(self, table_name: str):
+        if self._wheres is None:
+            raise RuntimeError("Delta is not computed")
+        if table_name in delta.full_tables:
+            return None
+        return self._wheres.get(table_name, "FALSE")
+
+    # =============
+
+    def _known(self, repo, type_name: str, obj, v5_ids):
+        """
+            Objects migrated before are known to the WAL and the id map so that they are skipped.
+        """
+        known = 0
+        for v5_id in v5_ids:
+            uuid = self._ids_store.uuid(type_name, v5_id)
+            if uuid is None:
+                continue
+            obj.id2uuid[str(v5_id)] = uuid
+            if not repo.wal.done(type_name, v5_id):
+                repo.wal.append(type_name, v5_id, uuid)
+            known += 1
+        return known
+
+    def apply(self, env, dspace, repo, delete: bool = False) -> dict:
+        """
+            Apply computed changes, objects of other phases are deserialized from their cache files.
+        """
+        changes = self.changes
+        report = {"imported": 0, "updated": 0, "deleted": 0, "bitstreams": 0, "policies_failed": 0, "failed": 0}
+        for obj, key in [(repo.metadatas, "metadataschema"), (repo.communities, "community"),
+                         (repo.collections, "collection"), (repo.groups, "epersongroup"),
+                         (repo.epersons, "eperson"), (repo.bitstreamformatregistry, "bitstreamformat")]:
+            obj.deserialize(env["cache"][key])
+
+        items, bundles, bitstreams = repo.items, repo.bundles, repo.bitstreams
+        self._known(repo, "item", items, changes["changed_items"])
+        existing_bundles = self._ids[_BUNDLE]
+        self._known(repo, "bundle", bundles, existing_bundles)
+        self._known(repo, "bitstream", bitstreams,
+                    [x for x in self._ids[_BITSTREAM] if x not in set(changes["new_bitstreams"])])
+        existing_bundles = {x for x in existing_bundles if bundles.uuid(x) is not None}
+
+        def import_content(item_id: int, created: list):
+            bundle_ids = bundles.import_item(item_id, dspace, repo.metadatas, items, repo.wal)
+            created += [(_BUNDLE, x) for x in bundle_ids if x not in existing_bundles]
+            bs_ids = bitstreams.import_bundles(
+                bundle_ids, env, dspace, repo.metadatas, repo.bitstreamformatregistry, bundles,
+                repo.communities, repo.collections, repo.wal)
+            new_bs = [x for x in bs_ids if x in new_bitstreams]
+            report["bitstreams"] += len(new_bs)
+            created += [(_BITSTREAM, x) for x in new_bs]
+
+        new_items = set(changes["new_items"])
+        changed_items = set(changes["changed_items"])
+        new_bitstreams = set(changes["new_bitstreams"])
+        archived = items.archived_items()
+        not_archived = new_items - {x['item_id'] for x in archived}
+        if len(not_archived) > 0:
+            _logger.warning(f"New workspace/workflow items are not migrated by delta: {sorted(not_archived)}")
+        created = []
+        for item in progress_bar(archived):
+            i_id = item['item_id']
+            if i_id in new_items:
+                st = items.import_one(item, dspace, repo.handles, repo.metadatas, repo.epersons,
+                                      repo.collections, repo.wal)
+                if st != "imported":
+                    report["failed"] += 1
+                    continue
+                report["imported"] += 1
+                created.append((_ITEM, i_id))
+                import_content(i_id, created)
+            elif i_id in changed_items:
+                err, _1, data = items.item_payload(
+                    item, repo.handles, repo.metadatas, repo.epersons, repo.collections)
+                if err is not None:
+                    report["failed"] += 1
+                    continue
+                uuid = items.uuid(i_id)
+                data.update({"id": uuid, "uuid": uuid, "type": "item"})
+                try:
+                    dspace.update_item(uuid, data)
+                    report["updated"] += 1
+                except Exception as e:
+                    _logger.error(f"update_item: [{i_id}] failed [{str(e)}]")
+                    report["failed"] += 1
+                    continue
+                import_content(i_id, created)
+
+        # new bitstreams in bundles of unchanged items
+        rest = [x for x in existing_bundles if x not in {b for t, b in created if t == _BUNDLE}]
+        bs_ids = bitstreams.import_bundles(
+            rest, env, dspace, repo.metadatas, repo.bitstreamformatregistry, bundles,
+            repo.communities, repo.collections, repo.wal)
+        new_bs = [x for x in bs_ids if x in new_bitstreams and (_BITSTREAM, x) not in created]
+        report["bitstreams"] += len(new_bs)
+        created += [(_BITSTREAM, x) for x in new_bs]
+
+        # policies of created objects replace the default ones, new policies of other objects are added
+        rp = repo.resourcepolicies
+        report["policies_failed"] += rp.import_objects(env, dspace, repo, created, repo.wal)
+        created = set(created)
+        policies = [p for policy_id, t, r in changes["new_policies"] if (t, r) not in created
+                    for p in rp.policies_of(t, r) if p['policy_id'] == policy_id]
+        report["policies_failed"] += rp.import_policies(env, dspace, repo, policies, repo.wal)
+
+        for t, v in changes["tables"].items():
+            if len(v["changed"]) + len(v["deleted"]) > 0:
+                _logger.warning(
+                    f"Table [{t}] has changed:[{len(v['changed'])}] deleted:[{len(v['deleted'])}] rows "
+                    f"which are not migrated by delta")
+
+        for i_id in changes["deleted_items"]:
+            uuid = self._ids_store.uuid("item", i_id)
+            if not delete:
+                _logger.warning(f"Item [{i_id}] [{uuid}] was deleted in v5, use delete to remove it from v7")
+                continue
+            try:
+                dspace.delete_item(uuid)
+                self._ids_store.delete("item", i_id)
+                report["deleted"] += 1
+            except Exception as e:
+                _logger.error(f"delete_item: [{i_id}] failed [{str(e)}]")
+                report["failed"] += 1
+
+        _logger.info("Delta applied: " + " ".join(f"{k}:[{v}]" for k, v in report.items()))
+        return report
@@ -1,5 +1,7 @@
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.eperson")
 
@@ -55,7 +57,7 @@ class epersons:
             _logger.info(f"Empty input: [{eperson_file_str}].")
 
         self._email2id = {}
-        self._id2uuid = {}
+        self._id2uuid = idmap()
 
         if not self._epersons:
             _logger.info(f"Empty input: [{eperson_file_str}].")
@@ -73,8 +75,11 @@ class epersons:
     def by_email(self, email: str):
         return self._email2id.get(email, None)
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, eid: int):
-        assert isinstance(list(self._id2uuid.keys())[0], str)
         return self._id2uuid.get(str(eid), None)
 
     @property
@@ -82,7 +87,7 @@ class epersons:
         return self._imported['p']
 
     @time_method
-    def import_to(self, env, dspace, metadatas):
+    def import_to(self, env, dspace, metadatas, wal=None):
         expected = len(self)
         log_key = "eperson"
         log_before_import(log_key, expected)
@@ -90,8 +95,13 @@ class epersons:
         ignore_eids = env.get("ignore", {}).get("epersons", [])
         ignored = 0
 
+        wal = ensure_wal(wal)
+        self._imported["p"] += wal.replay_into("eperson", self._id2uuid)
+
         for e in progress_bar(self._epersons):
             e_id = e['eperson_id']
+            if wal.done("eperson", e_id):
+                continue
 
             if e_id in ignore_eids:
                 _logger.debug(f"Skipping eperson [{e_id}]")
@@ -123,6 +133,7 @@ class epersons:
                 resp = dspace.put_eperson(params, data)
                 self._id2uuid[str(e_id)] = resp['id']
                 self._imported["p"] += 1
+                wal.append("eperson", e_id, resp['id'])
             except Exception as e:
                 _logger.error(f'put_eperson: [{e_id}] failed [{str(e)}]')
 
@@ -134,7 +145,7 @@ class epersons:
     def serialize(self, file_str: str):
         data = {
             "epersons": self._epersons,
-            "id2uuid": self._id2uuid,
+            "id2uuid": self._id2uuid.to_dict(),
             "email2id": self._email2id,
             "imported": self._imported,
         }
@@ -143,7 +154,7 @@ class epersons:
     def deserialize(self, file_str: str):
         data = deserialize(file_str)
         self._epersons = data["epersons"]
-        self._id2uuid = data["id2uuid"]
+        self._id2uuid = idmap(data["id2uuid"])
         self._email2id = data["email2id"]
         self._imported = data["imported"]
 
@@ -175,14 +186,22 @@ class groups:
         return self._imported['group']
 
     @time_method
-    def import_to(self, dspace, groups, epersons):
+    def import_to(self, dspace, groups, epersons, wal=None):
         expected = len(self)
         log_key = "epersongroup2eperson"
         log_before_import(log_key, expected)
 
+        wal = ensure_wal(wal)
+        for rec in wal.records("group2eperson").values():
+            self._imported["group"] += rec["x"]["imported"]
+
         for g in progress_bar(self._groups):
             g_id = g['eperson_group_id']
             e_id = g['eperson_id']
+            key = f"{g_id}_{e_id}"
+            if wal.done("group2eperson", key):
+                continue
+            imported = 0
             try:
                 g_uuid_list = groups.uuid(g_id)
                 e_uuid = epersons.uuid(e_id)
@@ -195,6 +214,8 @@ class groups:
                         continue
                     dspace.put_egroup(g_uuid, e_uuid)
                     self._imported["group"] += 1
+                    imported += 1
+                wal.append("group2eperson", key, imported=imported)
             except Exception as e:
                 _logger.error(f'put_egroup: [{g_id}] failed [{str(e)}]')
 
@@ -0,0 +1,170 @@
+import os
+import shutil
+import hashlib
+import logging
+import threading
+
+_logger = logging.getLogger("pump.fingerprint")
+
+
+class fingerprint:
+    """
+        Per row hashes of a v5 table keyed by primary key, for tables without timestamps.
+
+        The file has one `<pk> <md5 of row_to_json>` line per row sorted by the primary key,
+        it is written while streaming the rows from the database (server side cursor)
+        and two fingerprints are compared by a merge join in one pass, so neither
+        the export nor the diff keep the table in memory.
+    """
+
+    # table -> integer primary key
+    tables = {
+        "metadatavalue": "metadata_value_id",
+        "resourcepolicy": "policy_id",
+        "epersongroup2eperson": "id",
+        "bundle2bitstream": "id",
+    }
+
+    SUFFIX = ".hashes"
+
+    def __init__(self, file_str: str):
+        self._file_str = file_str
+
+    @property
+    def file_str(self):
+        return self._file_str
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file_str)
+
+    def __repr__(self):
+        return f"fingerprint({self._file_str})"
+
+    @staticmethod
+    def export(db, table_name: str, out_f: str, where: str = None):
+        """
+            Write fingerprint of the table (or of the rows matching `where`), returns it.
+        """
+        pk = fingerprint.tables[table_name]
+        where_sql = f" WHERE {where}" if where else ""
+        sql = f'SELECT {pk}, md5(row_to_json(t)::text) FROM "{table_name}" t{where_sql} ORDER BY {pk}'
+        tmp_file = f"{out_f}.tmp"
+        rows = 0
+        with open(tmp_file, mode="w", encoding="utf-8") as fout:
+            for pk_val, h in db.fetch_iter(sql):
+                fout.write(f"{pk_val} {h}\n")
+                rows += 1
+        os.replace(tmp_file, out_f)
+        _logger.info(f"Fingerprint of [{table_name}] with [{rows}] rows stored into [{out_f}]")
+        return fingerprint(out_f)
+
+    def rows(self):
+        """
+            (pk, hash) in the primary key order.
+        """
+        if not self.exists():
+            return
+        with open(self._file_str, mode="r", encoding="utf-8") as fin:
+            for line in fin:
+                pk, h = line.split()
+                yield int(pk), h
+
+    def digest(self) -> str:
+        """
+            Hash of the whole fingerprint.
+        """
+        md5 = hashlib.md5()
+        with open(self._file_str, mode="rb") as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b""):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def changed(self, new) -> bool:
+        """
+            Quick check whether the source changed between this and the `new` fingerprint.
+        """
+        if not self.exists() or not new.exists():
+            return self.exists() != new.exists()
+        if os.path.getsize(self._file_str) != os.path.getsize(new.file_str):
+            return True
+        return self.digest() != new.digest()
+
+    def diff(self, new) -> dict:
+        """
+            Primary keys inserted, updated and deleted between this (older) and the `new` fingerprint.
+        """
+        res = {"insert": [], "update": [], "delete": []}
+        old_it, new_it = self.rows(), new.rows()
+        old_row, new_row = next(old_it, None), next(new_it, None)
+        while old_row is not None or new_row is not None:
+            if new_row is None or (old_row is not None and old_row[0] < new_row[0]):
+                res["delete"].append(old_row[0])
+                old_row = next(old_it, None)
+            elif old_row is None or new_row[0] < old_row[0]:
+                res["insert"].append(new_row[0])
+                new_row = next(new_it, None)
+            else:
+                if old_row[1] != new_row[1]:
+                    res["update"].append(new_row[0])
+                old_row, new_row = next(old_it, None), next(new_it, None)
+        return res
+
+    @staticmethod
+    def log_diff(table_name: str, d: dict):
+        _logger.info(
+            f"Table [{table_name}] changed since the previous export: "
+            f"inserted:[{len(d['insert'])}] updated:[{len(d['update'])}] deleted:[{len(d['delete'])}]")
+
+
+class fingerprints:
+    """
+        Fingerprints of v5 tables stored in one directory (under `resume_dir`, it survives
+        removal of the table exports).
+
+        `take` hashes a table at most once per run - the delta watermarks and the table export
+        share the same fingerprint; the previous one is kept as `<file>.prev` and the changes
+        since then are logged. Filtered tables (subset, delta) have their own files so that
+        only fingerprints of the same rows are compared.
+    """
+
+    def __init__(self, dir_str: str):
+        self._dir = dir_str
+        self._taken = {}
+        self._lock = threading.Lock()
+
+    def file_str(self, table_name: str, where: str = None) -> str:
+        name = table_name
+        if where:
+            name += "." + hashlib.md5(where.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self._dir, name + fingerprint.SUFFIX)
+
+    def take(self, db, table_name: str, where: str = None):
+        """
+            Fingerprint of the table (or of the rows matching `where`) taken in this run.
+        """
+        fp_f = self.file_str(table_name, where)
+        with self._lock:
+            if fp_f in self._taken:
+                return self._taken[fp_f]
+            os.makedirs(self._dir, exist_ok=True)
+            prev = fingerprint(fp_f + ".prev")
+            if os.path.exists(fp_f):
+                os.replace(fp_f, prev.file_str)
+            cur = fingerprint.export(db, table_name, fp_f, where)
+            self._taken[fp_f] = cur
+        if prev.exists():
+            if prev.changed(cur):
+                fingerprint.log_diff(table_name, prev.diff(cur))
+            else:
+                _logger.info(f"Table [{table_name}] did not change since the previous export.")
+        return cur
+
+    @staticmethod
+    def keep(fp, file_str: str):
+        """
+            Copy of the fingerprint (e.g., delta baseline) which is not replaced by the next `take`.
+        """
+        tmp_file = f"{file_str}.tmp"
+        shutil.copyfile(fp.file_str, tmp_file)
+        os.replace(tmp_file, file_str)
+        return fingerprint(file_str)
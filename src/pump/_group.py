@@ -1,6 +1,8 @@
 import re
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._wal import ensure_wal
+from ._pushdown import pushdown
 
 _logger = logging.getLogger("pump.groups")
 
@@ -38,6 +40,30 @@ def _epersongroup_process(repo, v5data: list, v7data: list):
     return v5data_new, v7data
 
 
+def _collection_community_uuids(repo) -> dict:
+    """
+        `COLLECTION_<id>` / `COMMUNITY_<id>` -> uuid
+    """
+    d = {f"COLLECTION_{k}": v for k, v in repo.collections.id2uuid.items()}
+    d.update({f"COMMUNITY_{k}": v for k, v in repo.communities.id2uuid.items()})
+    return d
+
+
+# `_epersongroup_process` in SQL
+_epersongroup_pushdown = pushdown(["name"], [
+    ["expr", "kind", r"substring({name} from '^(COLLECTION|COMMUNITY)_\d+_')"],
+    ["expr", "obj", r"substring({name} from '^((?:COLLECTION|COMMUNITY)_\d+)_')"],
+    ["expr", "role", r"substring({name} from '^(?:COLLECTION|COMMUNITY)_\d+_(.*)$')"],
+    ["lookup", "uuid", "{obj}", _collection_community_uuids],
+    ["expr", "role", "CASE WHEN {role} = 'WORKFLOW_STEP_2' THEN 'WORKFLOW_ROLE_editor' ELSE {role} END"],
+    ["expr", "prefix", "{kind} || '_' || coalesce({uuid}, 'None') || '_'"],
+    ["unnest", "name", "CASE WHEN {kind} IS NULL THEN ARRAY[{name}] "
+                       "WHEN {role} = 'DEFAULT_READ' THEN "
+                       "ARRAY[{prefix} || 'BITSTREAM_DEFAULT_READ', {prefix} || 'ITEM_DEFAULT_READ'] "
+                       "ELSE ARRAY[{prefix} || {role}] END"],
+], output=["name"])
+
+
 class groups:
 
     validate_table = [
@@ -52,6 +78,7 @@ class groups:
                 "7": "select name from epersongroup",
                 "compare": 0,
                 "process": _epersongroup_process,
+                "pushdown": {"5": _epersongroup_pushdown},
             }
         }],
 
@@ -132,19 +159,23 @@ class groups:
             f"Loaded groups [{self._id2uuid}], other groups:[{len(other_groups)}]")
         return self
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, gid: int):
-        assert isinstance(list(self._id2uuid.keys())[0], str)
         return self._id2uuid.get(str(gid), None)
 
     @time_method
-    def import_to(self, dspace, metadatas, coll_groups, comm_groups):
+    def import_to(self, dspace, metadatas, coll_groups, comm_groups, wal=None):
         # Do not import groups which are already imported
         self._id2uuid.update(coll_groups)
         self._id2uuid.update(comm_groups)
-        self._import_eperson(dspace, metadatas)
-        self._import_group2group(dspace)
+        wal = ensure_wal(wal)
+        self._import_eperson(dspace, metadatas, wal)
+        self._import_group2group(dspace, wal)
 
-    def _import_eperson(self, dspace, metadatas):
+    def _import_eperson(self, dspace, metadatas, wal):
         """
             Import data into database.
             Mapped tables: epersongroup
@@ -155,8 +186,17 @@ class groups:
 
         grps = []
 
+        # replay groups created before the crash
+        for g_id, rec in wal.records("epersongroup").items():
+            if g_id in self._id2uuid:
+                continue
+            self._id2uuid[g_id] = [rec["uuid"]]
+            self._imported["eperson"] += 1
+
         for eg in progress_bar(self._eperson):
             g_id = eg['eperson_group_id']
+            if wal.done("epersongroup", g_id):
+                continue
 
             # group Administrator and Anonymous already exist
             # group is created with dspace object too
@@ -187,6 +227,7 @@ class groups:
                 resp = dspace.put_eperson_group({}, data)
                 self._id2uuid[str(g_id)] = [resp['id']]
                 self._imported["eperson"] += 1
+                wal.append("epersongroup", g_id, resp['id'])
             except Exception as e:
                 _logger.error(f'put_eperson_group: [{g_id}] failed [{str(e)}]')
 
@@ -196,7 +237,7 @@ class groups:
         log_after_import(f'{log_key} [known existing:{self._imported["default_groups"]}]',
                          expected, self.imported_eperson + self._imported["default_groups"])
 
-    def _import_group2group(self, dspace):
+    def _import_group2group(self, dspace, wal):
         """
             Import data into database.
             Mapped tables: group2group
@@ -205,6 +246,8 @@ class groups:
         log_key = "epersons g2g (could have children)"
         log_before_import(log_key, expected)
 
+        self._imported["g2g"] += len(wal.records("group2group"))
+
         for g2g in progress_bar(self._g2g):
             parent_a = self.uuid(g2g['parent_id'])
             child_a = self.uuid(g2g['child_id'])
@@ -215,10 +258,14 @@ class groups:
 
             for parent in parent_a:
                 for child in child_a:
+                    key = f"{parent}_{child}"
+                    if wal.done("group2group", key):
+                        continue
                     try:
                         dspace.put_group2group(parent, child)
                         # TODO Update statistics when the collection has more group relations.
                         self._imported["g2g"] += 1
+                        wal.append("group2group", key)
                     except Exception as e:
                         _logger.error(
                             f'put_group2group: [{parent}][{child}] failed [{str(e)}]')
@@ -0,0 +1,109 @@
+import uuid as uuid_lib
+
+
+class idmap:
+    """
+        Mapping of v5 ids to v7 uuids with O(1) lookups in both directions.
+
+        Keys are normalised to `str` on insert (v5 ids are stored as strings in the
+        serialized cache files), uuids are stored as 16 byte values.
+        Lookups accept both `int` and `str` keys. The reverse index is built
+        on the first reverse lookup and maintained afterwards.
+    """
+
+    def __init__(self, data: dict = None):
+        self._id2uuid = {}
+        self._uuid2id = None
+        if data:
+            self.update(data)
+
+    @staticmethod
+    def _key(key) -> str:
+        if isinstance(key, bool) or not isinstance(key, (int, str)):
+            raise TypeError(f"Invalid id type [{type(key).__name__}] of [{key}]")
+        return str(key)
+
+    @staticmethod
+    def _pack(value) -> bytes:
+        if isinstance(value, uuid_lib.UUID):
+            return value.bytes
+        return uuid_lib.UUID(str(value)).bytes
+
+    @staticmethod
+    def _unpack(value: bytes) -> str:
+        return str(uuid_lib.UUID(bytes=value))
+
+    # =============
+
+    def __len__(self):
+        return len(self._id2uuid)
+
+    def __contains__(self, key):
+        return str(key) in self._id2uuid
+
+    def __iter__(self):
+        return iter(self._id2uuid)
+
+    def __getitem__(self, key):
+        return self._unpack(self._id2uuid[str(key)])
+
+    def __setitem__(self, key, value):
+        key = self._key(key)
+        packed = self._pack(value)
+        prev = self._id2uuid.get(key, None)
+        self._id2uuid[key] = packed
+        rev = self._uuid2id
+        if rev is not None:
+            if prev is not None and rev.get(prev, None) == key:
+                del rev[prev]
+            rev[packed] = key
+
+    def get(self, key, default=None):
+        value = self._id2uuid.get(str(key), None)
+        if value is None:
+            return default
+        return self._unpack(value)
+
+    def keys(self):
+        return self._id2uuid.keys()
+
+    def values(self):
+        return (self._unpack(x) for x in self._id2uuid.values())
+
+    def items(self):
+        return ((k, self._unpack(v)) for k, v in self._id2uuid.items())
+
+    def update(self, data: dict):
+        for k, v in data.items():
+            self[k] = v
+
+    # =============
+
+    def id(self, uuid):
+        """
+            Reverse lookup, return v5 id (as string) of the uuid or None.
+        """
+        if self._uuid2id is None:
+            rev = {}
+            for k, v in self._id2uuid.items():
+                rev[v] = k
+            self._uuid2id = rev
+        try:
+            return self._uuid2id.get(self._pack(uuid), None)
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+    def has_uuid(self, uuid) -> bool:
+        return self.id(uuid) is not None
+
+    def copy(self):
+        res = idmap()
+        res._id2uuid = dict(self._id2uuid)
+        return res
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data or {})
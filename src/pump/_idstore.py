@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+import logging
+
+_logger = logging.getLogger("pump.idstore")
+
+
+class idstore:
+    """
+        Persistent mapping of v5 ids to v7 uuids shared by importers, validators and tools.
+
+        Backed by SQLite in WAL mode so that readers (e.g., tools) do not block the writer.
+        Every thread uses its own connection.
+
+        One (type, id) can be mapped to more uuids (e.g., collection groups),
+        `pos` keeps their order.
+    """
+
+    _schema = [
+        "CREATE TABLE IF NOT EXISTS id2uuid ("
+        "type TEXT NOT NULL, id TEXT NOT NULL, pos INTEGER NOT NULL, uuid TEXT NOT NULL, "
+        "PRIMARY KEY (type, id, pos)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS id2uuid_uuid ON id2uuid (uuid)",
+    ]
+
+    def __init__(self, file_str: str, readonly: bool = False, timeout: float = 60.):
+        self._file_str = file_str
+        self._readonly = readonly
+        self._timeout = timeout
+        self._local = threading.local()
+        if readonly:
+            if not os.path.exists(file_str):
+                raise FileNotFoundError(f"File [{file_str}] does not exist.")
+            return
+        os.makedirs(os.path.dirname(file_str) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for sql in idstore._schema:
+            conn.execute(sql)
+        conn.commit()
+
+    @property
+    def file_str(self):
+        return self._file_str
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._readonly:
+                conn = sqlite3.connect(
+                    f"file:{self._file_str}?mode=ro", uri=True, timeout=self._timeout)
+            else:
+                conn = sqlite3.connect(self._file_str, timeout=self._timeout)
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM id2uuid").fetchone()[0]
+
+    # =============
+
+    def upsert(self, type_name: str, v5_id, uuid):
+        self.upsert_many(type_name, {v5_id: uuid})
+
+    def upsert_many(self, type_name: str, id2uuid: dict):
+        """
+            Insert or replace mapping, value could be one uuid or list of uuids.
+        """
+        rows = []
+        for v5_id, uuids in id2uuid.items():
+            if uuids is None:
+                continue
+            if not isinstance(uuids, (list, tuple)):
+                uuids = [uuids]
+            rows += [(type_name, str(v5_id), pos, str(u)) for pos, u in enumerate(uuids)]
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "DELETE FROM id2uuid WHERE type = ? AND id = ?",
+                [(type_name, str(x)) for x in id2uuid.keys()])
+            conn.executemany(
+                "INSERT OR REPLACE INTO id2uuid (type, id, pos, uuid) VALUES (?, ?, ?, ?)", rows)
+        _logger.debug(f"Stored [{len(rows)}] [{type_name}] mappings")
+        return len(rows)
+
+    def clear(self):
+        """
+            Remove all mappings (a fresh import).
+        """
+        conn = self._conn()
+        with conn:
+            deleted = conn.execute("DELETE FROM id2uuid").rowcount
+        _logger.info(f"Removed [{deleted}] mappings from [{self._file_str}]")
+
+    def delete(self, type_name: str, v5_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM id2uuid WHERE type = ? AND id = ?", (type_name, str(v5_id)))
+
+    # =============
+
+    def uuid(self, type_name: str, v5_id):
+        row = self._conn().execute(
+            "SELECT uuid FROM id2uuid WHERE type = ? AND id = ? ORDER BY pos LIMIT 1",
+            (type_name, str(v5_id))).fetchone()
+        return row[0] if row is not None else None
+
+    def uuids(self, type_name: str, v5_id) -> list:
+        rows = self._conn().execute(
+            "SELECT uuid FROM id2uuid WHERE type = ? AND id = ? ORDER BY pos",
+            (type_name, str(v5_id))).fetchall()
+        return [x[0] for x in rows]
+
+    def id(self, uuid: str, type_name: str = None):
+        """
+            Reverse lookup, return v5 id (as string) of the uuid.
+        """
+        sql = "SELECT id FROM id2uuid WHERE uuid = ?"
+        params = (str(uuid),)
+        if type_name is not None:
+            sql += " AND type = ?"
+            params += (type_name,)
+        row = self._conn().execute(sql + " LIMIT 1", params).fetchone()
+        return row[0] if row is not None else None
+
+    def type_of(self, uuid: str):
+        row = self._conn().execute(
+            "SELECT type FROM id2uuid WHERE uuid = ? LIMIT 1", (str(uuid),)).fetchone()
+        return row[0] if row is not None else None
+
+    def id2uuid(self, type_name: str) -> dict:
+        """
+            Return the whole mapping of one type, first uuid only.
+        """
+        rows = self._conn().execute(
+            "SELECT id, uuid FROM id2uuid WHERE type = ? AND pos = 0", (type_name,))
+        return {k: v for k, v in rows}
+
+    def types(self) -> dict:
+        rows = self._conn().execute("SELECT type, COUNT(*) FROM id2uuid GROUP BY type")
+        return {k: v for k, v in rows}
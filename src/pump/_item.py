@@ -1,5 +1,10 @@
 import logging
 from ._utils import read_json, serialize, deserialize, time_method, progress_bar, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
+from ._version_chains import version_chains
+from ._shard import sharded, shard_by
+from ._tracing import span
 
 _logger = logging.getLogger("pump.item")
 
@@ -77,13 +82,14 @@ class items:
             _logger.info(f"Empty input: [{col2item_file_str}].")
 
         self._id2item = {str(e['item_id']): e for e in self._items}
-        self._id2uuid = {}
+        self._id2uuid = idmap()
         self._ws_id2v7id = {}
-        self._ws_id2uuid = {}
+        self._ws_id2uuid = idmap()
         self._wf_id2workflow_id = {}
         self._wf_item_ids = []
         self._col_id2uuid = {}
-        self._migrated_versions = []
+        # ids (str) of items with migrated versions
+        self._migrated_versions = set()
 
         self._imported = {
             "items": 0,
@@ -103,13 +109,16 @@ class items:
         return len(self._items or {})
 
     def find_by_uuid(self, uuid: str):
-        for k, item_uuid in self._id2uuid.items():
-            if uuid == item_uuid:
-                return self._id2item[k]
-        return None
+        k = self._id2uuid.id(uuid)
+        if k is None:
+            return None
+        return self._id2item.get(k, None)
+
+    @property
+    def id2uuid(self):
+        return self._id2uuid
 
     def uuid(self, eid: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid.get(str(eid), None)
 
     def wf_id(self, wfid: int):
@@ -135,17 +144,25 @@ class items:
         return self._id2item[str(item_id)]
 
     @time_method
-    def import_to(self, cache_file, dspace, handles, metadatas, epersons, collections):
+    def import_to(self, cache_file, dspace, handles, metadatas, epersons, collections, wal=None,
+                  ids=None, shards: int = 1, stream=None):
         """
             Import data into database.
             Mapped tables: item, collection2item, workspaceitem, cwf_workflowitem,
             metadata, handle
+
+            Objects already recorded in `wal` are not created again.
+            With `shards` > 1 items are imported by more processes sharing `ids` store.
+            If `stream` is set, it is called with every item existing in v7 right after the item
+            is handled in the item step.
         """
+        wal = ensure_wal(wal)
+
         if "ws" in self._done:
             _logger.info("Skipping workspace import")
         else:
             if self._ws_items is not None:
-                self._ws_import_to(dspace, handles, metadatas, epersons, collections)
+                self._ws_import_to(dspace, handles, metadatas, epersons, collections, wal)
             self._done.append("ws")
             self.serialize(cache_file)
 
@@ -153,21 +170,22 @@ class items:
             _logger.info("Skipping workflow import")
         else:
             if self._wf_items is not None:
-                self._wf_import_to(dspace, handles, metadatas, epersons, collections)
+                self._wf_import_to(dspace, handles, metadatas, epersons, collections, wal)
             self._done.append("wf")
             self.serialize(cache_file)
 
         if "item" in self._done:
             _logger.info("Skipping item import")
         else:
-            self._item_import_to(dspace, handles, metadatas, epersons, collections)
+            self._item_import_to(dspace, handles, metadatas, epersons, collections, wal, ids, shards,
+                                 stream)
             self._done.append("item")
             self.serialize(cache_file)
 
         if "itemcol" in self._done:
             _logger.info("Skipping itemcol import")
         else:
-            self._itemcol_import_to(dspace, handles, metadatas, epersons, collections)
+            self._itemcol_import_to(dspace, handles, metadatas, epersons, collections, wal)
             self._done.append("itemcol")
             self.serialize(cache_file)
 
@@ -227,33 +245,58 @@ class items:
 
         return True, ws_id
 
-    def _ws_import_to(self, dspace, handles, metadatas, epersons, collections):
+    def _ws_import_to(self, dspace, handles, metadatas, epersons, collections, wal):
         expected = len(self._ws_items or {})
         log_key = "workspaceitems"
         log_before_import(log_key, expected)
 
+        # replay workspace items created before the crash
+        for i_id, rec in wal.records("ws").items():
+            if i_id in self._ws_id2v7id:
+                continue
+            self._ws_id2v7id[i_id] = rec["x"]["ws_id"]
+            self._ws_id2uuid[i_id] = rec["uuid"]
+            self._id2uuid[i_id] = rec["uuid"]
+            self._imported["ws"] += 1
+
         for ws in progress_bar(self._ws_items):
+            if wal.done("ws", ws['item_id']):
+                continue
             item = self.item(ws['item_id'])
-            ret, _1 = self._import_item(dspace, ws, item, handles,
-                                        metadatas, epersons, collections, "workspace")
+            with span("workspaceitem", v5_id=ws['item_id']):
+                ret, ws_id = self._import_item(dspace, ws, item, handles,
+                                               metadatas, epersons, collections, "workspace")
             if ret:
                 self._imported["ws"] += 1
+                wal.append("ws", ws['item_id'], self.uuid(ws['item_id']), ws_id=ws_id)
 
         log_after_import(log_key, expected, self.imported_ws)
 
-    def _wf_import_to(self, dspace, handles, metadatas, epersons, collections):
+    def _wf_import_to(self, dspace, handles, metadatas, epersons, collections, wal):
         expected = len(self._wf_items or {})
         log_key = "workflowitems"
         log_before_import(log_key, expected)
 
+        # replay workflow items created before the crash
+        for i_id, rec in wal.records("wf").items():
+            if int(i_id) in self._wf_item_ids:
+                continue
+            self._id2uuid[i_id] = rec["uuid"]
+            self._wf_id2workflow_id[str(rec["x"]["workflow_id"])] = rec["x"]["workflowitem_id"]
+            self._wf_item_ids.append(int(i_id))
+            self._imported["wf"] += 1
+
         # create workflowitem
         # workflowitem is created from workspaceitem
         # -1, because the workflowitem doesn't contain this attribute
         for wf in progress_bar(self._wf_items):
             wf_id = wf['item_id']
+            if wal.done("wf", wf_id):
+                continue
             item = self.item(wf_id)
-            ret, ws_id = self._import_item(dspace, wf, item, handles,
-                                           metadatas, epersons, collections, "workflow")
+            with span("workflowitem", v5_id=wf_id):
+                ret, ws_id = self._import_item(dspace, wf, item, handles,
+                                               metadatas, epersons, collections, "workflow")
             if not ret:
                 continue
 
@@ -265,79 +308,158 @@ class items:
                                         ] = resp.headers['workflowitem_id']
                 self._wf_item_ids.append(wf_id)
                 self._imported["wf"] += 1
+                wal.append("wf", wf_id, self.uuid(wf_id), workflow_id=wf['workflow_id'],
+                           workflowitem_id=resp.headers['workflowitem_id'])
             except Exception as e:
                 _logger.error(f'put_wf_item: [{wf_id}] failed [{str(e)}]')
 
         log_after_import(log_key, expected, self.imported_wf)
 
-    def _item_import_to(self, dspace, handles, metadatas, epersons, collections):
+    def _item_import_to(self, dspace, handles, metadatas, epersons, collections, wal, ids=None, shards=1,
+                        stream=None):
         expected = len(self._items or {})
         log_key = "items"
         log_before_import(log_key, expected)
 
-        without_col = 0
+        # replay items created before the crash
+        self._imported["items"] += wal.replay_into("item", self._id2uuid)
 
-        ws_items = 0
-        wf_items = 0
+        if shards > 1 and ids is not None and stream is None:
+            stats = self._item_import_sharded(
+                dspace, handles, metadatas, epersons, collections, wal, ids, shards)
+        else:
+            stats = self._item_import_objs(
+                self._items, dspace, handles, metadatas, epersons, collections, wal, stream)
+        self._imported["items"] += stats.get("imported", 0)
 
-        # create other items
-        for item in progress_bar(self._items):
-            i_id = item['item_id']
+        without_col = stats.get("without_col", 0)
+        ws_items = stats.get("ws", 0)
+        wf_items = stats.get("wf", 0)
+        log_after_import(f'{log_key} no owning col:[{without_col}], ws items:[{ws_items}] wf items:[{wf_items}]',
+                         expected, self.imported + without_col + ws_items + wf_items)
 
-            # is it already imported in WS?
-            if str(i_id) in self._ws_id2v7id:
-                ws_items += 1
-                continue
-            if i_id in self._wf_item_ids:
-                wf_items += 1
-                continue
+    def _item_import_sharded(self, dspace, handles, metadatas, epersons, collections, wal, ids, shards):
+        """
+            Import items in `shards` worker processes, items of one owning collection
+            are imported by one worker.
+        """
+        todo = [x for x in self._items if not wal.done("item", x['item_id'])]
+        sh = sharded("items", "item", wal, ids, dspace)
+        stats = sh.run(
+            shard_by(todo, lambda x: x['owning_collection'], shards),
+            lambda objs, w: self._item_import_objs(
+                objs, dspace, handles, metadatas, epersons, collections, w))
+        created = sh.id2uuid()
+        for item in todo:
+            i_id = str(item['item_id'])
+            if i_id in created and i_id not in self._id2uuid:
+                self._id2uuid[i_id] = created[i_id]
+        return stats
+
+    def _item_import_objs(self, objs, dspace, handles, metadatas, epersons, collections, wal,
+                          stream=None) -> dict:
+        stats = {}
+        for item in progress_bar(objs):
+            with span("item", v5_id=item['item_id']):
+                res = self._item_import_one(item, dspace, handles, metadatas, epersons, collections, wal)
+            if res is not None:
+                stats[res] = stats.get(res, 0) + 1
+            if stream is not None and self.uuid(item['item_id']) is not None:
+                stream(item)
+        return stats
+
+    def import_one(self, item, dspace, handles, metadatas, epersons, collections, wal=None):
+        """
+            Import one archived item outside of `import_to` (e.g., delta migration).
+            @return: see `_item_import_one`
+        """
+        return self._item_import_one(item, dspace, handles, metadatas, epersons, collections, ensure_wal(wal))
 
-            data = {
-                'discoverable': item['discoverable'],
-                'inArchive': item['in_archive'],
-                'lastModified': item['last_modified'],
-                'withdrawn': item['withdrawn']
-            }
+    def _item_import_one(self, item, dspace, handles, metadatas, epersons, collections, wal):
+        """
+            Import one item.
+            @return: "imported", "error", "ws", "wf", "without_col", "invalid" or None if already done
+        """
+        i_id = item['item_id']
 
-            i_meta = metadatas.replace_meta_val(metadatas.value(
-                items.TYPE, i_id, None, True), self.replaced_fields)
-            if i_meta:
-                data['metadata'] = i_meta
+        # is it already imported in WS?
+        if str(i_id) in self._ws_id2v7id:
+            return "ws"
+        if i_id in self._wf_item_ids:
+            return "wf"
+        if wal.done("item", i_id):
+            return None
 
-            i_handle = handles.get(items.TYPE, i_id)
-            if i_handle is None:
-                _logger.critical(f"Cannot find handle for item [{i_id}]")
-                continue
+        err, params, data = self.item_payload(item, handles, metadatas, epersons, collections)
+        if err is not None:
+            return err
 
-            data['handle'] = i_handle
+        try:
+            resp = dspace.put_item(params, data)
+            self._id2uuid[str(i_id)] = resp['id']
+            wal.append("item", i_id, resp['id'])
+            return "imported"
+        except Exception as e:
+            _logger.error(f'put_item: [{i_id}] failed [{str(e)}]')
+        return "error"
 
-            if item['owning_collection'] is None:
-                _logger.critical(f"Item without collection [{i_id}] is not valid!")
-                without_col += 1
-                continue
+    def item_payload(self, item, handles, metadatas, epersons, collections):
+        """
+            Build `put_item` request of one archived item.
+            @return: (error, params, data), error is "without_col" or "invalid" if the item cannot be imported
+        """
+        i_id = item['item_id']
+        data = {
+            'discoverable': item['discoverable'],
+            'inArchive': item['in_archive'],
+            'lastModified': item['last_modified'],
+            'withdrawn': item['withdrawn']
+        }
 
-            col_uuid = collections.uuid(item['owning_collection'])
-            params = {
-                'owningCollection': col_uuid,
-                'epersonUUID': epersons.uuid(item['submitter_id']),
-            }
+        i_meta = metadatas.replace_meta_val(metadatas.value(
+            items.TYPE, i_id, None, True), self.replaced_fields)
+        if i_meta:
+            data['metadata'] = i_meta
 
-            if col_uuid is None:
-                _logger.critical(
-                    f"Item without collection [{i_id}] cannot be imported here")
-                continue
+        i_handle = handles.get(items.TYPE, i_id)
+        if i_handle is None:
+            _logger.critical(f"Cannot find handle for item [{i_id}]")
+            return "invalid", None, None
 
-            try:
-                resp = dspace.put_item(params, data)
-                self._id2uuid[str(i_id)] = resp['id']
-                self._imported["items"] += 1
-            except Exception as e:
-                _logger.error(f'put_item: [{i_id}] failed [{str(e)}]')
+        data['handle'] = i_handle
 
-        log_after_import(f'{log_key} no owning col:[{without_col}], ws items:[{ws_items}] wf items:[{wf_items}]',
-                         expected, self.imported + without_col + ws_items + wf_items)
+        if item['owning_collection'] is None:
+            _logger.critical(f"Item without collection [{i_id}] is not valid!")
+            return "without_col", None, None
+
+        col_uuid = collections.uuid(item['owning_collection'])
+        params = {
+            'owningCollection': col_uuid,
+            'epersonUUID': epersons.uuid(item['submitter_id']),
+        }
+
+        if col_uuid is None:
+            _logger.critical(
+                f"Item without collection [{i_id}] cannot be imported here")
+            return "invalid", None, None
+
+        return None, params, data
+
+    def unarchived_ids(self) -> set:
+        """
+            Ids of workspace and workflow items.
+        """
+        return {int(x['item_id']) for x in (self._ws_items or [])} | \
+            {int(x['item_id']) for x in (self._wf_items or [])}
 
-    def _itemcol_import_to(self, dspace, handles, metadatas, epersons, collections):
+    def archived_items(self) -> list:
+        """
+            Items imported in the item step (not workspace or workflow items).
+        """
+        unarchived = self.unarchived_ids()
+        return [x for x in self._items if x['item_id'] not in unarchived]
+
+    def _itemcol_import_to(self, dspace, handles, metadatas, epersons, collections, wal):
         # Find items which are mapped in more collections and store them into dictionary in this way
         # {'item_uuid': [collection_uuid_1, collection_uuid_2]}
         for col in self._col2item:
@@ -356,14 +478,20 @@ class items:
         log_key = "items coll"
         log_before_import(log_key, expected)
 
+        # replay mappings created before the crash
+        self._imported['cols'] += len(wal.records("itemcol"))
+
         # Call Vanilla REST endpoint which add relation between Item and Collection into the collection2item table
         for item_uuid, cols in progress_bar(to_import):
             if len(cols) < 2:
                 continue
+            if wal.done("itemcol", item_uuid):
+                continue
             try:
                 data = self._col_id2uuid[item_uuid]
                 dspace.put_item_to_col(item_uuid, data)
                 self._imported['cols'] += 1
+                wal.append("itemcol", item_uuid)
             except Exception as e:
                 _logger.error(f'put_item_to_col: [{item_uuid}] failed [{str(e)}]')
 
@@ -378,16 +506,16 @@ class items:
             "wf_items": self._wf_items,
             "col2item": self._col2item,
             "id2item": self._id2item,
-            "id2uuid": self._id2uuid,
+            "id2uuid": self._id2uuid.to_dict(),
             "ws_id2v7id": self._ws_id2v7id,
-            "ws_id2uuid": self._ws_id2uuid,
+            "ws_id2uuid": self._ws_id2uuid.to_dict(),
             "wf_id2uuid": self._wf_id2workflow_id,
             "wf_item_ids": self._wf_item_ids,
             "col_id2uuid": self._col_id2uuid,
             "imported": self._imported,
             "done": self._done,
             "versions": self._versions,
-            "migrated_versions": self._migrated_versions,
+            "migrated_versions": sorted(self._migrated_versions),
         }
         serialize(file_str, data)
 
@@ -398,16 +526,16 @@ class items:
         self._wf_items = data["wf_items"]
         self._col2item = data["col2item"]
         self._id2item = data["id2item"]
-        self._id2uuid = data["id2uuid"]
+        self._id2uuid = idmap(data["id2uuid"])
         self._ws_id2v7id = data["ws_id2v7id"]
-        self._ws_id2uuid = data["ws_id2uuid"]
+        self._ws_id2uuid = idmap(data["ws_id2uuid"])
         self._wf_id2workflow_id = data["wf_id2uuid"]
         self._wf_item_ids = data.get("wf_item_ids", [])
         self._col_id2uuid = data["col_id2uuid"]
         self._imported = data["imported"]
         self._done = data["done"]
         self._versions = data["versions"]
-        self._migrated_versions = data.get("migrated_versions", [])
+        self._migrated_versions = set(data.get("migrated_versions", []))
 
     def _migrate_versions(self, env, db7, db5_dspace, metadatas):
         _logger.info(
@@ -417,7 +545,7 @@ class items:
         admin_username = env["backend"]["user"]
         admin_uuid = db7.get_admin_uuid(admin_username)
 
-        self._migrated_versions = []
+        self._migrated_versions = set()
 
         # Get version date fields from project settings
         # Must be configured in project_settings.py as version_date_fields
@@ -427,19 +555,12 @@ class items:
             raise ValueError(
                 "version_date_fields configuration is required but not found in project settings")
 
-        # Migrate versions for every Item
-        for item_id, item in progress_bar(self._id2item.items()):
-            # Do not process versions of the item that have already been processed.
-            if item_id in self._migrated_versions:
-                continue
-
-            # This sequence contains handles of all versions of the Item ordered from the first version to the latest one
-            versions = self.get_all_versions(item_id, metadatas)
-
-            # Do not process item which does not have any version
-            if len(versions or []) == 0:
-                continue
+        # Every chain contains handles of all versions ordered from the first version to the latest one,
+        # items without any version are not part of any chain
+        chains = self.build_version_chains(metadatas)
 
+        # Migrate versions for every chain
+        for item_id, versions in progress_bar(chains.chains()):
             _logger.debug(f'Processing all versions for the item with ID: {item_id}')
 
             # All versions of this Item is going to be processed
@@ -539,7 +660,7 @@ SELECT setval('versionhistory_seq', {versionhistory_new_id})
                 # Update sequence
                 db7.exe_sql(f"SELECT setval('versionitem_seq', {versionitem_new_id})")
                 versionitem_new_id += 1
-                self._migrated_versions.append(str(item_id))
+                self._migrated_versions.add(str(item_id))
 
         _logger.info(
             f"Migrated versions [{len(self._migrated_versions or [])}]")
@@ -549,88 +670,15 @@ SELECT setval('versionhistory_seq', {versionhistory_new_id})
         self._migrate_versions(env, db7, db5_dspace, metadatas)
         self._check_sum(db7, db5_dspace, metadatas)
 
-    def get_newer_versions(self, item_id: int, metadatas):
-        return self._get_versions(item_id, metadatas, metadatas.V5_DC_RELATION_ISREPLACEDBY_ID)
-
-    def get_older_versions(self, item_id: int, metadatas):
-        return self._get_versions(item_id, metadatas, metadatas.V5_DC_RELATION_REPLACES_ID)
-
-    def _get_versions(self, item_id: int, metadatas, metadata_field: int):
-        """
-            Return all previous or newer versions of the item using connection between `dc.relation.replaces` and
-            `dc.relation.isreplacedby` item metadata.
-            @return: list of versions or empty list
-        """
-
-        def _get_version(cur_item_id):
-            item_versions = metadatas.value(items.TYPE, cur_item_id, metadata_field)
-            if len(item_versions or []) == 0:
-                # _logger.debug(f"Item [{cur_item_id}] does not have any version.")
-                return None
-            return item_versions[0]
-
-        versions = []
-        cur_item_id = item_id
-        visited = set()
-
-        cur_item_version = _get_version(cur_item_id)
-
-        while cur_item_version is not None:
-            if cur_item_version in visited:
-                _logger.warning(
-                    f"Detected cyclic version reference for handle: {cur_item_version}. Breaking loop.")
-                break
-            visited.add(cur_item_version)
-            versions.append(cur_item_version)
-
-            if cur_item_version not in metadatas.versions:
-                # Check if current item is withdrawn
-                cur_item = self._id2item.get(str(cur_item_id))
-                if cur_item['withdrawn']:
-                    _logger.debug(f'Item [{cur_item_version}] is withdrawn')
-                    self._versions["withdrawn"].append(cur_item_version)
-                else:
-                    _logger.error(
-                        f'The item with handle: {cur_item_version} has not been imported!')
-                    self._versions["not_imported"].append(cur_item_version)
-                break
-
-            next_item_id = metadatas.versions[cur_item_version]['item_id']
-            next_item_version = _get_version(next_item_id)
-            if next_item_version in visited:
-                versions.append(next_item_version)
-                break
-            cur_item_id = next_item_id
-            cur_item_version = next_item_version
-
-        return versions
-
-    def get_all_versions(self, item_id: int, metadatas):
+    def build_version_chains(self, metadatas):
         """
-            Return all versions of the item in ordered list from the first version to the latest including the handle of the
-            current Item
-            @return: list of the item versions or if the item doesn't have any version return None
+            Build version chains of all items, withdrawn and not imported versions are recorded.
         """
-        # The newer versions of the item
-        newer_versions = self.get_newer_versions(item_id, metadatas)
-        # The previous versions of the item
-        previous_versions = self.get_older_versions(item_id, metadatas)
-        # Previous versions are in wrong order - reverse the list
-        previous_versions = previous_versions[::-1]
-
-        # If this item does not have any version return a None
-        if not newer_versions and not previous_versions:
-            return None
-
-        # Get handle of the current Item
-        cur_handle = metadatas.value(
-            items.TYPE, item_id, metadatas.V5_DC_IDENTIFIER_URI_ID)
-        if len(cur_handle or []) == 0:
-            _logger.error(f'Cannot find handle for the item with id: {item_id}')
-            self._versions["not_imported_handles"].append(item_id)
-            return None
-
-        return previous_versions + [cur_handle[0]] + newer_versions
+        chains = version_chains(self._id2item, metadatas, items.TYPE)
+        self._versions["withdrawn"] += chains.withdrawn
+        self._versions["not_imported"] += chains.not_imported
+        self._versions["not_imported_handles"] += chains.not_imported_handles
+        return chains
 
     def _check_sum(self, db7, db5_dspace, metadatas):
         """
@@ -662,7 +710,7 @@ SELECT setval('versionhistory_seq', {versionhistory_new_id})
         for uuid7 in clarin_7_item_uuids:
             if uuid7 in clarin_5_ids_to_uuid:
                 continue
-            if uuid7 in self._ws_id2uuid.values():
+            if self._ws_id2uuid.has_uuid(uuid7):
                 continue
             # if item is in wf/ws it will have the relation stored in versionitem
             # in v5, we stored it after item installation
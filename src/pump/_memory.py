@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import logging
+import threading
+import tracemalloc
+
+from ._perf import _rss, _peak_rss
+
+_logger = logging.getLogger("pump.memory")
+
+
+def deep_size(obj, sample: int = 100, _seen: set = None) -> int:
+    """
+        Estimated size of the object with everything it contains in bytes,
+        containers with more than `sample` elements are extrapolated from evenly spaced elements.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        elems = obj.items()
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        elems = obj
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        return size + deep_size(vars(obj), sample, _seen)
+    else:
+        return size
+
+    n = len(elems)
+    if n == 0:
+        return size
+    step = max(1, n // sample)
+    measured = 0
+    cnt = 0
+    for i, x in enumerate(elems):
+        if i % step != 0:
+            continue
+        if isinstance(obj, dict):
+            measured += deep_size(x[0], sample, _seen) + deep_size(x[1], sample, _seen)
+        else:
+            measured += deep_size(x, sample, _seen)
+        cnt += 1
+    return size + int(measured * n / cnt)
+
+
+class memory:
+    """
+        Opt-in memory accounting, it is a scheduler hook.
+
+        `tracemalloc` is started when created (so it should be created before the repo),
+        at the end of every phase the RSS, traced current/peak memory, top allocation sites
+        and the growth since the previous snapshot are logged and stored into the report,
+        together with estimated sizes of the big repo structures (only those already created).
+        With `--parallel` the growth between snapshots includes concurrently running phases.
+    """
+
+    # repo entity, attribute
+    structures = [
+        ("metadatas", "_values"),
+        ("items", "_id2item"),
+        ("handles", "_handles"),
+        ("bitstreams", "_bs"),
+    ]
+
+    def __init__(self, repo=None, file_str: str = None, frames: int = 1, top: int = 15):
+        self._repo = repo
+        self._file_str = file_str
+        self._top = top
+        self._lock = threading.Lock()
+        self._prev = None
+        self.phases = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, frames))
+        _logger.info(f"Tracing memory allocations with [{frames}] frames")
+
+    def set_repo(self, repo):
+        self._repo = repo
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+
+    def structure_sizes(self) -> dict:
+        res = {}
+        if self._repo is None:
+            return res
+        for name, attr in memory.structures:
+            # do not create the entity
+            obj = self._repo.__dict__.get(name, None)
+            if obj is None or not hasattr(obj, attr):
+                continue
+            res[f"{name}.{attr}"] = deep_size(getattr(obj, attr))
+        return res
+
+    @staticmethod
+    def _site(stat) -> str:
+        frame = stat.traceback[0]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+    # ============= scheduler hook
+
+    def phase_start(self, p):
+        with self._lock:
+            if self._prev is None:
+                self._prev = self._snapshot()
+        tracemalloc.reset_peak()
+
+    def phase_end(self, p):
+        cur, peak = tracemalloc.get_traced_memory()
+        snap = self._snapshot()
+        with self._lock:
+            prev, self._prev = self._prev, snap
+        top = snap.statistics("lineno")[:self._top]
+        growth = snap.compare_to(prev, "lineno")[:self._top] if prev is not None else []
+        rec = {
+            "name": p.name,
+            "rss": _rss(),
+            "peak_rss": _peak_rss(),
+            "traced": cur,
+            "traced_peak": peak,
+            "top": [{"site": self._site(x), "size": x.size, "count": x.count} for x in top],
+            "growth": [{"site": self._site(x), "size_diff": x.size_diff, "size": x.size}
+                       for x in growth if x.size_diff != 0],
+            "structures": self.structure_sizes(),
+        }
+        with self._lock:
+            self.phases.append(rec)
+        self.log(rec)
+        if self._file_str is not None:
+            self.save(self._file_str)
+
+    # =============
+
+    @staticmethod
+    def log(rec: dict):
+        def mb(v):
+            return "-" if v is None else f"{v / (1 << 20):.1f}MB"
+
+        msg = f"Memory after phase [{rec['name']}] rss:[{mb(rec['rss'])}] peak rss:[{mb(rec['peak_rss'])}] " \
+              f"traced:[{mb(rec['traced'])}] traced peak:[{mb(rec['traced_peak'])}]\n"
+        if len(rec["structures"]) > 0:
+            msg += "Structures: " + " ".join(f"{k}:[{mb(v)}]" for k, v in rec["structures"].items()) + "\n"
+        msg += "Top allocation sites:\n"
+        for x in rec["top"]:
+            msg += f"{mb(x['size']): >12} {x['count']: >10d}  {x['site']}\n"
+        msg += "Growth since the previous snapshot:\n"
+        for x in rec["growth"]:
+            msg += f"{'+' if x['size_diff'] > 0 else '-'}{mb(abs(x['size_diff'])): >11}  {x['site']}\n"
+        _logger.info(msg)
+
+    def save(self, file_str: str):
+        with self._lock:
+            phases = list(self.phases)
+        os.makedirs(os.path.dirname(file_str) or ".", exist_ok=True)
+        tmp_file = f"{file_str}.tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as fout:
+            json.dump({"phases": phases}, fout, indent=2)
+        os.replace(tmp_file, file_str)
+
+    def close(self):
+        tracemalloc.stop()
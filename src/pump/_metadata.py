@@ -1,121 +1,367 @@
-import logging
+import os
 import re
+import logging
+import logging.handlers
+import multiprocessing
+import queue as queue_lib
 from typing import Optional
 
+from ._pushdown import pushdown
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
 
 _logger = logging.getLogger("pump.metadata")
 
 
-def _metadatavalue_process(repo, v5data: list, v7data: list):
+def _norm_lic(text):
+    # normalize it, not 100% because of licence-UD-2.2
+    return text.split('/')[-1].split('.')[0]
+
+
+def _norm_text(text):
+    # this should not be a reasonable list of replacements but rather
+    # instance specific use cases
+    return text.replace("\u2028", "\n").rstrip()
+
+
+class _metadatavalue_validator:
     """
-        v5: ['COLLECTION_17_DEFAULT_READ', 'COLLECTION_20_WORKFLOW_STEP_2']
-        v7: ['COLLECTION_f3c65f29-355e-4ca2-a05b-f3e30883e09f_BITSTREAM_DEFAULT_READ']
+        Compare normalized metadata values of v5 and v7.
+
+        Rows of both databases are streamed in chunks and partitioned by the resource uuid
+        into spawned worker processes. Every worker normalizes its rows, ignores `dc.date.issued`
+        of resources having `local.approximateDate.issued` (indexed by uuid) and computes
+        its part of only in v5/only in v7 - all values of a resource are in one partition,
+        so the parts are simply merged.
+
+        If the differ allows it, the text and field normalization runs in SQL (`_pushdown5`, `_pushdown7`)
+        and only uuids of v5 objects and the date cleanup are left to the workers.
     """
-    if repo is None:
-        _logger.critical(
-            "Cannot validate using _metadatavalue_process because repo is None")
-        return None, None
 
-    def norm_lic(text):
-        # normalize it, not 100% because of licence-UD-2.2
-        return text.split('/')[-1].split('.')[0]
+    sql5 = "select resource_id, resource_type_id, text_value, metadata_field_id from metadatavalue"
+    sql7 = "select dspace_object_id, text_value, metadata_field_id from metadatavalue"
 
-    def norm_text(text):
-        # this should not be a reasonable list of replacements but rather
-        # instance specific use cases
-        return text.replace("\u2028", "\n").rstrip()
+    CHUNK = 10000
+    processes = min(4, os.cpu_count() or 1)
 
     rec_complex_funds = re.compile("(euFunds|nationalFunds|ownFunds|@@Other)")
-    v5data_new = []
-    V5_FIELD_ID_APPROX_DATE = repo.metadatas.get_field_id_by_name_v5(
-        "approximateDate.issued")
-    specific_fields = {
-        V5_FIELD_ID_APPROX_DATE: [],
-        repo.metadatas.V5_DATE_ISSUED: [],
-    }
-
-    for res_id, res_type_id, text, field_id in v5data:
-        # ignore '0000', 15 -> we do not store unknown dates
-        if field_id == repo.metadatas.V5_DATE_ISSUED and text == "0000":
-            continue
-
-        # ignore file preview in metadata
-        if field_id in repo.metadatas.ignored_fields or field_id in repo.metadatas.replaced_fields:
-            continue
-
-        uuid = repo.uuid(res_type_id, res_id)
-        if uuid is None:
-            _logger.debug(
-                f"Cannot find uuid for [{res_type_id}] [{res_id}] [{str(text)}]")
-
-        if field_id in specific_fields.keys():
-            specific_fields[field_id].append(uuid)
-
-        field_id_v7 = repo.metadatas.get_field_id(field_id)
-        #
+
+    def __init__(self, repo):
+        self._repo = repo
+        m = repo.metadatas
+        # resolved before starting the workers, they do not get the repo
+        self._fields_id2v7id = m.fields_id2v7id
+        self._v5_approx_date = m.get_field_id_by_name_v5("approximateDate.issued")
+        self._v5_date_issued = m.V5_DATE_ISSUED
+        self._v5_skipped = set(m.ignored_fields) | set(m.replaced_fields)
+        self._v7_date_issued = m.V7_FIELD_DATE_ISSUED
+        self._v7_lic = m.V7_FIELD_ID_LIC
+        self._v7_title = m.V7_FIELD_ID_TITLE
+        self._v7_provenance = m.V7_FIELD_ID_PROVENANCE
+        self._v7_lang_added = m.V7_FIELD_LANG_ADDED
+        self._v7_identifier_uri = m.V7_FIELD_ID_IDENTIFIER_URI
+        self._group_type = repo.groups.TYPE
+        self._pushed = False
+
+    def __getstate__(self):
+        # sent to spawned worker processes
+        state = dict(self.__dict__)
+        state["_repo"] = None
+        return state
+
+    @staticmethod
+    def _sql_norm_text(col: str) -> str:
+        return f"regexp_replace(replace({col}, U&'\\2028', E'\\n'), '\\s+$', '')"
+
+    @staticmethod
+    def _sql_norm_lic(col: str) -> str:
+        return f"split_part(regexp_replace({col}, '^.*/', ''), '.', 1)"
+
+    def _pushdown5(self) -> pushdown:
+        def part(i: int) -> str:
+            return f"split_part({{text}}, '@@', {i})"
+        parts_n = "(length({text}) - length(replace({text}, '@@', ''))) / 2 + 1"
+        steps = [
+            # ignore '0000', 15 -> we do not store unknown dates
+            ["filter", f"NOT ({{field_v5}} = {self._v5_date_issued} AND coalesce({{text}}, '') = '0000')"],
+        ]
+        if len(self._v5_skipped) > 0:
+            # ignore file preview in metadata
+            steps.append(["filter", f"{{field_v5}} <> ALL(ARRAY[{','.join(str(x) for x in self._v5_skipped)}])"])
+        steps += [
+            ["lookup", "field", "{field_v5}", lambda repo: repo.metadatas.fields_id2v7id],
+            ["expr", "field", "{field}::int"],
+            ["expr", "text", "coalesce({text}, '')"],
+            ["expr", "text",
+             "CASE WHEN position('@@' in {text}) = 0 THEN {text} "
+             f"WHEN {{field}} IS DISTINCT FROM {self._v7_provenance} AND {parts_n} = 5 THEN "
+             f"{part(4)} || ';' || {part(2)} || ';' || {part(1)} || ';' || {part(3)} || ';' || {part(5)} "
+             f"WHEN {{field}} IS DISTINCT FROM {self._v7_provenance} AND {parts_n} = 4 "
+             f"AND {{text}} ~ '{self.rec_complex_funds.pattern}' THEN "
+             f"{part(4)} || ';' || {part(2)} || ';' || {part(1)} || ';' || {part(3)} || ';' "
+             "ELSE replace({text}, '@@', ';') END"],
+            ["expr", "text", f"CASE WHEN {{field}} = {self._v7_lic} THEN {self._sql_norm_lic('{text}')} "
+                             "ELSE {text} END"],
+            # groups have titles in table
+            ["filter", f"({{field}} IS DISTINCT FROM {self._v7_title} OR {{res_type_id}} <> {self._group_type})"],
+            ["expr", "text", self._sql_norm_text("{text}")],
+        ]
+        return pushdown(["res_id", "res_type_id", "text", "field_v5"], steps,
+                        ["res_id", "res_type_id", "text", "field", "field_v5"])
+
+    def _pushdown7(self) -> pushdown:
+        return pushdown(["uuid", "text", "field"], [
+            # added language description in addition to language code
+            ["filter", f"{{field}} <> {self._v7_lang_added}"],
+            ["expr", "text", "coalesce({text}, '')"],
+            ["expr", "text", f"CASE WHEN {{field}} = {self._v7_lic} THEN {self._sql_norm_lic('{text}')} "
+                             "ELSE {text} END"],
+            ["expr", "text", f"CASE WHEN {{field}} = {self._v7_identifier_uri} THEN "
+                             "replace({text}, 'http://dev-5.pc:88/handle/', 'http://hdl.handle.net/') "
+                             "ELSE {text} END"],
+            ["expr", "text", self._sql_norm_text("{text}")],
+        ])
+
+    def _compile(self, diff, db5):
+        """
+            SQL of both sides normalized in the databases if possible.
+        """
+        self._pushed = False
+        if not diff.pushdown:
+            return self.sql5, self.sql7
+        try:
+            sql5 = self._pushdown5().compile(self.sql5, self._repo)
+            sql7 = self._pushdown7().compile(self.sql7, self._repo)
+            pushdown.probe(db5, sql5)
+            pushdown.probe(diff.raw_db_7, sql7)
+        except Exception as e:
+            _logger.warning(f"Cannot normalize metadata values in SQL, normalizing in Python: [{str(e)}]")
+            return self.sql5, self.sql7
+        self._pushed = True
+        return sql5, sql7
+
+    def _norm5(self, res_type_id: int, text: str, field_id: int):
+        """
+            v7 field id and text of v5 value or None if the value is ignored.
+        """
+        field_id_v7 = self._fields_id2v7id[str(field_id)]
+        text = text or ""
         if "@@" in text:
             splits = text.split("@@")
             new_splits = splits
 
-            if field_id_v7 not in (repo.metadatas.V7_FIELD_ID_PROVENANCE,):
+            if field_id_v7 not in (self._v7_provenance,):
                 if len(splits) == 5:
                     new_splits = [splits[-2], splits[1], splits[0], splits[2], splits[-1]]
                 # special case - older complex field impl.
-                elif len(splits) == 4 and rec_complex_funds.search(text) is not None:
+                elif len(splits) == 4 and self.rec_complex_funds.search(text) is not None:
                     new_splits = [splits[3], splits[1], splits[0], splits[2], '']
             text = ";".join(new_splits)
 
         # license def
-        if field_id_v7 == repo.metadatas.V7_FIELD_ID_LIC:
-            text = norm_lic(text)
+        if field_id_v7 == self._v7_lic:
+            text = _norm_lic(text)
 
         # groups have titles in table
-        if field_id_v7 == repo.metadatas.V7_FIELD_ID_TITLE and res_type_id == repo.groups.TYPE:
-            continue
-
-        text = norm_text(text)
-        v5data_new.append((uuid, text, field_id_v7))
-
-    # cleanup
-    # has local.approximateDate.issued -> ignore dc.date.issued
-    to_check_dates_uuids = set(specific_fields[V5_FIELD_ID_APPROX_DATE]).intersection(
-        set(specific_fields[repo.metadatas.V5_DATE_ISSUED])
-    )
-    for to_check_uuid in to_check_dates_uuids:
-        for i, v in enumerate(v5data_new):
-            if v is None:
-                continue
-            if to_check_uuid == v[0] and v[2] == repo.metadatas.V7_FIELD_DATE_ISSUED:
-                v5data_new[i] = None
-                break
-    v5data_new = [x for x in v5data_new if x is not None]
+        if field_id_v7 == self._v7_title and res_type_id == self._group_type:
+            return None
+        return field_id_v7, _norm_text(text)
 
-    v7data_new = []
-    for uuid, text, field_id in v7data:
+    def _norm7(self, text: str, field_id: int):
         # added language description in addition to language code
-        if field_id == repo.metadatas.V7_FIELD_LANG_ADDED:
-            continue
-
-        # should be already ignored # imported preview data
-        # if field_id == 147:
-        #     continue
+        if field_id == self._v7_lang_added:
+            return None
 
+        text = text or ""
         # license def
-        if field_id == repo.metadatas.V7_FIELD_ID_LIC:
-            text = norm_lic(text)
+        if field_id == self._v7_lic:
+            text = _norm_lic(text)
 
-        if field_id == repo.metadatas.V7_FIELD_ID_IDENTIFIER_URI:
+        if field_id == self._v7_identifier_uri:
             text = text.replace("http://dev-5.pc:88/handle/", "http://hdl.handle.net/")
+        return field_id, _norm_text(text)
+
+    @staticmethod
+    def _partition() -> dict:
+        # has local.approximateDate.issued -> ignore dc.date.issued
+        return {"v5": [], "v7": set(), "v7_n": 0, "approx": set(), "issued": set(), "first_issued": {}}
 
-        text = norm_text(text)
-        v7data_new.append((uuid, text, field_id))
+    def _add(self, part: dict, kind: int, rows: list):
+        """
+            Normalize rows (with v5 ids already mapped to uuids) into the partition.
+        """
+        v5, approx, issued, first_issued = part["v5"], part["approx"], part["issued"], part["first_issued"]
+        if kind == 7:
+            for uuid, text, field_id in rows:
+                val = (field_id, text) if self._pushed else self._norm7(text, field_id)
+                if val is not None:
+                    part["v7_n"] += 1
+                    part["v7"].add((uuid, val[1], val[0]))
+            return
+        if self._pushed:
+            # already filtered and normalized
+            for uuid, res_type_id, text, field_id_v7, field_id in rows:
+                if field_id == self._v5_approx_date:
+                    approx.add(uuid)
+                elif field_id == self._v5_date_issued:
+                    issued.add(uuid)
+                if field_id_v7 == self._v7_date_issued and uuid not in first_issued:
+                    first_issued[uuid] = len(v5)
+                v5.append((uuid, text, field_id_v7))
+            return
+        for uuid, res_type_id, text, field_id in rows:
+            # ignore '0000', 15 -> we do not store unknown dates
+            if field_id == self._v5_date_issued and text == "0000":
+                continue
+            # ignore file preview in metadata
+            if field_id in self._v5_skipped:
+                continue
+            if field_id == self._v5_approx_date:
+                approx.add(uuid)
+            elif field_id == self._v5_date_issued:
+                issued.add(uuid)
+            val = self._norm5(res_type_id, text, field_id)
+            if val is None:
+                continue
+            if val[0] == self._v7_date_issued and uuid not in first_issued:
+                first_issued[uuid] = len(v5)
+            v5.append((uuid, val[1], val[0]))
+
+    def _result(self, part: dict) -> dict:
+        v5 = part["v5"]
+        for uuid in part["approx"] & part["issued"]:
+            pos = part["first_issued"].get(uuid, None)
+            if pos is not None:
+                v5[pos] = None
+        v5 = [x for x in v5 if x is not None]
+        res = {"v5": len(v5), "v7": part["v7_n"]}
+        v5 = set(v5)
+        res["only_in_5"] = list(v5.difference(part["v7"]))
+        res["only_in_7"] = list(part["v7"].difference(v5))
+        return res
+
+    def compare(self, rows5: list, rows7: list) -> dict:
+        """
+            Compare values of a few objects in process (v5 rows with uuids), see `_sampling`.
+        """
+        part = self._partition()
+        self._add(part, 5, rows5)
+        self._add(part, 7, rows7)
+        return self._result(part)
+
+    def _worker(self, queue_in, queue_out):
+        # log records are sent to the parent which emits them in the validation job
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(logging.handlers.QueueHandler(queue_out))
+        root.setLevel(logging.INFO)
+
+        res = {"v5": 0, "v7": 0, "only_in_5": [], "only_in_7": [], "error": None}
+        try:
+            part = self._partition()
+            while True:
+                msg = queue_in.get()
+                if msg is None:
+                    break
+                self._add(part, *msg)
+            res.update(self._result(part))
+        except Exception as e:
+            _logger.critical(f"Validation process [{multiprocessing.current_process().name}] failed: [{str(e)}]")
+            res["error"] = str(e)
+        queue_out.put(res)
 
-    _logger.info(
-        f"Changed v5 metadata values to match v7: {len(v5data)} -> {len(v5data_new)}")
-    _logger.info(
-        f"Changed v7 metadata values to match v7: {len(v7data)} -> {len(v7data_new)}")
-    return v5data_new, v7data_new
+    @staticmethod
+    def _put(queue, proc, item):
+        while True:
+            try:
+                queue.put(item, timeout=5)
+                return
+            except queue_lib.Full:
+                if not proc.is_alive():
+                    raise RuntimeError(f"Validation process [{proc.name}] died")
+
+    def _feed(self, queues, procs, kind: int, rows, key_fnc) -> int:
+        """
+            Send rows in chunks to the partitions of their uuid.
+        """
+        n = len(queues)
+        bufs = [[] for _1 in range(n)]
+        cnt = 0
+        for row in rows:
+            row = key_fnc(row)
+            pos = hash(row[0]) % n
+            bufs[pos].append(row)
+            cnt += 1
+            if len(bufs[pos]) >= self.CHUNK:
+                self._put(queues[pos], procs[pos], (kind, bufs[pos]))
+                bufs[pos] = []
+        for pos, buf in enumerate(bufs):
+            if len(buf) > 0:
+                self._put(queues[pos], procs[pos], (kind, buf))
+        return cnt
+
+    def validate(self, diff, db5, table_name: str):
+        uuids = {}
+
+        def with_uuid(row):
+            res_id, res_type_id, text = row[0], row[1], row[2]
+            key = (res_type_id, res_id)
+            if key not in uuids:
+                uuids[key] = self._repo.uuid(res_type_id, res_id)
+                if uuids[key] is None:
+                    _logger.debug(f"Cannot find uuid for [{res_type_id}] [{res_id}] [{str(text)}]")
+            return (uuids[key],) + tuple(row[1:])
+
+        sql5, sql7 = self._compile(diff, db5)
+
+        n = max(1, self.processes)
+        # not forked - validations run in threads next to open database connections
+        ctx = multiprocessing.get_context("spawn")
+        queues = [ctx.Queue(maxsize=4) for _1 in range(n)]
+        queue_out = ctx.Queue()
+        procs = [ctx.Process(target=self._worker, args=(q, queue_out), name=f"validate-{table_name}-{i}")
+                 for i, q in enumerate(queues)]
+        for p in procs:
+            p.start()
+        parts = []
+        finished = False
+        try:
+            len5 = self._feed(queues, procs, 5, db5.fetch_iter(sql5, self.CHUNK), with_uuid)
+            len7 = self._feed(queues, procs, 7, diff.raw_db_7.fetch_iter(sql7, self.CHUNK), lambda x: x)
+            for q, p in zip(queues, procs):
+                self._put(q, p, None)
+            while len(parts) < n:
+                try:
+                    msg = queue_out.get(timeout=5)
+                except queue_lib.Empty:
+                    if not any(p.is_alive() for p in procs) and queue_out.empty():
+                        break
+                    continue
+                if isinstance(msg, logging.LogRecord):
+                    logging.getLogger(msg.name).handle(msg)
+                    continue
+                parts.append(msg)
+            finished = True
+        finally:
+            for p in procs:
+                if finished:
+                    p.join(timeout=5)
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+
+        errors = [x["error"] for x in parts if x["error"] is not None]
+        if len(errors) > 0 or len(parts) < n:
+            _logger.critical(f"Validation of [{table_name}] failed in [{n - len(parts) + len(errors)}] "
+                             f"of [{n}] processes: {errors}")
+            return
+        only_in_5 = [x for part in parts for x in part["only_in_5"]]
+        only_in_7 = [x for part in parts for x in part["only_in_7"]]
+        _logger.info(
+            f"Changed v5 metadata values to match v7: {len5} -> {sum(x['v5'] for x in parts)}")
+        _logger.info(
+            f"Changed v7 metadata values to match v7: {len7} -> {sum(x['v7'] for x in parts)}")
+        diff._cmp_values(table_name, None, only_in_5, None, only_in_7, False, (len5, len7))
 
 
 class metadatas:
@@ -131,12 +377,7 @@ class metadatas:
             "compare": ["element", "qualifier"],
         }],
         ["metadatavalue", {
-            "sql": {
-                "5": "select resource_id, resource_type_id, text_value, metadata_field_id from metadatavalue",
-                "7": "select dspace_object_id, text_value, metadata_field_id from metadatavalue",
-                "compare": None,
-                "process": _metadatavalue_process,
-            }
+            "validator": _metadatavalue_validator,
         }],
     ]
 
@@ -680,6 +921,27 @@ class metadatas:
 
         return res_d
 
+    def texts(self, res_type_id: int, field_ids: list) -> dict:
+        """
+            Get text values of `field_ids` for all objects of one type in one pass.
+            @return: {res_id (str): {field_id: [text_value, ...]}}
+        """
+        field_ids = set(field_ids)
+        res_d = {}
+        for res_id, vals in self._values.get(str(res_type_id), {}).items():
+            for x in vals:
+                field_id = x['metadata_field_id']
+                if field_id not in field_ids:
+                    continue
+                if not (self.exists_field(field_id) or field_id in self.replaced_fields):
+                    continue
+                res_d.setdefault(res_id, {}).setdefault(field_id, []).append(x['text_value'])
+        return res_d
+
+    @property
+    def fields_id2v7id(self) -> dict:
+        return self._fields_id2v7id
+
     def exists_field(self, id: int) -> bool:
         return str(id) in self._fields_id2v7id
 
@@ -0,0 +1,240 @@
+import os
+import re
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time as time_fnc, process_time
+
+from ._perf import perf, sql_statements, _rss, _peak_rss
+
+_logger = logging.getLogger("pump.metrics")
+
+_id_segment = re.compile(r"^([0-9]+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$")
+
+
+def _endpoint(command: str) -> str:
+    """
+        REST command without ids and query (`core/items/<uuid>/bundles` -> `core/items/:id/bundles`).
+    """
+    path = (command or "").split("?")[0].strip("/")
+    return "/".join(":id" if _id_segment.match(x) else x for x in path.split("/"))
+
+
+def _label(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class metrics:
+    """
+        Live metrics of a running import in Prometheus text format, written periodically
+        into a textfile (node_exporter textfile collector) and/or served over HTTP.
+
+        It is a scheduler hook (running phases and their durations) and a REST listener
+        (requests, latencies, in-flight requests); objects per phase are taken
+        from `perf`, created objects from WAL, SQL statements from `db`
+        and gauges (e.g., pipeline queue depths) are added by `add_gauge`.
+    """
+
+    PREFIX = "dspace_import"
+
+    # upper bounds of REST latency histogram buckets (seconds)
+    BUCKETS = [0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.]
+
+    def __init__(self, wal=None, file_str: str = None, port: int = None, interval: float = 15.):
+        self._wal = wal
+        self._file_str = file_str
+        self._port = port
+        self._interval = max(1., interval)
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._gauges = {}
+        self._requests = {}
+        self._errors = {}
+        self._latency = {}
+        self._in_flight = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    # ============= scheduler hook
+
+    def phase_start(self, p):
+        with self._lock:
+            self._phases[p.name] = {"start": time_fnc(), "end": None, "error": None}
+
+    def phase_end(self, p):
+        with self._lock:
+            rec = self._phases.setdefault(p.name, {"start": p.start, "end": None, "error": None})
+            rec["end"] = time_fnc()
+            rec["error"] = p.error
+
+    # ============= REST listener
+
+    def request_start(self, method: str, command: str):
+        with self._lock:
+            self._in_flight += 1
+        return method, _endpoint(command), time_fnc()
+
+    def request_end(self, token, response, error):
+        method, endpoint, start = token
+        took = time_fnc() - start
+        if error is not None:
+            status = "error"
+        else:
+            status = str(getattr(response, "status_code", "none"))
+        with self._lock:
+            self._in_flight -= 1
+            key = (method, endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if error is not None or not status.startswith("2"):
+                self._errors[method] = self._errors.get(method, 0) + 1
+            hist = self._latency.setdefault(method, {"buckets": [0] * len(metrics.BUCKETS), "sum": 0., "count": 0})
+            for i, le in enumerate(metrics.BUCKETS):
+                if took <= le:
+                    hist["buckets"][i] += 1
+            hist["sum"] += took
+            hist["count"] += 1
+
+    # =============
+
+    def add_gauge(self, name: str, fnc, label: str = None, help_str: str = ""):
+        """
+            Gauge evaluated on every export, `fnc` returns a number or (with `label`) a dict label value -> number.
+        """
+        with self._lock:
+            self._gauges[name] = (fnc, label, help_str)
+
+    def remove_gauge(self, name: str):
+        with self._lock:
+            self._gauges.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_str: str, samples: list):
+            name = f"{metrics.PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help_str}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, v in samples:
+                lbl = ",".join(f'{k}="{_label(x)}"' for k, x in labels.items())
+                lines.append(f"{name}{suffix}{'{' + lbl + '}' if lbl else ''} {v}")
+
+        now = time_fnc()
+        with self._lock:
+            phases = {k: dict(v) for k, v in self._phases.items()}
+            requests = dict(self._requests)
+            errors = dict(self._errors)
+            latency = {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]}
+                       for k, v in self._latency.items()}
+            in_flight = self._in_flight
+            gauges = dict(self._gauges)
+
+        metric("phase_running", "gauge", "Phase is running (1) or finished (0)",
+               [("", {"phase": k}, 1 if v["end"] is None else 0) for k, v in phases.items()])
+        metric("phase_failed", "gauge", "Phase finished with an error",
+               [("", {"phase": k}, 1 if v["error"] is not None else 0) for k, v in phases.items()])
+        metric("phase_duration_seconds", "gauge", "Duration of the phase (so far if running)",
+               [("", {"phase": k}, round((v["end"] or now) - v["start"], 3)) for k, v in phases.items()])
+        objects = perf.instance().objects()
+        metric("phase_objects_total", "counter", "Objects imported by the phase (logged after import)",
+               [("", {"phase": k}, v[0]) for k, v in objects.items()])
+        metric("phase_objects_failed_total", "counter", "Objects expected but not imported by the phase",
+               [("", {"phase": k}, v[1]) for k, v in objects.items()])
+
+        if self._wal is not None:
+            created = []
+            for type_name in self._wal.types():
+                created.append(("", {"type": type_name}, len(self._wal.records(type_name))))
+            metric("created_objects_total", "counter", "Objects created in v7 (write-ahead log records)", created)
+
+        metric("rest_requests_total", "counter", "REST requests by method, endpoint and status",
+               [("", {"method": m, "endpoint": e, "status": s}, v) for (m, e, s), v in sorted(requests.items())])
+        metric("rest_request_errors_total", "counter", "REST requests which raised or did not return 2xx",
+               [("", {"method": m}, v) for m, v in sorted(errors.items())])
+        metric("rest_requests_in_flight", "gauge", "REST requests being processed", [("", {}, in_flight)])
+        samples = []
+        for m, hist in sorted(latency.items()):
+            for le, cnt in zip(metrics.BUCKETS, hist["buckets"]):
+                samples.append(("_bucket", {"method": m, "le": le}, cnt))
+            samples.append(("_bucket", {"method": m, "le": "+Inf"}, hist["count"]))
+            samples.append(("_sum", {"method": m}, round(hist["sum"], 6)))
+            samples.append(("_count", {"method": m}, hist["count"]))
+        metric("rest_request_seconds", "histogram", "Latency of REST requests", samples)
+
+        metric("db_statements_total", "counter", "SQL statements executed", [("", {}, sql_statements.value)])
+
+        for name, (fnc, label, help_str) in sorted(gauges.items()):
+            try:
+                v = fnc()
+            except Exception as e:
+                _logger.warning(f"Gauge [{name}] failed: [{str(e)}]")
+                continue
+            if label is None:
+                metric(name, "gauge", help_str, [("", {}, v)])
+            else:
+                metric(name, "gauge", help_str, [("", {label: k}, x) for k, x in sorted(v.items())])
+
+        metric("process_resident_memory_bytes", "gauge", "Resident memory", [("", {}, _rss() or 0)])
+        metric("process_peak_resident_memory_bytes", "gauge", "Peak resident memory", [("", {}, _peak_rss() or 0)])
+        metric("process_cpu_seconds_total", "counter", "CPU time of the process", [("", {}, round(process_time(), 3))])
+        return "\n".join(lines) + "\n"
+
+    # ============= exporters
+
+    def write(self):
+        tmp_file = f"{self._file_str}.tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as fout:
+            fout.write(self.render())
+        os.replace(tmp_file, self._file_str)
+
+    def _write_loop(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.write()
+            except Exception as e:
+                _logger.error(f"Cannot write metrics into [{self._file_str}]: [{str(e)}]")
+
+    def _serve(self):
+        m = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = m.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("", self._port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        _logger.info(f"Serving metrics on port [{self._server.server_address[1]}]")
+
+    def start(self):
+        if self._port is not None:
+            self._serve()
+        if self._file_str is not None:
+            os.makedirs(os.path.dirname(self._file_str) or ".", exist_ok=True)
+            self._thread = threading.Thread(target=self._write_loop, name="metrics-file", daemon=True)
+            self._thread.start()
+            _logger.info(f"Writing metrics into [{self._file_str}] every [{self._interval}] seconds")
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            # final state
+            self.write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
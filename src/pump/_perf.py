@@ -0,0 +1,256 @@
+import os
+import json
+import logging
+import threading
+from time import time as time_fnc, process_time, thread_time
+
+_logger = logging.getLogger("pump.perf")
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class counter:
+    """
+        Thread safe cumulative counter.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+# SQL statements executed by `db`
+sql_statements = counter()
+
+
+def _io() -> dict:
+    """
+        Bytes read/written by the process (including sockets), None if not available.
+    """
+    res = {"read_bytes": None, "written_bytes": None}
+    try:
+        with open("/proc/self/io", mode="r", encoding="utf-8") as fin:
+            for line in fin:
+                k, v = line.split(":")
+                if k == "rchar":
+                    res["read_bytes"] = int(v)
+                elif k == "wchar":
+                    res["written_bytes"] = int(v)
+    except Exception:
+        pass
+    return res
+
+
+def _rss() -> int:
+    """
+        Current resident set size of the process in bytes, None if not available.
+    """
+    try:
+        with open("/proc/self/statm", mode="r", encoding="utf-8") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+def _peak_rss() -> int:
+    """
+        Peak resident set size of the process in bytes, None if not available.
+    """
+    if resource is None:
+        return None
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class perf:
+    """
+        Per phase performance records - wall and CPU time, imported objects,
+        REST requests, SQL statements, bytes read/written and peak RSS.
+
+        It is a scheduler hook, a record is opened in `phase_start` and closed
+        in `phase_end`; methods decorated with `time_method` are recorded
+        under the phase running in the same thread. Counters are cumulative
+        sources (name -> callable) sampled at the start and the end of a record,
+        they are process wide so concurrently running phases share them
+        (as well as `cpu`, `thread_cpu` is the time of the phase thread only).
+    """
+
+    _instance = None
+
+    def __init__(self):
+        self._sources = {"sql": lambda: sql_statements.value}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = []
+        self.phases = []
+        self._file_str = None
+
+    @staticmethod
+    def instance():
+        """
+            Shared recorder used by `time_method` and `log_after_import`.
+        """
+        if perf._instance is None:
+            perf._instance = perf()
+        return perf._instance
+
+    def add_source(self, name: str, fnc):
+        self._sources[name] = fnc
+
+    def store_into(self, file_str: str):
+        """
+            Write the report after every finished phase.
+        """
+        self._file_str = file_str
+
+    def snapshot(self) -> dict:
+        res = {"wall": time_fnc(), "cpu": process_time(), "thread_cpu": thread_time()}
+        for name, fnc in self._sources.items():
+            try:
+                res[name] = fnc()
+            except Exception:
+                res[name] = None
+        res.update(_io())
+        return res
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @staticmethod
+    def _delta(start: dict, end: dict) -> dict:
+        res = {}
+        for k, v in end.items():
+            if v is None or start.get(k, None) is None:
+                res[k] = None
+            else:
+                res[k] = v - start[k]
+        return res
+
+    # =============
+
+    def start(self, name: str) -> dict:
+        rec = {"name": name, "objects": 0, "failed": 0, "methods": {}, "_start": self.snapshot()}
+        self._stack().append(rec)
+        return rec
+
+    def end(self, rec: dict, error=None) -> dict:
+        stack = self._stack()
+        if rec in stack:
+            stack.remove(rec)
+        start = rec.pop("_start")
+        rec.update(self._delta(start, self.snapshot()))
+        rec["objects_per_s"] = rec["objects"] / rec["wall"] if rec["wall"] > 0 else None
+        rec["peak_rss"] = _peak_rss()
+        rec["error"] = None if error is None else str(error)
+        return rec
+
+    def _current(self):
+        stack = self._stack()
+        if len(stack) > 0:
+            return stack[0]
+        # threads started by a phase (e.g., pipeline stages) belong to it if it is the only one
+        with self._lock:
+            return self._open[0] if len(self._open) == 1 else None
+
+    def add_objects(self, n: int, failed: int = 0):
+        rec = self._current()
+        if rec is None:
+            return
+        rec["objects"] += n or 0
+        rec["failed"] += failed or 0
+
+    def objects(self) -> dict:
+        """
+            Phase name -> (imported objects, failed objects) of running and finished phases.
+        """
+        with self._lock:
+            recs = self.phases + self._open
+        return {x["name"]: (x["objects"], x["failed"]) for x in recs}
+
+    def method(self, name: str, start: dict):
+        """
+            Add the method which started at `start` (`snapshot`) to the current phase.
+        """
+        cur = self._current()
+        if cur is None:
+            return
+        d = self._delta(start, self.snapshot())
+        m = cur["methods"].setdefault(name, {"calls": 0, "wall": 0., "cpu": 0., "sql": 0})
+        m["calls"] += 1
+        for k in ("wall", "cpu", "sql"):
+            if d.get(k, None) is not None:
+                m[k] += d[k]
+
+    # ============= scheduler hook
+
+    def phase_start(self, p):
+        rec = self.start(p.name)
+        with self._lock:
+            self._open.append(rec)
+
+    def phase_end(self, p):
+        stack = self._stack()
+        rec = next((x for x in stack if x["name"] == p.name), None)
+        if rec is None:
+            return
+        with self._lock:
+            self._open.remove(rec)
+        self.end(rec, p.error)
+        with self._lock:
+            self.phases.append(rec)
+        if self._file_str is not None:
+            self.save(self._file_str)
+
+    # =============
+
+    def report(self) -> dict:
+        with self._lock:
+            phases = list(self.phases)
+        return {
+            "phases": phases,
+            "peak_rss": _peak_rss(),
+        }
+
+    def save(self, file_str: str):
+        os.makedirs(os.path.dirname(file_str) or ".", exist_ok=True)
+        tmp_file = f"{file_str}.tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as fout:
+            json.dump(self.report(), fout, indent=2)
+        os.replace(tmp_file, file_str)
+
+    def log_summary(self):
+        with self._lock:
+            phases = list(self.phases)
+        if len(phases) == 0:
+            return
+
+        def fmt(v, f="{:.1f}"):
+            return "-" if v is None else f.format(v)
+
+        def mb(v):
+            return None if v is None else v / (1 << 20)
+
+        cols = ["wall[s]", "cpu[s]", "objects", "obj/s", "rest", "sql", "read[MB]", "written[MB]", "peak rss[MB]"]
+        name_w = max(len(x["name"]) for x in phases) + 2
+        msg = f"{'phase': <{name_w}}" + "".join(f"{c: >13}" for c in cols) + "\n"
+        for rec in phases:
+            vals = [
+                fmt(rec["wall"]), fmt(rec["cpu"]), str(rec["objects"]), fmt(rec["objects_per_s"]),
+                fmt(rec.get("rest", None), "{:d}"), fmt(rec.get("sql", None), "{:d}"),
+                fmt(mb(rec["read_bytes"])), fmt(mb(rec["written_bytes"])), fmt(mb(rec["peak_rss"])),
+            ]
+            msg += f"{rec['name']: <{name_w}}" + "".join(f"{v: >13}" for v in vals) + "\n"
+        _logger.info(f"Performance per phase:\n{msg}")
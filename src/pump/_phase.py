@@ -0,0 +1,212 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time as time_fnc
+
+_logger = logging.getLogger("pump.phase")
+
+
+class phase:
+    """
+        One import phase with the names of phases it depends on.
+    """
+
+    def __init__(self, name: str, fnc, deps: list = None):
+        self.name = name
+        self.fnc = fnc
+        self.deps = list(deps or [])
+        self.start = None
+        self.end = None
+        self.error = None
+
+    @property
+    def took(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"phase({self.name}, deps={self.deps})"
+
+
+class scheduler:
+    """
+        Run phases respecting their dependencies.
+
+        With `parallel` <= 1 phases run one by one in the declaration order
+        (constrained by dependencies), otherwise up to `parallel` ready phases
+        run concurrently in threads.
+
+        Hooks are objects with optional `phase_start(phase)` and `phase_end(phase)`
+        methods; both are called in the thread running the phase.
+    """
+
+    def __init__(self, parallel: int = 1):
+        self._parallel = max(1, parallel or 1)
+        self._phases = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._phases)
+
+    def __contains__(self, name: str):
+        return name in self._phases
+
+    def names(self) -> list:
+        return list(self._phases.keys())
+
+    def get(self, name: str):
+        return self._phases.get(name, None)
+
+    def add(self, name: str, fnc, deps: list = None):
+        if name in self._phases:
+            raise ValueError(f"Phase [{name}] already exists")
+        self._phases[name] = phase(name, fnc, deps)
+        return self._phases[name]
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    # =============
+
+    def order(self) -> list:
+        """
+            Stable topological order - declaration order is kept where dependencies allow it.
+        """
+        for p in self._phases.values():
+            missing = [x for x in p.deps if x not in self._phases]
+            if len(missing) > 0:
+                raise ValueError(f"Phase [{p.name}] depends on unknown phases {missing}")
+
+        done = set()
+        res = []
+        todo = list(self._phases.values())
+        while len(todo) > 0:
+            ready = next((p for p in todo if all(d in done for d in p.deps)), None)
+            if ready is None:
+                raise ValueError(
+                    f"Cyclic dependency between phases {[p.name for p in todo]}")
+            todo.remove(ready)
+            done.add(ready.name)
+            res.append(ready)
+        return res
+
+    def _call_hooks(self, method: str, p: phase):
+        for hook in self._hooks:
+            fnc = getattr(hook, method, None)
+            if fnc is None:
+                continue
+            try:
+                fnc(p)
+            except Exception as e:
+                _logger.error(f"Hook [{type(hook).__name__}.{method}] failed for [{p.name}]: {str(e)}")
+
+    def _run_one(self, p: phase):
+        _logger.info(f"Starting phase [{p.name}]")
+        p.start = time_fnc()
+        self._call_hooks("phase_start", p)
+        try:
+            p.fnc()
+        except Exception as e:
+            p.error = e
+            raise
+        finally:
+            p.end = time_fnc()
+            self._call_hooks("phase_end", p)
+            _logger.info(f"Phase [{p.name}] took [{round(p.took, 2)}] seconds")
+        return p
+
+    def needed(self, name: str) -> set:
+        """
+            Names of the phase and all phases it (transitively) depends on.
+        """
+        res = set()
+        todo = [name]
+        while len(todo) > 0:
+            cur = todo.pop()
+            if cur in res:
+                continue
+            res.add(cur)
+            todo += self._phases[cur].deps
+        return res
+
+    def run(self, until: str = None):
+        """
+            Run all phases or only the phase `until` and the phases it depends on.
+        """
+        order = self.order()
+        if until is not None:
+            if until not in self._phases:
+                raise ValueError(f"Unknown phase [{until}]")
+            needed = self.needed(until)
+            order = [p for p in order if p.name in needed]
+        if self._parallel <= 1:
+            for p in order:
+                self._run_one(p)
+        else:
+            self._run_parallel(order)
+        self.log_critical_path()
+
+    def _run_parallel(self, order: list):
+        _logger.info(f"Running [{len(order)}] phases with parallelism [{self._parallel}]")
+        done = set()
+        todo = list(order)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self._parallel, thread_name_prefix="phase") as pool:
+            while len(todo) > 0 or len(running) > 0:
+                # do not start anything new after a failure
+                while error is None and len(running) < self._parallel:
+                    ready = next((p for p in todo if all(d in done for d in p.deps)), None)
+                    if ready is None:
+                        break
+                    todo.remove(ready)
+                    running[pool.submit(self._run_one, ready)] = ready
+                if len(running) == 0:
+                    break
+                finished, _1 = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for f in finished:
+                    p = running.pop(f)
+                    if f.exception() is not None:
+                        _logger.critical(f"Phase [{p.name}] failed: {str(f.exception())}")
+                        error = error or f.exception()
+                        continue
+                    done.add(p.name)
+        if error is not None:
+            raise error
+
+    # =============
+
+    def critical_path(self) -> list:
+        """
+            Longest chain of dependent phases by measured time.
+        """
+        finish = {}
+        prev = {}
+        for p in self.order():
+            if p.start is None:
+                continue
+            best = None
+            for d in p.deps:
+                if d in finish and (best is None or finish[d] > finish[best]):
+                    best = d
+            prev[p.name] = best
+            finish[p.name] = p.took + (finish[best] if best is not None else 0.)
+        if len(finish) == 0:
+            return []
+        name = max(finish, key=lambda k: finish[k])
+        path = []
+        while name is not None:
+            path.append(self._phases[name])
+            name = prev[name]
+        return path[::-1]
+
+    def log_critical_path(self):
+        path = self.critical_path()
+        if len(path) == 0:
+            return
+        total = sum(p.took for p in path)
+        _logger.info(
+            f"Critical path [{round(total, 2)}] seconds: " +
+            " -> ".join(f"{p.name}[{round(p.took, 2)}]" for p in path))
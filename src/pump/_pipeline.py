@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+from time import time as time_fnc
+
+_logger = logging.getLogger("pump.pipeline")
+
+
+class pipeline:
+    """
+        Item-centric streaming import.
+
+        Every item flows through item creation -> bundles -> bitstreams -> resource policies
+        as soon as it exists in v7, stages run in their own threads connected by bounded queues
+        (a full queue blocks the previous stage).
+
+        Resource policies created by dspace for the streamed objects are deleted right before
+        their v5 policies are imported (instead of deleting all policies before the policy phase).
+
+        Objects which are not part of any item (logos, orphan bitstreams, policies of communities,
+        collections, ...) are left for the regular phases which skip everything already recorded in WAL,
+        their dspace policies are deleted after all objects exist (`resourcepolicies.delete_created`).
+    """
+
+    _STOP = object()
+
+    def __init__(self, env, dspace, repo, queue_size: int = 100, checksum_every: int = 500):
+        self._env = env
+        self._dspace = dspace
+        self._repo = repo
+        self._checksum_every = checksum_every
+        self._queues = {
+            "bundles": queue.Queue(maxsize=queue_size),
+            "bitstreams": queue.Queue(maxsize=queue_size),
+            "policies": queue.Queue(maxsize=queue_size),
+        }
+        self._max_depths = {k: 0 for k in self._queues}
+        self._streamed = set()
+        self._bs_since_checksum = 0
+        self._failed = None
+        # stages using the database have their own connection
+        self._db7 = None
+        self.stats = {
+            "items": 0,
+            "bundles": 0,
+            "bitstreams": 0,
+            "policies_failed": 0,
+        }
+
+    def depths(self) -> dict:
+        return {k: q.qsize() for k, q in self._queues.items()}
+
+    def _put(self, name: str, x):
+        q = self._queues[name]
+        q.put(x)
+        self._max_depths[name] = max(self._max_depths[name], q.qsize())
+
+    # =============
+
+    def _feed(self, item: dict):
+        if self._failed is not None:
+            raise RuntimeError(f"Pipeline stopped: [{str(self._failed)}]")
+        i_id = int(item['item_id'])
+        if i_id in self._streamed:
+            return
+        self._streamed.add(i_id)
+        self.stats["items"] += 1
+        self._put("bundles", i_id)
+
+    def _source(self, cache_file: str):
+        repo = self._repo
+        try:
+            repo.items.import_to(cache_file, self._dspace, repo.handles, repo.metadatas, repo.epersons,
+                                 repo.collections, repo.wal, stream=self._feed)
+            # items created before (workspace, workflow items or in the previous run)
+            for i_id in list(repo.items.id2uuid.keys()):
+                self._feed({'item_id': i_id})
+        except Exception as e:
+            _logger.critical(f"Pipeline stage [items] failed: [{str(e)}]")
+            self._failed = self._failed or e
+        finally:
+            self._put("bundles", pipeline._STOP)
+
+    def _bundle_stage(self, item_id: int):
+        repo = self._repo
+        bundle_ids = repo.bundles.import_item(
+            item_id, self._dspace, repo.metadatas, repo.items, repo.wal)
+        self.stats["bundles"] += len(bundle_ids)
+        return item_id, bundle_ids
+
+    def _bitstream_stage(self, arg):
+        repo = self._repo
+        item_id, bundle_ids = arg
+        bs_ids = repo.bitstreams.import_bundles(
+            bundle_ids, self._env, self._dspace, repo.metadatas, repo.bitstreamformatregistry,
+            repo.bundles, repo.communities, repo.collections, repo.wal)
+        self.stats["bitstreams"] += len(bs_ids)
+
+        # the server may be out of memory if checksums are not computed regularly
+        self._bs_since_checksum += len(bs_ids)
+        if self._bs_since_checksum >= self._checksum_every:
+            self._bs_since_checksum = 0
+            try:
+                self._dspace.add_checksums()
+            except Exception as e:
+                _logger.error(f'add_checksums failed: [{str(e)}]')
+        return item_id, bundle_ids, bs_ids
+
+    def _policy_stage(self, arg):
+        repo = self._repo
+        item_id, bundle_ids, bs_ids = arg
+        objs = [(repo.items.TYPE, item_id)] + \
+               [(repo.bundles.TYPE, x) for x in bundle_ids] + \
+               [(repo.bitstreams.TYPE, x) for x in bs_ids]
+        self.stats["policies_failed"] += repo.resourcepolicies.import_objects(
+            self._env, self._dspace, repo, objs, repo.wal, self._db7)
+        return None
+
+    def _stage(self, name: str, fnc, q_in: str, q_out: str = None):
+        while True:
+            x = self._queues[q_in].get()
+            if x is pipeline._STOP:
+                break
+            # keep draining the queue so that the previous stage is not blocked
+            if self._failed is not None:
+                continue
+            try:
+                res = fnc(x)
+            except Exception as e:
+                _logger.critical(f"Pipeline stage [{name}] failed: [{str(e)}]")
+                self._failed = self._failed or e
+                continue
+            if q_out is not None:
+                self._put(q_out, res)
+        if q_out is not None:
+            self._put(q_out, pipeline._STOP)
+
+    # =============
+
+    def run(self, cache_file: str):
+        start = time_fnc()
+        threads = [
+            threading.Thread(target=self._source, args=(cache_file,), name="pipeline-items"),
+            threading.Thread(target=self._stage, name="pipeline-bundles",
+                             args=("bundles", self._bundle_stage, "bundles", "bitstreams")),
+            threading.Thread(target=self._stage, name="pipeline-bitstreams",
+                             args=("bitstreams", self._bitstream_stage, "bitstreams", "policies")),
+            threading.Thread(target=self._stage, name="pipeline-policies",
+                             args=("policies", self._policy_stage, "policies")),
+        ]
+        self._db7 = self._repo.raw_db_7.copy()
+        m = getattr(self._repo, "metrics", None)
+        if m is not None:
+            m.add_gauge("pipeline_queue_depth", self.depths, "queue", "Items waiting in pipeline queues")
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self._db7.close()
+        if m is not None:
+            m.remove_gauge("pipeline_queue_depth")
+
+        try:
+            self._dspace.add_checksums()
+        except Exception as e:
+            _logger.error(f'add_checksums failed: [{str(e)}]')
+
+        _logger.info(
+            f"Pipeline took [{round(time_fnc() - start, 2)}] seconds, " +
+            " ".join(f"{k}:[{v}]" for k, v in self.stats.items()) +
+            f", max queue depths: {self._max_depths}")
+        if self._failed is not None:
+            raise self._failed
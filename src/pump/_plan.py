@@ -0,0 +1,289 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ._utils import progress_bar
+from ._wal import ensure_wal
+
+_logger = logging.getLogger("pump.plan")
+
+
+def ref(op_id: str) -> dict:
+    """
+        Placeholder of uuid of an object created by another operation.
+    """
+    return {"$ref": op_id}
+
+
+def _is_ref(v) -> bool:
+    return isinstance(v, dict) and len(v) == 1 and "$ref" in v
+
+
+class plan:
+    """
+        Import plan of items, bundles and bitstreams.
+
+        `compile` resolves all references offline and writes every REST operation as one json line
+        into the spool file:
+            {"id": "bundle:5", "kind": "bundle", "v5": 5, "deps": ["item:3"],
+             "params": {"item": {"$ref": "item:3"}}, "data": {...}}
+        Uuids known at compile time are used directly, uuids of objects created by the plan are
+        `$ref` placeholders. Operations with missing references are not written, they are reported
+        into `<spool>.missing.json` instead. Bundles and bitstreams of workspace and workflow items
+        (created later in the items phase) are left for the regular phases.
+
+        `execute` streams the spool and runs every operation as soon as its dependencies are done,
+        created objects are recorded into WAL so the regular phases skip them.
+
+        Resource policies are not part of the plan, all policies are deleted and imported
+        in the resourcepolicies phase after all objects exist.
+    """
+
+    def __init__(self, file_str: str):
+        self._file_str = file_str
+        self._missing_file_str = f"{file_str}.missing.json"
+
+    @property
+    def file_str(self):
+        return self._file_str
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file_str)
+
+    # =============
+
+    def compile(self, env, repo, wal=None) -> dict:
+        wal = ensure_wal(wal)
+        ops = 0
+        missing = []
+        planned = set()
+        # bundles of workspace and workflow items which do not exist yet
+        deferred = set()
+
+        def uuid_or_ref(kind: str, v5_id, known_uuid):
+            """
+                Known uuid, placeholder of planned object or None.
+            """
+            if v5_id is None:
+                return None
+            if known_uuid is not None:
+                return known_uuid
+            rec = wal.get(kind, v5_id)
+            if rec is not None:
+                return rec["uuid"]
+            op_id = f"{kind}:{v5_id}"
+            if op_id in planned:
+                return ref(op_id)
+            return None
+
+        os.makedirs(os.path.dirname(self._file_str) or ".", exist_ok=True)
+        tmp_file = f"{self._file_str}.tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as fout:
+            def write(kind: str, v5_id, params: dict, data: dict):
+                nonlocal ops
+                op_id = f"{kind}:{v5_id}"
+                deps = sorted({v["$ref"] for v in params.values() if _is_ref(v)})
+                fout.write(json.dumps({
+                    "id": op_id, "kind": kind, "v5": v5_id, "deps": deps,
+                    "params": params, "data": data}) + "\n")
+                planned.add(op_id)
+                ops += 1
+
+            # items
+            for item in progress_bar(repo.items.archived_items()):
+                i_id = item['item_id']
+                if wal.done("item", i_id):
+                    continue
+                err, params, data = repo.items.item_payload(
+                    item, repo.handles, repo.metadatas, repo.epersons, repo.collections)
+                if err is not None:
+                    missing.append({"op": f"item:{i_id}", "reason": err})
+                    continue
+                write("item", i_id, params, data)
+
+            # bundles
+            unarchived = repo.items.unarchived_ids()
+            for item_id in progress_bar(list(repo.bundles.items_with_bundles())):
+                item_ref = uuid_or_ref("item", item_id, repo.items.uuid(item_id))
+                for bundle_id in repo.bundles.item_bundles(item_id):
+                    if wal.done("bundle", bundle_id):
+                        continue
+                    if item_ref is None and int(item_id) in unarchived:
+                        deferred.add(bundle_id)
+                        continue
+                    if item_ref is None:
+                        missing.append({"op": f"bundle:{bundle_id}", "ref": f"item:{item_id}"})
+                        continue
+                    write("bundle", bundle_id, {"item": item_ref},
+                          repo.bundles.bundle_payload(bundle_id, repo.metadatas))
+
+            # bitstreams of bundles
+            test_instance = env["backend"].get("testing", False)
+            path_assetstore = env["assetstore"]
+            for b in progress_bar(repo.bitstreams.bundled_bitstreams()):
+                b_id = b['bitstream_id']
+                if wal.done("bitstream", b_id):
+                    continue
+                bundle_id = repo.bitstreams.bundle_id(b_id)
+                primary_id = repo.bundles.primary.get(b_id, None)
+                if bundle_id in deferred or primary_id in deferred:
+                    continue
+                params, data = repo.bitstreams.bitstream_payload(
+                    b, repo.metadatas, repo.bitstreamformatregistry, repo.bundles, repo.communities,
+                    repo.collections, test_instance, path_assetstore)
+                if params['bitstreamFormat'] is None:
+                    missing.append({"op": f"bitstream:{b_id}", "reason": "format"})
+                    continue
+                params['bundle_id'] = uuid_or_ref("bundle", bundle_id, params['bundle_id'])
+                if params['bundle_id'] is None:
+                    missing.append({"op": f"bitstream:{b_id}", "ref": f"bundle:{bundle_id}"})
+                    continue
+                if primary_id is not None:
+                    params['primaryBundle_id'] = uuid_or_ref("bundle", primary_id, params['primaryBundle_id'])
+                    if params['primaryBundle_id'] is None:
+                        missing.append({"op": f"bitstream:{b_id}", "ref": f"bundle:{primary_id}"})
+                        continue
+                write("bitstream", b_id, params, data)
+
+        os.replace(tmp_file, self._file_str)
+        with open(self._missing_file_str, mode="w", encoding="utf-8") as fout:
+            json.dump(missing, fout, indent=2)
+
+        report = {"ops": ops, "missing": len(missing), "deferred": len(deferred)}
+        _logger.info(
+            f"Compiled plan [{self._file_str}]: operations:[{ops}], "
+            f"bundles of workspace/workflow items left for the regular phases:[{len(deferred)}], "
+            f"missing references:[{len(missing)}] (see [{self._missing_file_str}])")
+        return report
+
+    # =============
+
+    def _index(self) -> dict:
+        """
+            Read operations without payloads: op id -> (offset, deps).
+        """
+        res = {}
+        with open(self._file_str, mode="rb") as fin:
+            while True:
+                offset = fin.tell()
+                line = fin.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                op = json.loads(line)
+                res[op["id"]] = (offset, op["deps"])
+        return res
+
+    def _read(self, fin, offset: int) -> dict:
+        fin.seek(offset)
+        return json.loads(fin.readline())
+
+    @staticmethod
+    def _call(dspace, op: dict, params: dict):
+        kind = op["kind"]
+        if kind == "item":
+            return dspace.put_item(params, op["data"])['id']
+        if kind == "bundle":
+            return dspace.put_bundle(params["item"], op["data"])['uuid']
+        if kind == "bitstream":
+            return dspace.put_bitstream(params, op["data"])['id']
+        raise ValueError(f"Unknown operation kind [{kind}]")
+
+    def execute(self, dspace, wal=None, parallel: int = 4, checksum_every: int = 500) -> dict:
+        """
+            Run all operations of the spool, independent operations run concurrently.
+        """
+        if not self.exists():
+            raise FileNotFoundError(f"Plan [{self._file_str}] does not exist, compile it first.")
+        wal = ensure_wal(wal)
+        index = self._index()
+        results = {}
+        stats = {"done": 0, "executed": 0, "failed": 0, "skipped": 0}
+        lock = threading.Lock()
+        local = threading.local()
+        fins = []
+        bs_since_checksum = [0]
+
+        dependents = {}
+        waiting = {}
+        for op_id, (offset, deps) in index.items():
+            # dependencies outside the plan were resolved by compile
+            deps = [x for x in deps if x in index]
+            waiting[op_id] = len(deps)
+            for d in deps:
+                dependents.setdefault(d, []).append(op_id)
+
+        def run_op(op_id: str):
+            fin = getattr(local, "fin", None)
+            if fin is None:
+                fin = local.fin = open(self._file_str, mode="rb")
+                with lock:
+                    fins.append(fin)
+            op = self._read(fin, index[op_id][0])
+            rec = wal.get(op["kind"], op["v5"])
+            if rec is not None:
+                return op_id, rec["uuid"], "done"
+            params = {k: (results.get(v["$ref"]) if _is_ref(v) else v) for k, v in op["params"].items()}
+            try:
+                uuid = self._call(dspace, op, params)
+            except Exception as e:
+                _logger.error(f"Operation [{op_id}] failed [{str(e)}]")
+                return op_id, None, "failed"
+            wal.append(op["kind"], op["v5"], uuid)
+            if op["kind"] == "bitstream":
+                with lock:
+                    bs_since_checksum[0] += 1
+                    compute = bs_since_checksum[0] >= checksum_every
+                    if compute:
+                        bs_since_checksum[0] = 0
+                if compute:
+                    try:
+                        dspace.add_checksums()
+                    except Exception as e:
+                        _logger.error(f'add_checksums failed: [{str(e)}]')
+            return op_id, uuid, "executed"
+
+        def skip(op_id: str):
+            for x in dependents.get(op_id, []):
+                if waiting.pop(x, None) is not None:
+                    _logger.error(f"Operation [{x}] skipped, dependency [{op_id}] failed")
+                    stats["skipped"] += 1
+                    skip(x)
+
+        ready = [x for x, n in waiting.items() if n == 0]
+        for x in ready:
+            del waiting[x]
+        running = set()
+        _logger.info(f"Executing plan [{self._file_str}]: operations:[{len(index)}] parallel:[{parallel}]")
+        with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="plan") as pool:
+            while len(ready) > 0 or len(running) > 0:
+                while len(ready) > 0 and len(running) < 4 * max(1, parallel):
+                    running.add(pool.submit(run_op, ready.pop()))
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    op_id, uuid, status = f.result()
+                    stats[status] += 1
+                    if uuid is None:
+                        skip(op_id)
+                        continue
+                    results[op_id] = uuid
+                    for x in dependents.get(op_id, []):
+                        if x not in waiting:
+                            continue
+                        waiting[x] -= 1
+                        if waiting[x] == 0:
+                            del waiting[x]
+                            ready.append(x)
+        for fin in fins:
+            fin.close()
+        try:
+            dspace.add_checksums()
+        except Exception as e:
+            _logger.error(f'add_checksums failed: [{str(e)}]')
+
+        _logger.info(
+            f"Executed plan [{self._file_str}]: " + " ".join(f"{k}:[{v}]" for k, v in stats.items()))
+        return stats
@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import logging
+import threading
+from contextlib import contextmanager
+from time import time as time_fnc
+
+_logger = logging.getLogger("pump.profiler")
+
+
+class _section:
+    """
+        Named part of a tool profiled like a phase.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.error = None
+
+
+class _cprofile:
+    SUFFIX = ".pstats"
+
+    def __init__(self):
+        import cProfile
+        self._prof = cProfile.Profile()
+
+    def start(self):
+        self._prof.enable()
+
+    def stop(self, file_str: str, top: int) -> str:
+        import pstats
+        self._prof.disable()
+        self._prof.dump_stats(file_str)
+        out = io.StringIO()
+        stats = pstats.Stats(self._prof, stream=out)
+        stats.sort_stats("tottime").print_stats(top)
+        return out.getvalue()
+
+
+class _sampling:
+    """
+        Samples stacks of the phase thread and of threads started during the phase
+        (e.g., pipeline stages), written as collapsed stacks (flamegraph.pl, speedscope).
+    """
+    SUFFIX = ".collapsed"
+
+    def __init__(self, interval: float = 0.005):
+        self._interval = interval
+        self._stacks = {}
+        self._samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._owner = None
+        self._before = set()
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (ident != self._owner and ident in self._before):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                key = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self._samples += 1
+
+    def start(self):
+        self._owner = threading.get_ident()
+        self._before = {t.ident for t in threading.enumerate()}
+        self._thread = threading.Thread(target=self._run, name="profiler-sampling", daemon=True)
+        self._thread.start()
+
+    def stop(self, file_str: str, top: int) -> str:
+        self._stop.set()
+        self._thread.join()
+        with open(file_str, mode="w", encoding="utf-8") as fout:
+            for key, cnt in sorted(self._stacks.items()):
+                fout.write(f"{key} {cnt}\n")
+
+        own = {}
+        total = {}
+        for key, cnt in self._stacks.items():
+            frames = key.split(";")[1:]
+            if len(frames) == 0:
+                continue
+            own[frames[-1]] = own.get(frames[-1], 0) + cnt
+            for f in set(frames):
+                total[f] = total.get(f, 0) + cnt
+        n = max(1, sum(self._stacks.values()))
+        msg = f"[{self._samples}] samples every [{self._interval}]s\n"
+        msg += f"{'own': >7} {'total': >7}  function\n"
+        for f, cnt in sorted(own.items(), key=lambda x: -x[1])[:top]:
+            msg += f"{cnt / n: >7.1%} {total[f] / n: >7.1%}  {f}\n"
+        return msg
+
+
+class profiler:
+    """
+        Profile selected phases, it is a scheduler hook (tools use `section`).
+
+        `cprofile` profiles the phase thread and writes `<prefix>.<phase>.pstats`,
+        `sampling` samples stacks of the phase thread and of the threads it starts
+        and writes `<prefix>.<phase>.collapsed`. The hottest functions are logged when the phase ends.
+        Nothing is added to phases which are not selected.
+    """
+
+    KINDS = {
+        "cprofile": _cprofile,
+        "sampling": _sampling,
+    }
+
+    def __init__(self, phases: list, kind: str = "cprofile", prefix: str = "profile", top: int = 25):
+        if kind not in profiler.KINDS:
+            raise ValueError(f"Unknown profiler [{kind}], use one of {list(profiler.KINDS.keys())}")
+        self._phases = set(phases or [])
+        self._kind = kind
+        self._prefix = prefix
+        self._top = top
+        self._running = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_log_file(log_file: str, phases: list, kind: str = "cprofile"):
+        """
+            Profiler writing its files next to the log file.
+        """
+        prefix = os.path.splitext(log_file)[0]
+        return profiler(phases, kind, prefix)
+
+    def file_str(self, name: str) -> str:
+        return f"{self._prefix}.{name}{profiler.KINDS[self._kind].SUFFIX}"
+
+    # ============= scheduler hook
+
+    def phase_start(self, p):
+        if p.name not in self._phases:
+            return
+        prof = profiler.KINDS[self._kind]()
+        try:
+            prof.start()
+        except Exception as e:
+            _logger.error(f"Cannot profile phase [{p.name}]: [{str(e)}]")
+            return
+        with self._lock:
+            self._running[p.name] = (prof, time_fnc())
+        _logger.info(f"Profiling phase [{p.name}] using [{self._kind}]")
+
+    def phase_end(self, p):
+        with self._lock:
+            prof, start = self._running.pop(p.name, (None, None))
+        if prof is None:
+            return
+        file_str = self.file_str(p.name)
+        os.makedirs(os.path.dirname(file_str) or ".", exist_ok=True)
+        top = prof.stop(file_str, self._top)
+        _logger.info(
+            f"Profile of phase [{p.name}] ([{round(time_fnc() - start, 2)}] seconds) "
+            f"stored into [{file_str}], hot functions:\n{top}")
+
+    # =============
+
+    @contextmanager
+    def section(self, name: str):
+        """
+            Profile a named part of a tool like a phase.
+        """
+        s = _section(name)
+        self.phase_start(s)
+        try:
+            yield s
+        except Exception as e:
+            s.error = e
+            raise
+        finally:
+            self.phase_end(s)
@@ -0,0 +1,94 @@
+import re
+import logging
+
+_logger = logging.getLogger("pump.pushdown")
+
+_rec_col = re.compile(r"\{(\w+)\}")
+
+
+def literal(value) -> str:
+    """
+        SQL text literal (NULL for None).
+    """
+    if value is None:
+        return "NULL"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class pushdown:
+    """
+        Normalisation of a validation query declared as steps which are compiled into SQL,
+        PostgreSQL then returns already normalised rows.
+
+        `columns` name the columns of the base query, `{col}` in templates is the current value of a column.
+        Steps, applied in order:
+            ["expr", col, template]            - set (or add) the column to SQL expression
+            ["filter", template]               - keep only rows matching the condition
+            ["unnest", col, template]          - one row per element of SQL array expression
+            ["lookup", col, key_template, fnc] - value of dict `fnc(repo)` for the key (NULL if missing),
+                                                 the dict is sent as VALUES CTE, keys and values are text
+        The result has `output` columns (all by default).
+    """
+
+    def __init__(self, columns: list, steps: list, output: list = None):
+        self._columns = list(columns)
+        self._steps = list(steps)
+        self._output = list(output) if output else None
+
+    @staticmethod
+    def _render(template: str, alias: str, cols: list) -> str:
+        return _rec_col.sub(
+            lambda m: f'{alias}."{m.group(1)}"' if m.group(1) in cols else m.group(0), template)
+
+    @staticmethod
+    def _values(d: dict) -> str:
+        if len(d) == 0:
+            return "SELECT NULL::text AS k, NULL::text AS v WHERE FALSE"
+        return "VALUES " + ", ".join(f"({literal(k)}, {literal(v)})" for k, v in d.items())
+
+    def compile(self, sql: str, repo=None) -> str:
+        ctes = []
+        cols = list(self._columns)
+        col_list = ", ".join(f'"{x}"' for x in cols)
+        cur = f"SELECT * FROM ({sql}) s0({col_list})"
+
+        def select(alias: str, col: str, expr: str) -> str:
+            arr = [f'{alias}."{c}"' if c != col else f'{expr} AS "{c}"' for c in cols]
+            if col not in cols:
+                arr.append(f'{expr} AS "{col}"')
+                cols.append(col)
+            return ", ".join(arr)
+
+        for n, step in enumerate(self._steps, start=1):
+            a = f"s{n}"
+            kind = step[0]
+            if kind == "expr":
+                sel = select(a, step[1], f"({self._render(step[2], a, cols)})")
+                cur = f"SELECT {sel} FROM ({cur}) {a}"
+            elif kind == "filter":
+                cur = f"SELECT * FROM ({cur}) {a} WHERE {self._render(step[1], a, cols)}"
+            elif kind == "unnest":
+                expr = self._render(step[2], a, cols)
+                sel = select(a, step[1], f"u{n}.v")
+                cur = f"SELECT {sel} FROM ({cur}) {a} CROSS JOIN LATERAL unnest({expr}) AS u{n}(v)"
+            elif kind == "lookup":
+                col, key, fnc = step[1], step[2], step[3]
+                ctes.append(f"lk{n}(k, v) AS ({self._values(fnc(repo))})")
+                key = self._render(key, a, cols)
+                sel = select(a, col, f"lk{n}.v")
+                cur = f"SELECT {sel} FROM ({cur}) {a} LEFT JOIN lk{n} ON lk{n}.k = ({key})::text"
+            else:
+                raise ValueError(f"Unknown pushdown step [{kind}]")
+
+        out = ", ".join(f'q."{x}"' for x in (self._output or cols))
+        with_sql = ("WITH " + ", ".join(ctes) + " ") if ctes else ""
+        return f"{with_sql}SELECT {out} FROM ({cur}) q"
+
+    @staticmethod
+    def probe(db_x, sql: str) -> list:
+        """
+            Column names of the compiled query, raises if it cannot run.
+        """
+        cols = []
+        db_x.fetch_all(f"SELECT * FROM ({sql}) p LIMIT 0", cols)
+        return cols
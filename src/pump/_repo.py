@@ -2,6 +2,7 @@ import logging
 import os
 import json
 import shutil
+import threading
 
 from ._utils import time_method
 
@@ -24,199 +25,379 @@ from ._resourcepolicy import resourcepolicies
 from ._usermetadata import usermetadatas
 from ._db import db, differ, tester
 from ._sequences import sequences
+from ._wal import wal
+from ._idstore import idstore
+from ._subset import subset
+from ._fingerprint import fingerprint, fingerprints
 
 _logger = logging.getLogger("pump.repo")
 
 
-def export_table(db, table_name: str, out_f: str):
+def export_table(db, table_name: str, out_f: str, where: str = None):
+    where_sql = f" WHERE {where}" if where else ""
     with open(out_f, 'w', encoding='utf-8') as fout:
-        js = db.fetch_one(f'SELECT json_agg(row_to_json(t)) FROM "{table_name}" t')
+        js = db.fetch_one(f'SELECT json_agg(row_to_json(t)) FROM "{table_name}" t{where_sql}')
         json.dump(js, fout)
 
 
 class repo:
+    # type name in the id store -> repo attribute with `id2uuid`
+    id_types = {
+        "community": "communities",
+        "collection": "collections",
+        "epersongroup": "groups",
+        "eperson": "epersons",
+        "userregistration": "userregistrations",
+        "item": "items",
+        "bundle": "bundles",
+        "bitstream": "bitstreams",
+    }
+
+    # resource type id -> repo attribute with `uuid` method
+    type2attr = {
+        communities.TYPE: "communities",
+        collections.TYPE: "collections",
+        items.TYPE: "items",
+        bitstreams.TYPE: "bitstreams",
+        bundles.TYPE: "bundles",
+        epersons.TYPE: "epersons",
+    }
+
+    # entities in the order of construction, each is created on first use
+    entities = [
+        "groups", "handles", "metadatas", "communities", "collections", "registrationdatas",
+        "epersons", "egroups", "userregistrations", "bitstreamformatregistry", "licenses",
+        "items", "bundles", "bitstreams", "usermetadatas", "resourcepolicies", "sequences",
+    ]
+
+    # phases using data read from the table which is not restored from their cache files,
+    # the table is not exported when resuming after all of them finished
+    _metadata_phases = ["metadatas", "communities", "collections", "groups", "epersons",
+                        "items", "bundles", "bitstreams"]
+    table_phases = {
+        "epersongroup": ["groups"],
+        "group2group": ["groups"],
+        "handle": ["handles"],
+        "metadatavalue": _metadata_phases,
+        "metadatafieldregistry": _metadata_phases,
+        "metadataschemaregistry": _metadata_phases,
+        "community": ["communities"],
+        "community2community": ["communities"],
+        "collection": ["collections"],
+        "community2collection": ["collections"],
+        "registrationdata": ["registrationdatas"],
+        "eperson": ["epersons"],
+        "epersongroup2eperson": ["egroups"],
+        "user_registration": ["userregistrations"],
+        "bitstreamformatregistry": ["bitstreamformatregistry"],
+        "fileextension": ["bitstreamformatregistry"],
+        "license_label": ["licenses"],
+        "license_definition": ["licenses"],
+        "license_label_extended_mapping": ["licenses"],
+        "item": ["items"],
+        "workspaceitem": ["items"],
+        "workflowitem": ["items"],
+        "collection2item": ["items"],
+        "bundle": ["bundles"],
+        "item2bundle": ["bundles"],
+        "bitstream": ["bitstreams"],
+        "bundle2bitstream": ["bitstreams"],
+        "user_metadata": ["usermetadatas"],
+        "license_resource_user_allowance": ["usermetadatas"],
+        "license_resource_mapping": ["usermetadatas"],
+        "resourcepolicy": ["resourcepolicies"],
+    }
+
+    # WAL type of finished phases
+    PHASE_TYPE = "phase"
+
     @time_method
     def __init__(self, env: dict, dspace):
+        self._lock = threading.RLock()
+        self._env = env
+        self._dspace = dspace
+        self._tables_db_5 = None
+        self._tables_utilities_5 = None
+
         self.raw_db_dspace_5 = db(env["db_dspace_5"])
         self.raw_db_utilities_5 = db(env["db_utilities_5"])
         self.raw_db_7 = db(env["db_dspace_7"])
 
+        # created objects, used to resume in the middle of a phase
+        self.wal = wal(env["cache"]["wal"], resume=env.get("resume", False))
+        # persistent id -> uuid mapping shared with validators and tools
+        self.ids = idstore(env["cache"]["idstore"])
+        # per row hashes of v5 tables without timestamps, shared by exports and delta
+        self.fingerprints = fingerprints(env["cache"]["fingerprints"])
+        # background validations, diff/test run synchronously if not set
+        self.validation = None
+        # live metrics exporter, see `metrics`
+        self.metrics = None
+        # memory accounting per phase, see `memory`
+        self.memory = None
+        # import only selected objects and their dependencies
+        self.subset = subset.from_env(env)
+        if self.subset is not None and env["tempdb"]:
+            _logger.warning(f"Using existing table exports, {self.subset} is not applied")
+
         if not env["tempdb"]:
             for path in [env["input"]["tempdbexport_v5"], env["input"]["tempdbexport_v7"]]:
                 if os.path.exists(path):
                     shutil.rmtree(path)
 
-        tables_db_5 = [x for arr in self.raw_db_dspace_5.all_tables() for x in arr]
-        tables_utilities_5 = [x for arr in self.raw_db_utilities_5.all_tables()
-                              for x in arr]
-
-        def _f(table_name):
-            """
-                Dynamically export the table to JSON or,
-                if its name is in env["test"], load configured test JSON file for testing instead.
-            """
-            if table_name in env.get("test", []):
-                test_json_path = os.path.join(
-                    env["input"]["test"], env["input"]["test_json_filename"])
-                if not os.path.exists(test_json_path):
-                    raise FileNotFoundError(f"Test JSON file not found: {test_json_path}")
-                return test_json_path
-            os.makedirs(env["input"]["tempdbexport_v5"], exist_ok=True)
-            out_f = os.path.join(env["input"]["tempdbexport_v5"], f"{table_name}.json")
-            if not env["tempdb"]:
-                if table_name in tables_db_5:
-                    db = self.raw_db_dspace_5
-                elif table_name in tables_utilities_5:
-                    db = self.raw_db_utilities_5
-                else:
-                    _logger.warning(f"Table [{table_name}] not found in db.")
-                    raise NotImplementedError(f"Table [{table_name}] not found in db.")
-                export_table(db, table_name, out_f)
-            return out_f
-
-        def _f_7(table_name):
-            """ Dynamically export the table to json file and return path to it for DSpace 7. """
-            os.makedirs(env["input"]["tempdbexport_v7"], exist_ok=True)
-            out_f = os.path.join(env["input"]["tempdbexport_v7"], f"{table_name}.json")
-            if not env["tempdb"]:
-                export_table(self.raw_db_7, table_name, out_f)
-            return out_f
-
-        # load groups
-        self.groups = groups(
-            _f("epersongroup"),
-            _f("group2group"),
-        )
-        self.groups.from_rest(dspace)
-
-        # load handles
-        self.handles = handles(_f("handle"))
-
-        # load metadata
-        self.metadatas = metadatas(
-            env,
-            dspace,
-            _f_7("metadatafieldregistry"),
-            _f_7("metadataschemaregistry"),
-            _f("metadatavalue"),
-            _f("metadatafieldregistry"),
-            _f("metadataschemaregistry"),
-        )
-
-        # load community
-        self.communities = communities(
-            _f("community"),
-            _f("community2community"),
-        )
-
-        self.collections = collections(
-            _f("collection"),
-            _f("community2collection"),
-            _f("metadatavalue"),
-        )
-
-        self.registrationdatas = registrationdatas(
-            _f("registrationdata")
-        )
-
-        self.epersons = epersons(
-            _f("eperson")
-        )
-
-        self.egroups = eperson_groups(
-            _f("epersongroup2eperson")
-        )
-
-        self.userregistrations = userregistrations(
-            _f("user_registration")
-        )
-
-        self.bitstreamformatregistry = bitstreamformatregistry(
-            _f("bitstreamformatregistry"), _f("fileextension")
-        )
-
-        self.licenses = licenses(
-            _f("license_label"),
-            _f("license_definition"),
-            _f("license_label_extended_mapping")
-        )
-
-        self.items = items(
-            _f("item"),
-            _f("workspaceitem"),
-            _f("workflowitem"),
-            _f("collection2item"),
-        )
-
-        self.bundles = bundles(
-            _f("bundle"),
-            _f("item2bundle"),
-        )
-
-        self.bitstreams = bitstreams(
-            _f("bitstream"),
-            _f("bundle2bitstream"),
-        )
-
-        self.usermetadatas = usermetadatas(
-            _f("user_metadata"),
-            _f("license_resource_user_allowance"),
-            _f("license_resource_mapping")
-        )
-
-        self.resourcepolicies = resourcepolicies(
-            _f("resourcepolicy")
-        )
-
-        self.sequences = sequences()
+        done = list(self.wal.records(repo.PHASE_TYPE).keys())
+        if len(done) > 0:
+            _logger.info(f"Finished phases {done}, their tables are not exported")
+
+    def __getattr__(self, name: str):
+        # called only if the attribute does not exist yet
+        if name not in repo.entities:
+            raise AttributeError(f"'repo' object has no attribute '{name}'")
+        with self._lock:
+            if name not in self.__dict__:
+                _logger.debug(f"Creating [{name}]")
+                self.__dict__[name] = self._create(name)
+        return self.__dict__[name]
+
+    def _create(self, name: str):
+        _f, _f_7 = self._f, self._f_7
+        if name == "groups":
+            obj = groups(
+                _f("epersongroup"),
+                _f("group2group"),
+            )
+            obj.from_rest(self._dspace)
+            return obj
+
+        creators = {
+            "handles": lambda: handles(_f("handle")),
+            "metadatas": lambda: metadatas(
+                self._env,
+                self._dspace,
+                _f_7("metadatafieldregistry"),
+                _f_7("metadataschemaregistry"),
+                _f("metadatavalue"),
+                _f("metadatafieldregistry"),
+                _f("metadataschemaregistry"),
+            ),
+            "communities": lambda: communities(
+                _f("community"),
+                _f("community2community"),
+            ),
+            "collections": lambda: collections(
+                _f("collection"),
+                _f("community2collection"),
+                _f("metadatavalue"),
+            ),
+            "registrationdatas": lambda: registrationdatas(
+                _f("registrationdata")
+            ),
+            "epersons": lambda: epersons(
+                _f("eperson")
+            ),
+            "egroups": lambda: eperson_groups(
+                _f("epersongroup2eperson")
+            ),
+            "userregistrations": lambda: userregistrations(
+                _f("user_registration")
+            ),
+            "bitstreamformatregistry": lambda: bitstreamformatregistry(
+                _f("bitstreamformatregistry"), _f("fileextension")
+            ),
+            "licenses": lambda: licenses(
+                _f("license_label"),
+                _f("license_definition"),
+                _f("license_label_extended_mapping")
+            ),
+            "items": lambda: items(
+                _f("item"),
+                _f("workspaceitem"),
+                _f("workflowitem"),
+                _f("collection2item"),
+            ),
+            "bundles": lambda: bundles(
+                _f("bundle"),
+                _f("item2bundle"),
+            ),
+            "bitstreams": lambda: bitstreams(
+                _f("bitstream"),
+                _f("bundle2bitstream"),
+            ),
+            "usermetadatas": lambda: usermetadatas(
+                _f("user_metadata"),
+                _f("license_resource_user_allowance"),
+                _f("license_resource_mapping")
+            ),
+            "resourcepolicies": lambda: resourcepolicies(
+                _f("resourcepolicy")
+            ),
+            "sequences": lambda: sequences(),
+        }
+        return creators[name]()
+
+    # =====
+
+    def phase_done(self, name: str) -> bool:
+        return self.wal.done(repo.PHASE_TYPE, name)
+
+    def mark_phase_done(self, name: str):
+        """
+            Record finished phase into WAL, its tables are not exported when resuming.
+        """
+        self.wal.append(repo.PHASE_TYPE, name)
+
+    def _skip_table(self, table_name: str) -> bool:
+        if not self._env.get("resume", False):
+            return False
+        if self.subset is not None and not self.subset.skip_finished:
+            return False
+        phases = repo.table_phases.get(table_name, None)
+        if not phases:
+            return False
+        return all(self.phase_done(x) for x in phases)
+
+    def _skipped_file(self, dir_str: str) -> str:
+        """
+            Empty JSON input used instead of tables of finished phases.
+        """
+        os.makedirs(dir_str, exist_ok=True)
+        out_f = os.path.join(dir_str, "_skipped.json")
+        if not os.path.exists(out_f):
+            with open(out_f, 'w', encoding='utf-8') as fout:
+                json.dump(None, fout)
+        return out_f
+
+    def _f(self, table_name):
+        """
+            Dynamically export the table to JSON or,
+            if its name is in env["test"], load configured test JSON file for testing instead.
+        """
+        env = self._env
+        if table_name in env.get("test", []):
+            test_json_path = os.path.join(
+                env["input"]["test"], env["input"]["test_json_filename"])
+            if not os.path.exists(test_json_path):
+                raise FileNotFoundError(f"Test JSON file not found: {test_json_path}")
+            return test_json_path
+        if self._skip_table(table_name):
+            _logger.info(f"Skipping export of [{table_name}], all phases using it are finished.")
+            return self._skipped_file(env["input"]["tempdbexport_v5"])
+        os.makedirs(env["input"]["tempdbexport_v5"], exist_ok=True)
+        out_f = os.path.join(env["input"]["tempdbexport_v5"], f"{table_name}.json")
+        if not env["tempdb"]:
+            if self._tables_db_5 is None:
+                self._tables_db_5 = [x for arr in self.raw_db_dspace_5.all_tables() for x in arr]
+                self._tables_utilities_5 = [x for arr in self.raw_db_utilities_5.all_tables()
+                                            for x in arr]
+            if table_name in self._tables_db_5:
+                db = self.raw_db_dspace_5
+            elif table_name in self._tables_utilities_5:
+                db = self.raw_db_utilities_5
+            else:
+                _logger.warning(f"Table [{table_name}] not found in db.")
+                raise NotImplementedError(f"Table [{table_name}] not found in db.")
+            where = self._subset_where(table_name)
+            export_table(db, table_name, out_f, where)
+            if table_name in fingerprint.tables and self._env.get("fingerprints", False):
+                self.fingerprints.take(db, table_name, where)
+        return out_f
+
+    def _subset_where(self, table_name: str):
+        if self.subset is None:
+            return None
+        if self.subset.ids is None:
+            self.subset.compute(self.raw_db_dspace_5)
+        return self.subset.where(table_name)
+
+    def _f_7(self, table_name):
+        """ Dynamically export the table to json file and return path to it for DSpace 7. """
+        env = self._env
+        if self._skip_table(table_name):
+            _logger.info(f"Skipping export of v7 [{table_name}], all phases using it are finished.")
+            return self._skipped_file(env["input"]["tempdbexport_v7"])
+        os.makedirs(env["input"]["tempdbexport_v7"], exist_ok=True)
+        out_f = os.path.join(env["input"]["tempdbexport_v7"], f"{table_name}.json")
+        if not env["tempdb"]:
+            export_table(self.raw_db_7, table_name, out_f)
+        return out_f
 
     def diff(self, to_validate=None):
+        name = "all"
         if to_validate is None:
             to_validate = [
                 getattr(getattr(self, x), "validate_table")
-                for x in dir(self) if hasattr(getattr(self, x), "validate_table")
+                for x in sorted(repo.entities) if hasattr(getattr(self, x), "validate_table")
             ]
         else:
             if not hasattr(to_validate, "validate_table"):
                 _logger.warning(f"Missing validate_table in {to_validate}")
                 return
+            name = type(to_validate).__name__
             to_validate = [to_validate.validate_table]
 
+        if self.validation is not None:
+            self.validation.submit("diff", name, to_validate)
+            return
+
         diff = differ(self.raw_db_dspace_5, self.raw_db_utilities_5,
-                      self.raw_db_7, repo=self)
+                      self.raw_db_7, repo=self, mode=self._env.get("validate_mode", "rows"),
+                      pushdown=self._env.get("validate_pushdown", True),
+                      sample_size=self._env.get("sample_size", 400), sample_seed=self._env.get("sample_seed", 0))
         diff.validate(to_validate)
 
     def test(self, to_test=None):
+        name = "all"
         if to_test is None:
             to_test = [
                 getattr(getattr(self, x), "test_table")
-                for x in dir(self) if hasattr(getattr(self, x), "test_table")
+                for x in sorted(repo.entities) if hasattr(getattr(self, x), "test_table")
             ]
         else:
             if not hasattr(to_test, "test_table"):
                 _logger.warning(f"Missing test_table in {to_test}")
                 return
+            name = type(to_test).__name__
             to_test = [to_test.test_table]
+
+        if self.validation is not None:
+            self.validation.submit("test", name, to_test)
+            return
         test = tester(self.raw_db_dspace_5, self.raw_db_utilities_5,
-                      self.raw_db_7, repo=self)
+                      self.raw_db_7, repo=self, report_file=self.test_report_file(name))
         test.run_tests(to_test)
 
+    def test_report_file(self, name: str):
+        """
+            `<test_report>.<name>.json` or None if reports are not configured.
+        """
+        file_str = self._env.get("cache", {}).get("test_report", None)
+        if file_str is None:
+            return None
+        base, ext = os.path.splitext(file_str)
+        os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+        return f"{base}.{name}{ext}"
+
+    def store_ids(self, obj=None):
+        """
+            Store id -> uuid mapping of `obj` (or all objects) into the persistent id store.
+        """
+        stored = 0
+        for type_name, attr in repo.id_types.items():
+            # do not create entities which were not used
+            cur = self.__dict__.get(attr, None)
+            if cur is None or (obj is not None and cur is not obj):
+                continue
+            stored += self.ids.upsert_many(type_name, cur.id2uuid)
+        if stored > 0:
+            _logger.info(f"Stored [{stored}] id mappings into id store")
+
     # =====
     def uuid(self, res_type_id: int, res_id: int):
         # find object id based on its type
         try:
-            if res_type_id == self.communities.TYPE:
-                return self.communities.uuid(res_id)
-            if res_type_id == self.collections.TYPE:
-                return self.collections.uuid(res_id)
-            if res_type_id == self.items.TYPE:
-                return self.items.uuid(res_id)
-            if res_type_id == self.bitstreams.TYPE:
-                return self.bitstreams.uuid(res_id)
-            if res_type_id == self.bundles.TYPE:
-                return self.bundles.uuid(res_id)
-            if res_type_id == self.epersons.TYPE:
-                return self.epersons.uuid(res_id)
+            attr = repo.type2attr.get(res_type_id, None)
+            if attr is not None:
+                return getattr(self, attr).uuid(res_id)
             if res_type_id == self.groups.TYPE:
                 arr = self.groups.uuid(res_id)
                 if len(arr or []) > 0:
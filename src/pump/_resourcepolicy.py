@@ -1,5 +1,7 @@
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._idmap import idmap
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.resourcepolicy")
 
@@ -40,10 +42,12 @@ class resourcepolicies:
 
         if not self._respol:
             _logger.info(f"Empty input: [{resourcepolicy_file_str}].")
-        self._id2uuid = {}
+        self._id2uuid = idmap()
         self._imported = {
             "respol": 0,
         }
+        # (resource_type_id, resource_id) -> policies, built on first use
+        self._res2policies = None
 
     DEFAULT_BITSTREAM_READ = "DEFAULT_BITSTREAM_READ"
 
@@ -51,15 +55,25 @@ class resourcepolicies:
         return len(self._respol or {})
 
     def uuid(self, b_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid[str(b_id)]
 
     @property
     def imported(self):
         return self._imported['respol']
 
+    def policies_of(self, res_type_id: int, res_id: int) -> list:
+        """
+            Resource policies of one dspace object.
+        """
+        if self._res2policies is None:
+            self._res2policies = {}
+            for res_policy in self._respol:
+                key = (res_policy['resource_type_id'], res_policy['resource_id'])
+                self._res2policies.setdefault(key, []).append(res_policy)
+        return self._res2policies.get((res_type_id, res_id), [])
+
     @time_method
-    def import_to(self, env, dspace, repo):
+    def import_to(self, env, dspace, repo, wal=None):
         expected = len(self)
         log_key = "resourcepolicies"
         log_before_import(log_key, expected)
@@ -67,120 +81,188 @@ class resourcepolicies:
         dspace_actions = env["dspace"]["actions"]
         failed = 0
 
+        wal = ensure_wal(wal)
+        # every policy imported before (previous run, pipeline) is recorded in WAL, count each once
+        self._imported["respol"] = len(wal.records("resourcepolicy"))
+
         for res_policy in progress_bar(self._respol):
-            res_id = res_policy['resource_id']
-            res_type_id = res_policy['resource_type_id']
-            # If resourcepolicy belongs to some Item or Bundle, check if that Item/Bundle wasn't removed from the table.
-            # Somehow, the resourcepolicy table could still have a reference to deleted items/bundles.
-            if res_type_id in [repo.items.TYPE, repo.bundles.TYPE]:
-                if repo.uuid(res_type_id, res_id) is None:
-                    _logger.info(
-                        f"Cannot import resource policy [{res_id}] for the record with type [{res_type_id}] that has already been deleted.")
-                    continue
-
-            res_uuid = repo.uuid(res_type_id, res_id)
-            if res_uuid is None:
-                _logger.critical(
-                    f"Cannot find uuid for [{res_type_id}] [{res_id}] [{str(res_policy)}]")
+            if self._import_one(res_policy, dspace_actions, dspace, repo, wal) == "failed":
+                failed += 1
+
+        log_after_import(f"{log_key}, failed:[{failed}]", expected, self.imported)
+
+    def delete_created(self, repo, wal=None, db7=None):
+        """
+            Delete all resource policies except those of objects whose v5 policies have
+            already been imported (e.g., by the pipeline or in the previous run).
+        """
+        wal = ensure_wal(wal)
+        db7 = db7 or repo.raw_db_7
+        keep = set()
+        for res_policy in self._respol:
+            if not wal.done("resourcepolicy", res_policy['policy_id']):
                 continue
-            params = {}
+            res_uuid = repo.uuid(res_policy['resource_type_id'], res_policy['resource_id'])
             if res_uuid is not None:
-                params['resource'] = res_uuid
-            # in resource there is action as id, but we need action as text
-            actionId = res_policy['action_id']
+                keep.add(res_uuid)
+        deleted = db7.delete_resource_policy_except(list(keep))
+        _logger.info(f"Deleted [{deleted}] resource policies, kept policies of [{len(keep)}] objects")
 
-            # control, if action is entered correctly
-            if not dspace_actions:
-                _logger.error(
-                    "dspace_actions is None or empty. Cannot validate actionId.")
+    def import_objects(self, env, dspace, repo, objs: list, wal=None, db7=None) -> int:
+        """
+            Import resource policies of the listed dspace objects [(res_type_id, res_id), ...].
+
+            Policies created by dspace for these objects are deleted first unless some of their
+            policies have already been imported (resuming).
+            @return: number of failed policies
+        """
+        wal = ensure_wal(wal)
+        db7 = db7 or repo.raw_db_7
+        to_import = []
+        to_delete = []
+        for res_type_id, res_id in objs:
+            arr = self.policies_of(res_type_id, res_id)
+            if not any(wal.done("resourcepolicy", x['policy_id']) for x in arr):
+                res_uuid = repo.uuid(res_type_id, res_id)
+                if res_uuid is not None:
+                    to_delete.append(res_uuid)
+            to_import += arr
+        db7.delete_resource_policy_of(to_delete)
+        return self.import_policies(env, dspace, repo, to_import, wal)
+
+    def import_policies(self, env, dspace, repo, policies: list, wal=None) -> int:
+        """
+            Import the listed resource policies, existing policies are kept.
+            @return: number of failed policies
+        """
+        dspace_actions = env["dspace"]["actions"]
+        wal = ensure_wal(wal)
+        failed = 0
+        for res_policy in policies:
+            if self._import_one(res_policy, dspace_actions, dspace, repo, wal) == "failed":
                 failed += 1
-                continue
-            if actionId is None or actionId < 0 or actionId >= len(dspace_actions):
+        return failed
+
+    def _import_one(self, res_policy: dict, dspace_actions: list, dspace, repo, wal):
+        """
+            Import one resource policy.
+            @return: "imported", "failed" or None if skipped
+        """
+        if wal.done("resourcepolicy", res_policy['policy_id']):
+            return None
+        res_id = res_policy['resource_id']
+        res_type_id = res_policy['resource_type_id']
+        # If resourcepolicy belongs to some Item or Bundle, check if that Item/Bundle wasn't removed from the table.
+        # Somehow, the resourcepolicy table could still have a reference to deleted items/bundles.
+        if res_type_id in [repo.items.TYPE, repo.bundles.TYPE]:
+            if repo.uuid(res_type_id, res_id) is None:
+                _logger.info(
+                    f"Cannot import resource policy [{res_id}] for the record with type [{res_type_id}] that has already been deleted.")
+                return None
+
+        res_uuid = repo.uuid(res_type_id, res_id)
+        if res_uuid is None:
+            _logger.critical(
+                f"Cannot find uuid for [{res_type_id}] [{res_id}] [{str(res_policy)}]")
+            return None
+        params = {}
+        if res_uuid is not None:
+            params['resource'] = res_uuid
+        # in resource there is action as id, but we need action as text
+        actionId = res_policy['action_id']
+
+        # control, if action is entered correctly
+        if not dspace_actions:
+            _logger.error(
+                "dspace_actions is None or empty. Cannot validate actionId.")
+            return "failed"
+        if actionId is None or actionId < 0 or actionId >= len(dspace_actions):
+            _logger.error(
+                f"Invalid actionId: {actionId}. Must be in range 0 to {len(dspace_actions) - 1}")
+            return "failed"
+
+        # create object for request
+        data = {
+            'action': dspace_actions[actionId],
+            'startDate': res_policy['start_date'],
+            'endDate': res_policy['end_date'],
+            'name': res_policy['rpname'],
+            'policyType': res_policy['rptype'],
+            'description': res_policy['rpdescription']
+        }
+
+        # resource policy has defined eperson or group, not the both
+        # get eperson if it is not none
+        if res_policy['eperson_id'] is not None:
+            params['eperson'] = repo.epersons.uuid(res_policy['eperson_id'])
+            try:
+                resp = dspace.put_resourcepolicy(params, data)
+                self._imported["respol"] += 1
+                wal.append("resourcepolicy", res_policy['policy_id'])
+                return "imported"
+            except Exception as e:
                 _logger.error(
-                    f"Invalid actionId: {actionId}. Must be in range 0 to {len(dspace_actions) - 1}")
-                failed += 1
-                continue
+                    f'put_resourcepolicy: [{res_policy["policy_id"]}] failed [{str(e)}]')
+            return None
+
+        # get group if it is not none
+        eg_id = res_policy['epersongroup_id']
+        if eg_id is not None:
+            # groups created with coll and comm are already in the group
+            group_list = repo.groups.uuid(eg_id)
+            if not group_list:
+                return None
+            if len(group_list) > 1:
+                if len(group_list) != 2:
+                    raise RuntimeError(
+                        f'Unexpected size of mapped groups to group [{eg_id}]: {len(group_list)}. '
+                        f'Expected size: 2.')
+                group_types = repo.collections.groups_uuid2type
+                # Determine the target type based on the action
+                target_type = (
+                    repo.collections.BITSTREAM
+                    if dspace_actions[actionId] == resourcepolicies.DEFAULT_BITSTREAM_READ
+                    else repo.collections.ITEM
+                )
+                # Filter group_list to find the appropriate group based on type using list comprehension
+                group_type_list = [
+                    group for group in group_list
+                    if group in group_types and group_types[group] == target_type
+                ]
+
+                if len(group_type_list) != 1:
+                    raise RuntimeError(
+                        f'Unexpected size of filtered groups for group [{eg_id}] '
+                        f'of type [{target_type}]: {len(group_type_list)}. Expected size: 1.'
+                    )
 
-            # create object for request
-            data = {
-                'action': dspace_actions[actionId],
-                'startDate': res_policy['start_date'],
-                'endDate': res_policy['end_date'],
-                'name': res_policy['rpname'],
-                'policyType': res_policy['rptype'],
-                'description': res_policy['rpdescription']
-            }
-
-            # resource policy has defined eperson or group, not the both
-            # get eperson if it is not none
-            if res_policy['eperson_id'] is not None:
-                params['eperson'] = repo.epersons.uuid(res_policy['eperson_id'])
+                group_list = group_type_list
+
+            imported_groups = 0
+            for group in group_list:
+                params['group'] = group
                 try:
                     resp = dspace.put_resourcepolicy(params, data)
-                    self._imported["respol"] += 1
+                    imported_groups += 1
                 except Exception as e:
                     _logger.error(
                         f'put_resourcepolicy: [{res_policy["policy_id"]}] failed [{str(e)}]')
-                continue
+            if imported_groups > 0:
+                self._imported["respol"] += 1
+                wal.append("resourcepolicy", res_policy['policy_id'])
+                return "imported"
+            return None
 
-            # get group if it is not none
-            eg_id = res_policy['epersongroup_id']
-            if eg_id is not None:
-                # groups created with coll and comm are already in the group
-                group_list = repo.groups.uuid(eg_id)
-                if not group_list:
-                    continue
-                if len(group_list) > 1:
-                    if len(group_list) != 2:
-                        raise RuntimeError(
-                            f'Unexpected size of mapped groups to group [{eg_id}]: {len(group_list)}. '
-                            f'Expected size: 2.')
-                    group_types = repo.collections.groups_uuid2type
-                    # Determine the target type based on the action
-                    target_type = (
-                        repo.collections.BITSTREAM
-                        if dspace_actions[actionId] == resourcepolicies.DEFAULT_BITSTREAM_READ
-                        else repo.collections.ITEM
-                    )
-                    # Filter group_list to find the appropriate group based on type using list comprehension
-                    group_type_list = [
-                        group for group in group_list
-                        if group in group_types and group_types[group] == target_type
-                    ]
-
-                    if len(group_type_list) != 1:
-                        raise RuntimeError(
-                            f'Unexpected size of filtered groups for group [{eg_id}] '
-                            f'of type [{target_type}]: {len(group_type_list)}. Expected size: 1.'
-                        )
-
-                    group_list = group_type_list
-
-                imported_groups = 0
-                for group in group_list:
-                    params['group'] = group
-                    try:
-                        resp = dspace.put_resourcepolicy(params, data)
-                        imported_groups += 1
-                    except Exception as e:
-                        _logger.error(
-                            f'put_resourcepolicy: [{res_policy["policy_id"]}] failed [{str(e)}]')
-                if imported_groups > 0:
-                    self._imported["respol"] += 1
-                continue
-
-            _logger.error(f"Cannot import resource policy {res_policy['policy_id']} "
-                          f"because neither eperson nor group is defined")
-            failed += 1
-
-        log_after_import(f"{log_key}, failed:[{failed}]", expected, self.imported)
+        _logger.error(f"Cannot import resource policy {res_policy['policy_id']} "
+                      f"because neither eperson nor group is defined")
+        return "failed"
 
     # =============
 
     def serialize(self, file_str: str):
         data = {
             "respol": self._respol,
-            "id2uuid": self._id2uuid,
+            "id2uuid": self._id2uuid.to_dict(),
             "imported": self._imported,
         }
         serialize(file_str, data)
@@ -188,5 +270,6 @@ class resourcepolicies:
     def deserialize(self, file_str: str):
         data = deserialize(file_str)
         self._respol = data["respol"]
-        self._id2uuid = data["id2uuid"]
+        self._res2policies = None
+        self._id2uuid = idmap(data["id2uuid"])
         self._imported = data["imported"]
@@ -0,0 +1,222 @@
+import math
+import logging
+
+from ._metadata import _metadatavalue_validator
+
+_logger = logging.getLogger("pump.sampling")
+
+
+def wilson(k: int, n: int, z: float = 1.96) -> tuple:
+    """
+        Wilson score interval of the rate `k` / `n` (95% by default).
+    """
+    if n == 0:
+        return 0., 1.
+    p = k / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0., center - half), min(1., center + half)
+
+
+def _uuids_array(uuids) -> str:
+    arr = ",".join(f"'{x}'" for x in uuids if x is not None)
+    return f"ARRAY[{arr}]::uuid[]"
+
+
+class sampler:
+    """
+        Validation by random samples of v5 primary keys compared with v7 through the id -> uuid maps.
+
+        Every sampled row is a match or a mismatch (not migrated, missing in v7 or a compared field differs),
+        the mismatch rate of every stratum is reported with Wilson confidence interval and the
+        estimated number of mismatching rows. `metadatavalue` and `handle` are stratified
+        by resource type (samples are objects, all their values are compared), other tables
+        are one stratum each.
+
+        Samples are reproducible - ordered by md5 of the key and `seed`.
+    """
+
+    # table -> v5 primary key, resource type, compared columns [v5, v7, resource type of mapped ids]
+    tables = {
+        "community": {"pk": "community_id", "type": 4, "compare": [["logo_bitstream_id", "logo_bitstream_id", 0]]},
+        "collection": {"pk": "collection_id", "type": 3, "compare": [["logo_bitstream_id", "logo_bitstream_id", 0]]},
+        "epersongroup": {"pk": "eperson_group_id", "type": 6, "compare": []},
+        "eperson": {"pk": "eperson_id", "type": 7, "compare": [
+            ["email", "email", None], ["netid", "netid", None], ["can_log_in", "can_log_in", None],
+            ["require_certificate", "require_certificate", None], ["self_registered", "self_registered", None],
+        ]},
+        "item": {"pk": "item_id", "type": 2, "compare": [
+            ["in_archive", "in_archive", None], ["withdrawn", "withdrawn", None],
+            ["discoverable", "discoverable", None],
+            ["submitter_id", "submitter_id", 7], ["owning_collection", "owning_collection", 3],
+        ]},
+        "bundle": {"pk": "bundle_id", "type": 1, "compare": [["primary_bitstream_id", "primary_bitstream_id", 0]]},
+        "bitstream": {"pk": "bitstream_id", "type": 0, "compare": [
+            ["size_bytes", "size_bytes", None], ["checksum", "checksum", None],
+            ["checksum_algorithm", "checksum_algorithm", None], ["internal_id", "internal_id", None],
+            ["deleted", "deleted", None], ["sequence_id", "sequence_id", None],
+        ]},
+    }
+
+    # stratified by resource_type_id
+    stratified = ["metadatavalue", "handle"]
+
+    def __init__(self, diff, repo, size: int = 400, seed: int = 0):
+        self._diff = diff
+        self._repo = repo
+        self._size = max(1, size)
+        self._seed = seed
+        self.report = []
+
+    def _sample(self, db_x, sql_from: str, key: str) -> list:
+        return [x[0] for x in db_x.fetch_all(
+            f"SELECT {key} FROM {sql_from} ORDER BY md5({key}::text || '{self._seed}') LIMIT {self._size}")]
+
+    def _add(self, table_name: str, stratum, n: int, population: int, mismatches: dict):
+        k = sum(mismatches.values())
+        lo, hi = wilson(k, n)
+        rate = k / n if n > 0 else 0.
+        rec = {
+            "table": table_name,
+            "stratum": stratum,
+            "sampled": n,
+            "population": population,
+            "mismatches": k,
+            "rate": rate,
+            "ci95": [lo, hi],
+            "estimated": round(rate * population),
+            "reasons": mismatches,
+        }
+        self.report.append(rec)
+        msg = "OK" if k == 0 else "!!! WARN !!!"
+        _logger.info(
+            f"Sample [{table_name}{'' if stratum is None else f':{stratum}'}] {msg} "
+            f"n:[{n}] of [{population}] mismatches:[{k}] rate:[{rate:.2%}] "
+            f"95% CI:[{lo:.2%}, {hi:.2%}] estimated rows:[{rec['estimated']}] reasons:{mismatches}")
+        return rec
+
+    # =============
+
+    def _objects(self, db5, table_name: str, defin: dict):
+        pk, res_type = defin["pk"], defin["type"]
+        cols = defin["compare"]
+        population = db5.fetch_one(f"SELECT COUNT(*) FROM {table_name}") or 0
+        ids = self._sample(db5, table_name, pk)
+        if len(ids) == 0:
+            return self._add(table_name, res_type, 0, population, {})
+        sel5 = ", ".join([pk] + [x[0] for x in cols])
+        rows5 = db5.fetch_all(f"SELECT {sel5} FROM {table_name} WHERE {pk} = ANY(ARRAY[{','.join(map(str, ids))}])")
+        uuids = {x[0]: self._repo.uuid(res_type, x[0]) for x in rows5}
+        sel7 = ", ".join(["uuid::text"] + [f"{x[1]}::text" if x[2] is not None else x[1] for x in cols])
+        rows7 = {x[0]: x[1:] for x in self._diff.raw_db_7.fetch_all(
+            f"SELECT {sel7} FROM {table_name} WHERE uuid = ANY({_uuids_array(uuids.values())})")}
+
+        mismatches = {}
+
+        def inc(reason):
+            mismatches[reason] = mismatches.get(reason, 0) + 1
+
+        for row in rows5:
+            uuid = uuids[row[0]]
+            if uuid is None:
+                inc("not migrated")
+                continue
+            row7 = rows7.get(uuid, None)
+            if row7 is None:
+                inc("missing in v7")
+                continue
+            diff_cols = []
+            for (col5, col7, map_type), val5, val7 in zip(cols, row[1:], row7):
+                if map_type is not None and val5 is not None:
+                    val5 = self._repo.uuid(map_type, val5)
+                if val5 != val7:
+                    diff_cols.append(col5)
+            if len(diff_cols) > 0:
+                inc("different " + ",".join(diff_cols))
+        return self._add(table_name, res_type, len(rows5), population, mismatches)
+
+    def _handles(self, db5, res_type: int):
+        where = f"resource_type_id = {res_type}"
+        population = db5.fetch_one(f"SELECT COUNT(*) FROM handle WHERE {where}") or 0
+        ids = self._sample(db5, f"handle WHERE {where}", "handle_id")
+        rows5 = db5.fetch_all(
+            f"SELECT handle, resource_id FROM handle WHERE handle_id = ANY(ARRAY[{','.join(map(str, ids))}])") \
+            if len(ids) > 0 else []
+        uuids = {r: self._repo.uuid(res_type, r) for _1, r in rows5 if r is not None}
+        rows7 = set()
+        if len(uuids) > 0:
+            rows7 = {(h, u) for h, u in self._diff.raw_db_7.fetch_all(
+                f"SELECT handle, resource_id::text FROM handle WHERE resource_id = ANY({_uuids_array(uuids.values())})")}
+        mismatches = {}
+        for handle, res_id in rows5:
+            uuid = uuids.get(res_id, None)
+            reason = None
+            if uuid is None:
+                reason = "not migrated"
+            elif (handle, uuid) not in rows7:
+                reason = "missing in v7"
+            if reason is not None:
+                mismatches[reason] = mismatches.get(reason, 0) + 1
+        return self._add("handle", res_type, len(rows5), population, mismatches)
+
+    def _metadata(self, db5, validator, res_type: int):
+        where = f"resource_type_id = {res_type}"
+        population = db5.fetch_one(f"SELECT COUNT(DISTINCT resource_id) FROM metadatavalue WHERE {where}") or 0
+        ids = self._sample(db5, f"(SELECT DISTINCT resource_id FROM metadatavalue WHERE {where}) o", "resource_id")
+        if len(ids) == 0:
+            return self._add("metadatavalue", res_type, 0, population, {})
+        uuids = {x: self._repo.uuid(res_type, x) for x in ids}
+        rows5 = db5.fetch_all(
+            f"SELECT resource_id, resource_type_id, text_value, metadata_field_id FROM metadatavalue "
+            f"WHERE {where} AND resource_id = ANY(ARRAY[{','.join(map(str, ids))}])")
+        rows5 = [(uuids[r[0]],) + tuple(r[1:]) for r in rows5 if uuids[r[0]] is not None]
+        rows7 = self._diff.raw_db_7.fetch_all(
+            f"SELECT dspace_object_id::text, text_value, metadata_field_id FROM metadatavalue "
+            f"WHERE dspace_object_id = ANY({_uuids_array(uuids.values())})")
+        res = validator.compare(rows5, rows7)
+        wrong = {x[0] for x in res["only_in_5"] + res["only_in_7"]}
+        mismatches = {}
+        for v5_id in ids:
+            uuid = uuids[v5_id]
+            reason = "not migrated" if uuid is None else ("different values" if uuid in wrong else None)
+            if reason is not None:
+                mismatches[reason] = mismatches.get(reason, 0) + 1
+        return self._add("metadatavalue", res_type, len(ids), population, mismatches)
+
+    # =============
+
+    def run(self, db5, table_name: str):
+        """
+            Sample the table, returns False if it has no sampling definition.
+        """
+        if self._repo is None:
+            _logger.critical(f"Cannot sample [{table_name}] because repo is None")
+            return False
+        if table_name in sampler.tables:
+            self._objects(db5, table_name, sampler.tables[table_name])
+            return True
+        if table_name not in sampler.stratified:
+            return False
+        strata = sorted(x[0] for x in db5.fetch_all(
+            f"SELECT DISTINCT resource_type_id FROM {table_name} WHERE resource_type_id IS NOT NULL"))
+        if table_name == "handle":
+            for t in strata:
+                self._handles(db5, t)
+            return True
+
+        validator = _metadatavalue_validator(self._repo)
+        for t in strata:
+            self._metadata(db5, validator, t)
+        return True
+
+    def log_summary(self):
+        if len(self.report) == 0:
+            return
+        n = sum(x["sampled"] for x in self.report)
+        k = sum(x["mismatches"] for x in self.report)
+        worst = max(self.report, key=lambda x: x["ci95"][1])
+        _logger.info(
+            f"Sampled [{n}] rows in [{len(self.report)}] strata, mismatches:[{k}], "
+            f"highest upper bound of mismatch rate:[{worst['ci95'][1]:.2%}] "
+            f"in [{worst['table']}:{worst['stratum']}]")
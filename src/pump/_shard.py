@@ -0,0 +1,140 @@
+import queue as queue_lib
+import logging
+import multiprocessing
+from time import time as time_fnc
+
+from ._wal import wal as wal_cls
+from ._idstore import idstore
+
+_logger = logging.getLogger("pump.shard")
+
+
+def shard_by(objs: list, key_fnc, shards: int) -> list:
+    """
+        Split objects into `shards` lists, objects with the same key stay in one shard.
+        Largest groups are assigned first to the least loaded shard.
+    """
+    groups = {}
+    for o in objs:
+        groups.setdefault(key_fnc(o), []).append(o)
+    res = [[] for _1 in range(max(1, shards))]
+    for arr in sorted(groups.values(), key=len, reverse=True):
+        min(res, key=len).extend(arr)
+    return [x for x in res if len(x) > 0]
+
+
+class sharded:
+    """
+        Run one importer loop over shards of objects in forked worker processes.
+
+        Every worker gets its own WAL file (`<wal>.shard-<name>-<n>`) and stores created ids
+        into the shared `idstore`. The parent merges the shard WALs into the main WAL
+        and reads created ids back from the store.
+
+        `fnc(objs, wal)` runs in the worker and returns dict of counters
+        (e.g., {"imported": 10, "error": 1}).
+    """
+
+    def __init__(self, name: str, type_name: str, wal, ids: idstore, dspace=None):
+        self._name = name
+        self._type_name = type_name
+        self._wal = wal
+        self._ids = ids
+        self._dspace = dspace
+        self.report = {}
+
+    def _shard_file(self, pos: int) -> str:
+        return f"{self._wal.file_str}.shard-{self._name}-{pos}"
+
+    def _worker(self, pos: int, objs: list, fnc, queue):
+        start = time_fnc()
+        stats = {"shard": pos, "objects": len(objs)}
+        try:
+            # connections must not be shared with the parent process,
+            # database connections are reopened automatically (see `conn`)
+            if self._dspace is not None:
+                self._dspace.after_fork()
+            w = wal_cls(self._shard_file(pos), resume=True)
+            try:
+                for k, v in (fnc(objs, w) or {}).items():
+                    stats[k] = v
+            finally:
+                w.close()
+                # store also objects created before a failure
+                ids = idstore(self._ids.file_str)
+                ids.upsert_many(self._type_name, {
+                    k: rec["uuid"] for k, rec in w.records(self._type_name).items()})
+                ids.close()
+        except Exception as e:
+            _logger.critical(f"Shard [{self._name}:{pos}] failed: [{str(e)}]")
+            stats["failed"] = str(e)
+        stats["took"] = round(time_fnc() - start, 2)
+        queue.put(stats)
+
+    def run(self, shards: list, fnc) -> dict:
+        """
+            Run `fnc` over all shards and return rolled up counters.
+        """
+        if self._wal.file_str is None:
+            raise ValueError("Sharded import requires WAL stored in a file")
+
+        # make sure the workers do not inherit unflushed data
+        self._wal.sync()
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        procs = []
+        _logger.info(
+            f"Running [{self._name}] in [{len(shards)}] shards: {[len(x) for x in shards]}")
+        for pos, objs in enumerate(shards):
+            p = ctx.Process(target=self._worker, args=(pos, objs, fnc, queue),
+                            name=f"shard-{self._name}-{pos}")
+            p.start()
+            procs.append(p)
+
+        reports = []
+        while len(reports) < len(procs):
+            try:
+                reports.append(queue.get(timeout=5))
+            except queue_lib.Empty:
+                # a worker killed e.g., by OOM killer never reports
+                if not any(p.is_alive() for p in procs) and queue.empty():
+                    break
+        for p in procs:
+            p.join()
+            if p.exitcode != 0:
+                _logger.critical(f"Shard process [{p.name}] exited with [{p.exitcode}]")
+
+        self._wal.merge_shards()
+        self.report = self._roll_up(sorted(reports, key=lambda x: x["shard"]), len(shards))
+        return self.report
+
+    def _roll_up(self, reports: list, shards_n: int) -> dict:
+        total = {}
+        for r in reports:
+            _logger.info(
+                f"Shard [{self._name}:{r['shard']}] " +
+                " ".join(f"{k}:[{v}]" for k, v in r.items() if k != "shard"))
+            for k, v in r.items():
+                if k in ("shard", "took"):
+                    continue
+                if isinstance(v, (int, float)):
+                    total[k] = total.get(k, 0) + v
+        reported = {r["shard"] for r in reports}
+        failed = [r["shard"] for r in reports if "failed" in r]
+        failed += [x for x in range(shards_n) if x not in reported]
+        total["failed_shards"] = failed
+        total["took_max"] = max([r["took"] for r in reports] or [0])
+        _logger.info(
+            f"Shards [{self._name}] total " + " ".join(f"{k}:[{v}]" for k, v in total.items()))
+        return total
+
+    def id2uuid(self) -> dict:
+        """
+            Ids created by all shards (and previous runs) read back from the shared store,
+            completed by merged shard logs in case a worker died before storing its ids.
+        """
+        res = self._ids.id2uuid(self._type_name)
+        for k, rec in self._wal.records(self._type_name).items():
+            res.setdefault(k, rec["uuid"])
+        return res
+
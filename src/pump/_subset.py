@@ -0,0 +1,234 @@
+import logging
+
+from ._utils import IMPORT_LIMIT
+
+_logger = logging.getLogger("pump.subset")
+
+# v5 resource type ids
+_BITSTREAM = 0
+_BUNDLE = 1
+_ITEM = 2
+_COLLECTION = 3
+_COMMUNITY = 4
+_GROUP = 6
+_EPERSON = 7
+
+# Anonymous and Administrator groups always exist
+_SPECIAL_GROUPS = [0, 1]
+
+
+def _array(values) -> str:
+    """
+        SQL array literal of ints or strings.
+    """
+    values = sorted(set(values))
+    if len(values) == 0:
+        return "ARRAY[]::integer[]"
+    if all(isinstance(x, int) for x in values):
+        return "ARRAY[" + ",".join(str(x) for x in values) + "]"
+    return "ARRAY[" + ",".join("'" + str(x).replace("'", "''") + "'" for x in values) + "]"
+
+
+def _in(col: str, values) -> str:
+    return f"{col} = ANY({_array(values)})"
+
+
+class subset:
+    """
+        Import only a part of the repository - selected communities, collections (by handle)
+        and items (by id) together with everything they need:
+            - communities: selected, their subcommunities and ancestors
+            - collections: selected, in selected communities, owning collections of selected items
+            - items: selected, owned by selected collections (incl. workspace and workflow items)
+            - bundles, bitstreams of items, logos
+            - handles, metadata and resource policies of all the above
+            - groups used by policies, communities and collections (with member groups)
+            - epersons submitting items, used by policies or members of the groups
+
+        If nothing is selected and `IMPORT_LIMIT` is set, the first `IMPORT_LIMIT` archived items are selected.
+
+        The closure is computed from the v5 database, exported tables are filtered by `where(table)`.
+    """
+
+    # tables of finished phases are not exported when resuming
+    skip_finished = True
+
+    def __init__(self, handles: list = None, item_ids: list = None, limit: int = None):
+        self._handles = list(handles or [])
+        self._item_ids = [int(x) for x in (item_ids or [])]
+        self._limit = limit if limit is not None else IMPORT_LIMIT
+        self._ids = None
+        self._wheres = None
+
+    @staticmethod
+    def from_env(env: dict):
+        d = env.get("subset", None) or {}
+        if not (d.get("handles") or d.get("items") or IMPORT_LIMIT):
+            return None
+        return subset(d.get("handles"), d.get("items"))
+
+    @property
+    def ids(self) -> dict:
+        return self._ids
+
+    def __repr__(self):
+        return f"subset(handles={self._handles}, items={self._item_ids}, limit={self._limit})"
+
+    # =============
+
+    @staticmethod
+    def _col(db5, sql: str) -> set:
+        return {x[0] for x in db5.fetch_all(sql) if x[0] is not None}
+
+    def compute(self, db5):
+        """
+            Compute the closure of selected objects from v5 database.
+        """
+        coms, cols, items = set(), set(), set(self._item_ids)
+        if len(self._handles) > 0:
+            found = db5.fetch_all(
+                f"SELECT handle, resource_type_id, resource_id FROM handle WHERE {_in('handle', self._handles)}")
+            for handle, res_type_id, res_id in found:
+                if res_type_id == _COMMUNITY:
+                    coms.add(res_id)
+                elif res_type_id == _COLLECTION:
+                    cols.add(res_id)
+                elif res_type_id == _ITEM:
+                    items.add(res_id)
+                else:
+                    _logger.warning(f"Handle [{handle}] of unsupported type [{res_type_id}] ignored")
+            missing = set(self._handles) - {x[0] for x in found}
+            if len(missing) > 0:
+                _logger.critical(f"Handles not found in v5: {sorted(missing)}")
+
+        if len(self._handles) == 0 and len(items) == 0 and self._limit:
+            items |= self._col(
+                db5, f"SELECT item_id FROM item WHERE in_archive ORDER BY item_id LIMIT {int(self._limit)}")
+
+        # down: subcommunities, their collections and items
+        com2com = db5.fetch_all("SELECT parent_comm_id, child_comm_id FROM community2community")
+        children = {}
+        parent_of = {}
+        for parent_id, child_id in com2com:
+            children.setdefault(parent_id, []).append(child_id)
+            parent_of.setdefault(child_id, parent_id)
+        todo = list(coms)
+        while len(todo) > 0:
+            for child_id in children.get(todo.pop(), []):
+                if child_id not in coms:
+                    coms.add(child_id)
+                    todo.append(child_id)
+
+        com2col = db5.fetch_all("SELECT community_id, collection_id FROM community2collection")
+        cols |= {col_id for com_id, col_id in com2col if com_id in coms}
+        if len(cols) > 0:
+            for table in ("item", "workspaceitem", "workflowitem"):
+                col = "owning_collection" if table == "item" else "collection_id"
+                items |= self._col(db5, f"SELECT item_id FROM {table} WHERE {_in(col, cols)}")
+
+        # up: owning collections, their communities and ancestors
+        if len(items) > 0:
+            cols |= self._col(db5, f"SELECT owning_collection FROM item WHERE {_in('item_id', items)}")
+            for table in ("workspaceitem", "workflowitem"):
+                cols |= self._col(db5, f"SELECT collection_id FROM {table} WHERE {_in('item_id', items)}")
+        coms |= {com_id for com_id, col_id in com2col if col_id in cols}
+        for com_id in list(coms):
+            cur = parent_of.get(com_id, None)
+            while cur is not None and cur not in coms:
+                coms.add(cur)
+                cur = parent_of.get(cur, None)
+
+        # content
+        bundles = self._col(db5, f"SELECT bundle_id FROM item2bundle WHERE {_in('item_id', items)}")
+        bitstreams = self._col(db5, f"SELECT bitstream_id FROM bundle2bitstream WHERE {_in('bundle_id', bundles)}")
+        bitstreams |= self._col(
+            db5, f"SELECT logo_bitstream_id FROM community WHERE {_in('community_id', coms)}")
+        bitstreams |= self._col(
+            db5, f"SELECT logo_bitstream_id FROM collection WHERE {_in('collection_id', cols)}")
+
+        objs = {
+            _BITSTREAM: bitstreams,
+            _BUNDLE: bundles,
+            _ITEM: items,
+            _COLLECTION: cols,
+            _COMMUNITY: coms,
+        }
+        policies_where = self._res_where(objs)
+
+        # groups and their member groups
+        groups = set(_SPECIAL_GROUPS)
+        groups |= self._col(db5, f"SELECT admin FROM community WHERE {_in('community_id', coms)}")
+        for col in ("workflow_step_1", "workflow_step_2", "workflow_step_3", "submitter", "admin"):
+            groups |= self._col(db5, f"SELECT {col} FROM collection WHERE {_in('collection_id', cols)}")
+        groups |= self._col(db5, f"SELECT epersongroup_id FROM resourcepolicy WHERE {policies_where}")
+        group2group = db5.fetch_all("SELECT parent_id, child_id FROM group2group")
+        todo = list(groups)
+        while len(todo) > 0:
+            cur = todo.pop()
+            for parent_id, child_id in group2group:
+                if parent_id == cur and child_id not in groups:
+                    groups.add(child_id)
+                    todo.append(child_id)
+
+        epersons = self._col(db5, f"SELECT submitter_id FROM item WHERE {_in('item_id', items)}")
+        epersons |= self._col(db5, f"SELECT eperson_id FROM resourcepolicy WHERE {policies_where}")
+        epersons |= self._col(
+            db5, f"SELECT eperson_id FROM epersongroup2eperson WHERE {_in('eperson_group_id', groups)}")
+
+        objs[_GROUP] = groups
+        objs[_EPERSON] = epersons
+        self._ids = objs
+        self._wheres = self._build_wheres(objs, policies_where)
+        _logger.info(
+            f"Subset {self}: communities:[{len(coms)}] collections:[{len(cols)}] items:[{len(items)}] "
+            f"bundles:[{len(bundles)}] bitstreams:[{len(bitstreams)}] groups:[{len(groups)}] "
+            f"epersons:[{len(epersons)}]")
+        return objs
+
+    @staticmethod
+    def _res_where(objs: dict) -> str:
+        arr = [f"(resource_type_id = {t} AND {_in('resource_id', ids)})"
+               for t, ids in objs.items() if len(ids) > 0]
+        return "(" + " OR ".join(arr) + ")" if len(arr) > 0 else "FALSE"
+
+    @staticmethod
+    def _build_wheres(objs: dict, policies_where: str) -> dict:
+        bitstreams, bundles, items = objs[_BITSTREAM], objs[_BUNDLE], objs[_ITEM]
+        cols, coms = objs[_COLLECTION], objs[_COMMUNITY]
+        groups, epersons = objs[_GROUP], objs[_EPERSON]
+        mappings = f"SELECT mapping_id FROM license_resource_mapping WHERE {_in('bitstream_id', bitstreams)}"
+        transactions = f"SELECT transaction_id FROM license_resource_user_allowance WHERE mapping_id IN ({mappings})"
+        return {
+            "handle": f"(resource_id IS NULL OR {subset._res_where(objs)})",
+            "metadatavalue": subset._res_where(objs),
+            "resourcepolicy": policies_where,
+            "community": _in("community_id", coms),
+            "community2community": _in("child_comm_id", coms),
+            "collection": _in("collection_id", cols),
+            "community2collection": f"{_in('collection_id', cols)} AND {_in('community_id', coms)}",
+            "item": _in("item_id", items),
+            "workspaceitem": _in("item_id", items),
+            "workflowitem": _in("item_id", items),
+            "collection2item": f"{_in('item_id', items)} AND {_in('collection_id', cols)}",
+            "bundle": _in("bundle_id", bundles),
+            "item2bundle": _in("item_id", items),
+            "bitstream": _in("bitstream_id", bitstreams),
+            "bundle2bitstream": _in("bundle_id", bundles),
+            "epersongroup": _in("eperson_group_id", groups),
+            "group2group": f"{_in('parent_id', groups)} AND {_in('child_id', groups)}",
+            "eperson": _in("eperson_id", epersons),
+            "epersongroup2eperson": f"{_in('eperson_group_id', groups)} AND {_in('eperson_id', epersons)}",
+            # dspace-utilities
+            "user_registration": _in("eperson_id", epersons),
+            "license_resource_mapping": _in("bitstream_id", bitstreams),
+            "license_resource_user_allowance": f"mapping_id IN ({mappings})",
+            "user_metadata": f"transaction_id IN ({transactions})",
+        }
+
+    def where(self, table_name: str):
+        """
+            SQL condition selecting rows of the subset or None if the table is exported fully.
+        """
+        if self._wheres is None:
+            raise RuntimeError("Subset is not computed")
+        return self._wheres.get(table_name, None)
@@ -0,0 +1,180 @@
+import os
+import json
+import logging
+import threading
+from time import time as time_fnc
+
+_logger = logging.getLogger("pump.tracing")
+
+
+class _no_span:
+    """
+        Span used when tracing is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_SPAN = _no_span()
+
+
+class _span:
+    def __init__(self, t, name: str, cat: str, attrs: dict):
+        self._t = t
+        self._name = name
+        self._cat = cat
+        self._attrs = attrs
+        self._start = None
+
+    def __enter__(self):
+        self._start = time_fnc()
+        self._t._push(self._attrs)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        attrs = self._t._pop()
+        if exc_value is not None:
+            attrs = dict(attrs, error=str(exc_value))
+        self._t.emit(self._name, self._cat, self._start, time_fnc(), attrs)
+        return False
+
+
+def span(name: str, cat: str = "object", **attrs):
+    """
+        Span around a block (e.g., import of one object), its attributes are added
+        to all spans inside it. Does nothing when tracing is off.
+    """
+    t = tracer.active
+    if t is None:
+        return _NO_SPAN
+    return _span(t, name, cat, attrs)
+
+
+class tracer:
+    """
+        Local trace spans of phases, REST requests and SQL statements written into a file
+        in Chrome trace event format (chrome://tracing, Perfetto, speedscope).
+
+        The file is a JSON array with one complete ("X") event per line and without
+        the closing bracket (allowed by the format), so it can be read while the import
+        is running and it is still valid after a crash.
+
+        It is a scheduler hook, a REST listener (`dspace.rest.add_listener`) and
+        a statement listener (`db.add_listener`); `span` adds spans and attributes
+        (e.g., v5 id of the imported object) inside phases.
+    """
+
+    active = None
+
+    SQL_LEN = 200
+
+    def __init__(self, file_str: str):
+        self._file_str = file_str
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = set()
+        self._pid = os.getpid()
+        os.makedirs(os.path.dirname(file_str) or ".", exist_ok=True)
+        self._fout = open(file_str, mode="w", encoding="utf-8")
+        self._fout.write("[\n")
+
+    def start(self):
+        tracer.active = self
+        # forked workers (shards) do not write into the parent trace
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=tracer._after_fork)
+        _logger.info(f"Tracing into [{self._file_str}]")
+        return self
+
+    @staticmethod
+    def _after_fork():
+        tracer.active = None
+
+    def close(self):
+        if tracer.active is self:
+            tracer.active = None
+        with self._lock:
+            if self._fout is not None:
+                self._fout.close()
+                self._fout = None
+
+    # =============
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = [{}]
+        return self._local.stack
+
+    def _push(self, attrs: dict):
+        stack = self._stack()
+        stack.append(dict(stack[-1], **attrs))
+
+    def _pop(self) -> dict:
+        return self._stack().pop()
+
+    def _attrs(self) -> dict:
+        return self._stack()[-1]
+
+    def emit(self, name: str, cat: str, start: float, end: float, attrs: dict = None):
+        if os.getpid() != self._pid:
+            return
+        th = threading.current_thread()
+        tid = th.native_id if th.native_id is not None else th.ident
+        events = []
+        if tid not in self._threads:
+            events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                           "args": {"name": th.name}})
+        events.append({
+            "name": name, "cat": cat, "ph": "X", "pid": self._pid, "tid": tid,
+            "ts": int(start * 1e6), "dur": max(0, int((end - start) * 1e6)),
+            "args": attrs or {},
+        })
+        lines = "".join(json.dumps(x, default=str) + ",\n" for x in events)
+        with self._lock:
+            self._threads.add(tid)
+            if self._fout is not None:
+                self._fout.write(lines)
+
+    # ============= scheduler hook
+
+    def phase_start(self, p):
+        self._push({"phase": p.name})
+        self._local.phase_start = time_fnc()
+
+    def phase_end(self, p):
+        self._pop()
+        attrs = {} if p.error is None else {"error": str(p.error)}
+        self.emit(p.name, "phase", getattr(self._local, "phase_start", p.start), time_fnc(), attrs)
+        with self._lock:
+            if self._fout is not None:
+                self._fout.flush()
+
+    # ============= REST listener
+
+    def request_start(self, method: str, command: str):
+        return method, command, time_fnc()
+
+    def request_end(self, token, response, error):
+        method, command, start = token
+        attrs = dict(self._attrs(), endpoint=command)
+        if error is not None:
+            attrs["error"] = str(error)
+        else:
+            attrs["status"] = getattr(response, "status_code", None)
+        self.emit(f"{method} {command.split('?')[0]}", "rest", start, time_fnc(), attrs)
+
+    # ============= statement listener
+
+    def statement_start(self, sql: str):
+        return sql, time_fnc()
+
+    def statement_end(self, token, rows, error):
+        sql, start = token
+        attrs = dict(self._attrs(), sql=sql[:tracer.SQL_LEN], rows=rows)
+        if error is not None:
+            attrs["error"] = str(error)
+        self.emit("SQL", "db", start, time_fnc(), attrs)
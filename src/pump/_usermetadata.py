@@ -1,5 +1,6 @@
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.usermetadata")
 
@@ -49,7 +50,6 @@ class usermetadatas:
         return len(self._umeta or {})
 
     def uuid(self, b_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid.get(str(b_id))
 
     @property
@@ -57,14 +57,19 @@ class usermetadatas:
         return self._imported.get('um', 0)
 
     @time_method
-    def import_to(self, dspace, bitstreams, userregistrations):
+    def import_to(self, dspace, bitstreams, userregistrations, wal=None):
         expected = len(
             self._umeta_transid2ums or {})
         log_key = "usermetadata"
         log_before_import(log_key, expected)
 
+        wal = ensure_wal(wal)
+        self._imported['um'] += len(wal.records("usermetadata"))
+
         # Go through dict and import user_metadata
         for t_id, um_arr in progress_bar(self._umeta_transid2ums.items()):
+            if wal.done("usermetadata", t_id):
+                continue
             um0 = um_arr[0]
             # Get user_registration data for importing
             ua_d = self._uallowance_transid2d.get(um0['transaction_id'])
@@ -103,6 +108,7 @@ class usermetadatas:
                 }
                 resp = dspace.put_usermetadata(params, data)
                 self._imported['um'] += 1
+                wal.append("usermetadata", t_id)
             except Exception as e:
                 _logger.error(f'put_usermetadata: [{t_id}] failed [{str(e)}]')
 
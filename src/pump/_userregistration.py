@@ -1,5 +1,6 @@
 import logging
 from ._utils import read_json, time_method, serialize, deserialize, progress_bar, log_before_import, log_after_import
+from ._wal import ensure_wal
 
 _logger = logging.getLogger("pump.userregistration")
 
@@ -27,8 +28,11 @@ class userregistrations:
     def __len__(self):
         return len(self._ur or {})
 
+    @property
+    def id2uuid(self):
+        return self._id2uuid
+
     def uuid(self, e_id: int):
-        assert isinstance(list(self._id2uuid.keys() or [""])[0], str)
         return self._id2uuid[str(e_id)]
 
     @property
@@ -36,7 +40,7 @@ class userregistrations:
         return self._imported['users']
 
     @time_method
-    def import_to(self, dspace, epersons):
+    def import_to(self, dspace, epersons, wal=None):
         """
             Import data into database.
             Mapped tables: user_registration
@@ -45,7 +49,12 @@ class userregistrations:
         log_key = "userregistration"
         log_before_import(log_key, expected)
 
+        wal = ensure_wal(wal)
+        self._imported['users'] += wal.replay_into("userregistration", self._id2uuid)
+
         for ur in progress_bar(self._ur):
+            if wal.done("userregistration", ur['eperson_id']):
+                continue
             data = {
                 'email': ur['email'],
                 'organization': ur['organization'],
@@ -59,6 +68,7 @@ class userregistrations:
                 resp = dspace.put_userregistration(data)
                 self._id2uuid[str(e_id)] = resp['id']
                 self._imported['users'] += 1
+                wal.append("userregistration", e_id, resp['id'])
             except Exception as e:
                 _logger.error(f'put_userregistration: [{e_id}] failed [{str(e)}]')
 
@@ -4,6 +4,7 @@ import logging
 from datetime import datetime, timezone
 from time import time as time_fnc
 
+from ._perf import perf
 
 _logger = logging.getLogger("pump.utils")
 
@@ -33,12 +34,18 @@ def time_method(func):
         Timer decorator will store execution time of a function into
         the class which it uses. The time will be stored in
         instance.timed
+
+        The call is also recorded under the running phase of the performance report.
     """
 
     def _enclose(self, *args, **kw):
         """ Enclose every function with this one. """
         start = time_fnc()
-        res = func(self, *args, **kw)
+        perf_start = perf.instance().snapshot()
+        try:
+            res = func(self, *args, **kw)
+        finally:
+            perf.instance().method(f"{type(self).__name__}.{func.__name__}", perf_start)
         took = time_fnc() - start
         if took > 10.:
             _logger.info(f"Method [{func.__name__}] took [{round(took, 2)}] seconds.")
@@ -128,4 +135,5 @@ def log_before_import(msg: str, expected: int):
 
 def log_after_import(msg: str, expected: int, imported: int):
     prefix = "OK " if expected == imported else "!!! WARN !!! "
+    perf.instance().add_objects(imported, max(0, (expected or 0) - (imported or 0)))
     _logger.info(f"{prefix}Imported [{imported: >4d}] {msg}")
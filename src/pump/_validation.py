@@ -0,0 +1,181 @@
+import copy
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import time as time_fnc
+
+from ._db import db, differ, tester
+from ._idmap import idmap
+from ._repo import repo as repo_cls
+
+_logger = logging.getLogger("pump.validation")
+
+# validation job whose log records are captured, inherited by threads started
+# with the copied context and set for records sent by worker processes
+_current_job = contextvars.ContextVar("validation_job", default=None)
+
+
+class _job:
+    def __init__(self, pos: int, kind: str, name: str, defs: list, repo=None):
+        self.pos = pos
+        self.kind = kind
+        self.name = name
+        self.defs = defs
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.records = []
+        self.error = None
+        self.took = 0.
+
+    def __repr__(self):
+        return f"{self.kind}[{self.name}]"
+
+
+class _capture(logging.Filter):
+    """
+        Keeps log records of validation jobs in their jobs instead of emitting them.
+    """
+
+    def filter(self, record):
+        job = _current_job.get()
+        if job is None:
+            return True
+        # the same record is filtered by every handler
+        with job.lock:
+            if not job.records or job.records[-1] is not record:
+                job.records.append(record)
+        return False
+
+
+class _snapshot:
+    """
+        Repo as seen by one validation job - id -> uuid maps of the existing entities are copied
+        when the job is submitted because import phases keep adding to them.
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._entities = {}
+        for name in repo_cls.entities:
+            # do not create the entity
+            obj = repo.__dict__.get(name, None)
+            if obj is not None:
+                self._entities[name] = self._copy(obj)
+
+    @staticmethod
+    def _copy(obj):
+        res = copy.copy(obj)
+        for k, v in vars(obj).items():
+            if isinstance(v, idmap):
+                setattr(res, k, v.copy())
+            elif k.endswith("2uuid") and isinstance(v, dict):
+                setattr(res, k, dict(v))
+        return res
+
+    def __getattr__(self, name: str):
+        obj = self.__dict__["_entities"].get(name, None)
+        if obj is not None:
+            return obj
+        return getattr(self._repo, name)
+
+    def uuid(self, res_type_id: int, res_id: int):
+        return repo_cls.uuid(self, res_type_id, res_id)
+
+
+class validation_pool:
+    """
+        Run validations (`differ`, `tester`) in background threads so that
+        the next phase does not wait for them.
+
+        Every worker thread uses its own database connections. Log output of a job (including
+        its query threads and worker processes) is kept and emitted in submission order by `report`,
+        so reports of concurrent jobs are not mixed. Jobs use id maps copied at submission,
+        but see the v7 database at the time they run, i.e., possibly with objects
+        of later phases already imported.
+    """
+
+    def __init__(self, env: dict, repo, workers: int = 2):
+        self._env = env
+        self._repo = repo
+        self._workers = max(1, workers)
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._futures = []
+        self._pool = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="validation")
+        self._capture = _capture()
+        self._handlers = list(logging.getLogger().handlers)
+        for h in self._handlers:
+            h.addFilter(self._capture)
+
+    def _dbs(self):
+        dbs = getattr(self._local, "dbs", None)
+        if dbs is None:
+            dbs = self._local.dbs = (
+                db(self._env["db_dspace_5"]),
+                db(self._env["db_utilities_5"]),
+                db(self._env["db_dspace_7"]),
+            )
+            with self._lock:
+                self._conns.extend(dbs)
+        return dbs
+
+    def _run(self, job: _job):
+        token = _current_job.set(job)
+        start = time_fnc()
+        try:
+            db5, db_utilities5, db7 = self._dbs()
+            if job.kind == "diff":
+                mode = self._env.get("validate_mode", "rows")
+                pushdown = self._env.get("validate_pushdown", True)
+                differ(db5, db_utilities5, db7, repo=job.repo, mode=mode, pushdown=pushdown,
+                       sample_size=self._env.get("sample_size", 400),
+                       sample_seed=self._env.get("sample_seed", 0)).validate(job.defs)
+            else:
+                tester(db5, db_utilities5, db7, repo=job.repo,
+                       report_file=self._repo.test_report_file(job.name)).run_tests(job.defs)
+        except Exception as e:
+            job.error = e
+            _logger.critical(f"Validation [{job}] failed: [{str(e)}]")
+        finally:
+            job.took = time_fnc() - start
+            _current_job.reset(token)
+        return job
+
+    def submit(self, kind: str, name: str, defs: list):
+        """
+            Queue `diff` (list of `validate_table`) or `test` (list of `test_table`) job.
+        """
+        snapshot = _snapshot(self._repo)
+        with self._lock:
+            job = _job(len(self._jobs), kind, name, defs, snapshot)
+            self._jobs.append(job)
+            self._futures.append(self._pool.submit(self._run, job))
+        _logger.info(f"Queued validation [{job}]")
+        return job
+
+    def wait(self):
+        wait(self._futures)
+
+    def report(self):
+        """
+            Emit logs of all finished jobs in submission order.
+        """
+        for job in self._jobs:
+            _logger.info("=" * 10 + f" Report of {job} took [{round(job.took, 2)}] seconds " + "=" * 10)
+            for record in job.records:
+                logging.getLogger(record.name).handle(record)
+        failed = [str(x) for x in self._jobs if x.error is not None]
+        _logger.info(f"Validations: [{len(self._jobs)}], failed: {failed}")
+
+    def close(self):
+        self.wait()
+        self._pool.shutdown()
+        for h in self._handlers:
+            h.removeFilter(self._capture)
+        for x in self._conns:
+            x.close()
+        self.report()
@@ -0,0 +1,135 @@
+import logging
+
+_logger = logging.getLogger("pump.version_chains")
+
+
+class version_chains:
+    """
+        Precomputed graph of item versions built from `dc.relation.replaces`
+        and `dc.relation.isreplacedby` metadata.
+
+        Metadata are read in one pass, every chain is walked once and every item
+        is mapped to its chain so that a chain is never recomputed for its members.
+
+        Chains contain handles ordered from the first version to the latest one.
+    """
+
+    def __init__(self, id2item: dict, metadatas, res_type_id: int):
+        self._id2item = id2item
+        self._handle2item = metadatas.versions
+        self._replaces_id = metadatas.V5_DC_RELATION_REPLACES_ID
+        self._isreplacedby_id = metadatas.V5_DC_RELATION_ISREPLACEDBY_ID
+        self._uri_id = metadatas.V5_DC_IDENTIFIER_URI_ID
+        self._links = metadatas.texts(
+            res_type_id, [self._replaces_id, self._isreplacedby_id, self._uri_id])
+
+        # list of (first item id, handles)
+        self._chains = []
+        # item id (str) -> index in self._chains
+        self._item2chain = {}
+        self.withdrawn = []
+        self.not_imported = []
+        self.not_imported_handles = []
+        self.cycles = 0
+        self._build()
+
+    def __len__(self):
+        return len(self._chains)
+
+    def _link(self, item_id: str, field_id: int):
+        arr = self._links.get(item_id, {}).get(field_id, None)
+        if len(arr or []) == 0:
+            return None
+        return arr[0]
+
+    def _item_id(self, handle: str):
+        d = self._handle2item.get(handle, None)
+        if d is None:
+            return None
+        return str(d['item_id'])
+
+    def _walk(self, item_id: str, field_id: int, visited: set) -> list:
+        """
+            Follow `field_id` links from `item_id` until the chain ends, leaves the repository
+            or returns to already visited handle.
+        """
+        versions = []
+        cur_item_id = item_id
+        cur_handle = self._link(cur_item_id, field_id)
+        while cur_handle is not None:
+            if cur_handle in visited:
+                _logger.warning(
+                    f"Detected cyclic version reference for handle: {cur_handle}. Breaking loop.")
+                self.cycles += 1
+                break
+            visited.add(cur_handle)
+            versions.append(cur_handle)
+
+            next_item_id = self._item_id(cur_handle)
+            if next_item_id is None:
+                # Check if current item is withdrawn
+                cur_item = self._id2item.get(cur_item_id, None) or {}
+                if cur_item.get('withdrawn'):
+                    _logger.debug(f'Item [{cur_handle}] is withdrawn')
+                    self.withdrawn.append(cur_handle)
+                else:
+                    _logger.error(
+                        f'The item with handle: {cur_handle} has not been imported!')
+                    self.not_imported.append(cur_handle)
+                break
+
+            cur_item_id = next_item_id
+            cur_handle = self._link(cur_item_id, field_id)
+        return versions
+
+    def _chain(self, item_id: str):
+        if self._link(item_id, self._isreplacedby_id) is None and \
+                self._link(item_id, self._replaces_id) is None:
+            return None
+
+        cur_handle = self._link(item_id, self._uri_id)
+        if cur_handle is None:
+            _logger.error(f'Cannot find handle for the item with id: {item_id}')
+            self.not_imported_handles.append(item_id)
+            return None
+
+        visited = {cur_handle}
+        newer = self._walk(item_id, self._isreplacedby_id, visited)
+        older = self._walk(item_id, self._replaces_id, visited)
+        return older[::-1] + [cur_handle] + newer
+
+    def _build(self):
+        for item_id in self._id2item.keys():
+            if item_id in self._item2chain:
+                continue
+            versions = self._chain(item_id)
+            if versions is None:
+                continue
+            pos = len(self._chains)
+            self._chains.append((item_id, versions))
+            self._item2chain[item_id] = pos
+            for handle in versions:
+                member_id = self._item_id(handle)
+                if member_id is not None:
+                    self._item2chain.setdefault(member_id, pos)
+
+        _logger.info(
+            f"Version chains [{len(self._chains)}], items in chains [{len(self._item2chain)}], "
+            f"cycles [{self.cycles}]")
+
+    # =============
+
+    def chains(self) -> list:
+        """
+            @return: list of (first item id, handles) - every chain only once
+        """
+        return self._chains
+
+    def versions(self, item_id) -> list:
+        """
+            @return: handles of all versions of the item or None
+        """
+        pos = self._item2chain.get(str(item_id), None)
+        if pos is None:
+            return None
+        return self._chains[pos][1]
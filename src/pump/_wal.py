@@ -0,0 +1,186 @@
+import json
+import os
+import glob
+import logging
+import threading
+from time import time as time_fnc
+
+_logger = logging.getLogger("pump.wal")
+
+
+class wal:
+    """
+        Append-only write-ahead log of created objects.
+
+        Every successfully created object is appended as one json line:
+            {"t": <type>, "id": <v5 id>, "uuid": <v7 uuid>, "x": {<extra ids>}}
+
+        Lines are flushed immediately (survives a crash of the process), `fsync`
+        is called in batches (after `fsync_every` records or `fsync_interval` seconds).
+
+        On resume the log is read back and importers use `done`, `get`
+        and `replay_into` to restore their maps and skip already created objects.
+
+        If `file_str` is None, records are kept only in memory.
+    """
+
+    def __init__(self, file_str: str = None, resume: bool = True,
+                 fsync_every: int = 200, fsync_interval: float = 5.):
+        self._file_str = file_str
+        self._fsync_every = fsync_every
+        self._fsync_interval = fsync_interval
+        self._unsynced = 0
+        self._last_sync = time_fnc()
+        self._records = {}
+        self._fout = None
+        self._lock = threading.Lock()
+        if file_str is None:
+            return
+
+        os.makedirs(os.path.dirname(file_str) or ".", exist_ok=True)
+        if resume:
+            self._load()
+        elif os.path.exists(file_str):
+            _logger.info(f"Not resuming, truncating WAL [{file_str}]")
+        self._fout = open(file_str, mode="a" if resume else "w", encoding="utf-8")
+        # make sure the partially written last line is not merged with new records
+        if resume and self._fout.tell() > 0:
+            with open(file_str, mode="rb") as fin:
+                fin.seek(-1, os.SEEK_END)
+                if fin.read(1) != b"\n":
+                    self._fout.write("\n")
+        # shard logs left by a crashed sharded import
+        if resume:
+            self.merge_shards()
+
+    def __len__(self):
+        return sum(len(x) for x in self._records.values())
+
+    @property
+    def file_str(self):
+        return self._file_str
+
+    def __del__(self):
+        self.close()
+
+    def _load(self):
+        if not os.path.exists(self._file_str):
+            return
+        broken = 0
+        with open(self._file_str, mode="r", encoding="utf-8") as fin:
+            for line in fin:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    # the last line could be only partially written
+                    broken += 1
+                    continue
+                self._records.setdefault(rec["t"], {})[str(rec["id"])] = rec
+        if broken > 0:
+            _logger.warning(f"Ignored [{broken}] broken lines in WAL [{self._file_str}]")
+        _logger.info(
+            f"Loaded WAL [{self._file_str}]: " +
+            ", ".join(f"{k}:[{len(v)}]" for k, v in sorted(self._records.items())))
+
+    # =============
+
+    def append(self, type_name: str, v5_id, uuid=None, **extra):
+        """
+            Record successfully created object.
+        """
+        rec = {"t": type_name, "id": str(v5_id), "uuid": uuid}
+        if extra:
+            rec["x"] = extra
+        line = json.dumps(rec) + "\n"
+        with self._lock:
+            self._records.setdefault(type_name, {})[rec["id"]] = rec
+            if self._fout is None:
+                return
+            self._fout.write(line)
+            self._fout.flush()
+            self._unsynced += 1
+            if self._unsynced >= self._fsync_every or \
+                    time_fnc() - self._last_sync > self._fsync_interval:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._fout is None or self._unsynced == 0:
+            return
+        os.fsync(self._fout.fileno())
+        self._unsynced = 0
+        self._last_sync = time_fnc()
+
+    def close(self):
+        if getattr(self, "_fout", None) is None:
+            return
+        with self._lock:
+            self._sync()
+            self._fout.close()
+            self._fout = None
+
+    # =============
+
+    def done(self, type_name: str, v5_id) -> bool:
+        return str(v5_id) in self._records.get(type_name, {})
+
+    def get(self, type_name: str, v5_id):
+        return self._records.get(type_name, {}).get(str(v5_id), None)
+
+    def records(self, type_name: str) -> dict:
+        return self._records.get(type_name, {})
+
+    def types(self) -> list:
+        return list(self._records.keys())
+
+    def merge_shards(self) -> int:
+        """
+            Append records of shard logs (`<file>.shard-*`) written by worker processes
+            and remove them.
+            @return: number of merged records
+        """
+        if self._file_str is None:
+            return 0
+        merged = 0
+        for shard_file in sorted(glob.glob(f"{self._file_str}.shard-*")):
+            shard = wal(shard_file, resume=True)
+            shard.close()
+            for type_name in shard.types():
+                for v5_id, rec in shard.records(type_name).items():
+                    if self.done(type_name, v5_id):
+                        continue
+                    self.append(type_name, v5_id, rec["uuid"], **rec.get("x", {}))
+                    merged += 1
+            self.sync()
+            os.remove(shard_file)
+        if merged > 0:
+            _logger.info(f"Merged [{merged}] records from shard logs into WAL [{self._file_str}]")
+        return merged
+
+    def replay_into(self, type_name: str, id2uuid: dict) -> int:
+        """
+            Fill `id2uuid` with recorded objects of `type_name`.
+            @return: number of newly added entries
+        """
+        added = 0
+        for v5_id, rec in self.records(type_name).items():
+            if v5_id in id2uuid:
+                continue
+            id2uuid[v5_id] = rec["uuid"]
+            added += 1
+        if added > 0:
+            _logger.info(f"Replayed [{added}] [{type_name}] objects from WAL")
+        return added
+
+
+def ensure_wal(w):
+    """
+        Return `w` or in-memory log if WAL is not used.
+    """
+    return w if w is not None else wal(None)
@@ -43,75 +43,12 @@ def deserialize(resume: bool, obj, cache_file: str) -> bool:
     return True
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description='Import data from previous version to current DSpace')
-    parser.add_argument('--resume',
-                        help='Resume by loading values into dictionary',
-                        required=False, type=bool, default=True)
-    parser.add_argument('--config',
-                        help='Update configs',
-                        required=False, type=str, action='append')
-    parser.add_argument('--assetstore',
-                        help='Location of assetstore folder',
-                        required=False, type=str, default="")
-    parser.add_argument('--tempdb',
-                        help='Tempdb export exists',
-                        required=False, action="store_true", default=False)
-    parser.add_argument('--test',
-                        help='Empty table test',
-                        required=False, nargs='*', default=[])
+import_sep = f"\n{40 * '*'}\n"
 
-    args = parser.parse_args()
-    s = time.time()
 
-    for k, v in [x.split("=") for x in (args.config or [])]:
-        _logger.info(f"Updating [{k}]->[{v}]")
-        _1, prev_val = exists_key(k, env, True)
-        if isinstance(prev_val, bool):
-            new_val = str(v).lower() in ("true", "t", "1")
-        elif prev_val is None:
-            new_val = str(v)
-        else:
-            new_val = type(prev_val)(v)
-        set_key(k, new_val, env)
-
-    # add assetstore folder location to env
-    env["assetstore"] = args.assetstore
-
-    # just in case
-    # verify_disabled_mailserver()
-
-    # update based on env
-    for k, v in env["cache"].items():
-        env["cache"][k] = os.path.join(env["resume_dir"], v)
-
-    dspace_be = dspace.rest(
-        env["backend"]["endpoint"],
-        env["backend"]["user"],
-        env["backend"]["password"],
-        env["backend"]["authentication"]
-    )
-
-    env["tempdb"] = args.tempdb
-    env["test"] = args.test
-    _logger.info("Loading repo objects")
-    repo = pump.repo(env, dspace_be)
-
-    ####
-    _logger.info("New instance database status:")
-    repo.raw_db_7.status()
-    _logger.info("Reference database dspace status:")
-    repo.raw_db_dspace_5.status()
-    _logger.info("Reference database dspace-utilities status:")
-    repo.raw_db_utilities_5.status()
-
-    import_sep = f"\n{40 * '*'}\n"
-    _logger.info("Starting import")
-
-    # import handles
+def import_handles(env, repo, dspace_be):
     cache_file = env["cache"]["handle"]
-    if deserialize(args.resume, repo.handles, cache_file):
+    if deserialize(env["resume"], repo.handles, cache_file):
         _logger.info(f"Resuming handle [{repo.handles.imported}]")
     else:
         repo.handles.import_to(dspace_be)
@@ -119,9 +56,10 @@ if __name__ == "__main__":
     repo.diff(repo.handles)
     _logger.info(import_sep)
 
-    # import metadata
+
+def import_metadatas(env, repo, dspace_be):
     cache_file = env["cache"]["metadataschema"]
-    if deserialize(args.resume, repo.metadatas, cache_file):
+    if deserialize(env["resume"], repo.metadatas, cache_file):
         _logger.info(
             f"Resuming metadata [schemas:{repo.metadatas.imported_schemas}][fields:{repo.metadatas.imported_fields}]")
     else:
@@ -130,9 +68,10 @@ if __name__ == "__main__":
     repo.diff(repo.metadatas)
     _logger.info(import_sep)
 
-    # import bitstreamformatregistry
+
+def import_bitstreamformatregistry(env, repo, dspace_be):
     cache_file = env["cache"]["bitstreamformat"]
-    if deserialize(args.resume, repo.bitstreamformatregistry, cache_file):
+    if deserialize(env["resume"], repo.bitstreamformatregistry, cache_file):
         _logger.info(
             f"Resuming bitstreamformatregistry [{repo.bitstreamformatregistry.imported}]")
     else:
@@ -141,33 +80,38 @@ if __name__ == "__main__":
     repo.diff(repo.bitstreamformatregistry)
     _logger.info(import_sep)
 
-    # import community
+
+def import_communities(env, repo, dspace_be):
     cache_file = env["cache"]["community"]
-    if deserialize(args.resume, repo.communities, cache_file):
+    if deserialize(env["resume"], repo.communities, cache_file):
         _logger.info(
             f"Resuming community [coms:{repo.communities.imported_coms}][com2coms:{repo.communities.imported_com2coms}]")
     else:
-        repo.communities.import_to(dspace_be, repo.handles, repo.metadatas)
+        repo.communities.import_to(dspace_be, repo.handles, repo.metadatas, repo.wal)
         if len(repo.communities) == repo.communities.imported_coms:
             repo.communities.serialize(cache_file)
+    repo.store_ids(repo.communities)
     repo.diff(repo.communities)
     _logger.info(import_sep)
 
-    # import collection
+
+def import_collections(env, repo, dspace_be):
     cache_file = env["cache"]["collection"]
-    if deserialize(args.resume, repo.collections, cache_file):
+    if deserialize(env["resume"], repo.collections, cache_file):
         _logger.info(
             f"Resuming collection [cols:{repo.collections.imported_cols}] [groups:{repo.collections.imported_groups}]")
     else:
         repo.collections.import_to(dspace_be, repo.handles,
-                                   repo.metadatas, repo.communities)
+                                   repo.metadatas, repo.communities, repo.wal)
         repo.collections.serialize(cache_file)
+    repo.store_ids(repo.collections)
     repo.diff(repo.collections)
     _logger.info(import_sep)
 
-    # import registration data
+
+def import_registrationdatas(env, repo, dspace_be):
     cache_file = env["cache"]["registrationdata"]
-    if deserialize(args.resume, repo.registrationdatas, cache_file):
+    if deserialize(env["resume"], repo.registrationdatas, cache_file):
         _logger.info(f"Resuming registrationdata [{repo.registrationdatas.imported}]")
     else:
         repo.registrationdatas.import_to(dspace_be)
@@ -175,51 +119,59 @@ if __name__ == "__main__":
     repo.diff(repo.registrationdatas)
     _logger.info(import_sep)
 
-    # import eperson groups
+
+def import_groups(env, repo, dspace_be):
     cache_file = env["cache"]["epersongroup"]
-    if deserialize(args.resume, repo.groups, cache_file):
+    if deserialize(env["resume"], repo.groups, cache_file):
         _logger.info(
             f"Resuming epersongroup [eperson:{repo.groups.imported_eperson}] [g2g:{repo.groups.imported_g2g}]")
     else:
         repo.groups.import_to(dspace_be, repo.metadatas, repo.collections.groups_id2uuid,
-                              repo.communities.imported_groups)
+                              repo.communities.imported_groups, repo.wal)
         repo.groups.serialize(cache_file)
+    repo.store_ids(repo.groups)
     repo.diff(repo.groups)
     _logger.info(import_sep)
 
-    # import eperson
+
+def import_epersons(env, repo, dspace_be):
     cache_file = env["cache"]["eperson"]
-    if deserialize(args.resume, repo.epersons, cache_file):
+    if deserialize(env["resume"], repo.epersons, cache_file):
         _logger.info(f"Resuming epersons [{repo.epersons.imported}]")
     else:
-        repo.epersons.import_to(env, dspace_be, repo.metadatas)
+        repo.epersons.import_to(env, dspace_be, repo.metadatas, repo.wal)
         repo.epersons.serialize(cache_file)
+    repo.store_ids(repo.epersons)
     repo.diff(repo.epersons)
     _logger.info(import_sep)
 
-    # import userregistrations
+
+def import_userregistrations(env, repo, dspace_be):
     cache_file = env["cache"]["userregistration"]
-    if deserialize(args.resume, repo.userregistrations, cache_file):
+    if deserialize(env["resume"], repo.userregistrations, cache_file):
         _logger.info(f"Resuming userregistrations [{repo.userregistrations.imported}]")
     else:
-        repo.userregistrations.import_to(dspace_be, repo.epersons)
+        repo.userregistrations.import_to(dspace_be, repo.epersons, repo.wal)
         repo.userregistrations.serialize(cache_file)
+    repo.store_ids(repo.userregistrations)
     repo.diff(repo.userregistrations)
     _logger.info(import_sep)
 
-    # import group2eperson
+
+def import_egroups(env, repo, dspace_be):
     cache_file = env["cache"]["group2eperson"]
-    if deserialize(args.resume, repo.egroups, cache_file):
+    if deserialize(env["resume"], repo.egroups, cache_file):
         _logger.info(f"Resuming egroups [{repo.egroups.imported}]")
     else:
-        repo.egroups.import_to(dspace_be, repo.groups, repo.epersons)
+        repo.egroups.import_to(dspace_be, repo.groups, repo.epersons, repo.wal)
         repo.egroups.serialize(cache_file)
     repo.diff(repo.egroups)
     _logger.info(import_sep)
 
-    # import licenses
+
+def import_licenses(env, repo, dspace_be):
     cache_file = env["cache"]["license"]
-    if deserialize(args.resume, repo.licenses, cache_file):
+    if deserialize(env["resume"], repo.licenses, cache_file):
         _logger.info(
             f"Resuming licenses [labels:{repo.licenses.imported_labels}] [licenses:{repo.licenses.imported_licenses}]")
     else:
@@ -228,78 +180,490 @@ if __name__ == "__main__":
     repo.diff(repo.licenses)
     _logger.info(import_sep)
 
-    # import item
+
+def import_items(env, repo, dspace_be):
     cache_file = env["cache"]["item"]
-    if deserialize(args.resume, repo.items, cache_file):
+    if deserialize(env["resume"], repo.items, cache_file):
         _logger.info(f"Resuming items [{repo.items.imported}]")
         repo.items.import_to(cache_file, dspace_be, repo.handles,
-                             repo.metadatas, repo.epersons, repo.collections)
+                             repo.metadatas, repo.epersons, repo.collections, repo.wal,
+                             repo.ids, env["shards"])
     else:
         repo.items.import_to(cache_file, dspace_be, repo.handles,
-                             repo.metadatas, repo.epersons, repo.collections)
+                             repo.metadatas, repo.epersons, repo.collections, repo.wal,
+                             repo.ids, env["shards"])
         repo.items.serialize(cache_file)
         repo.items.raw_after_import(
             env, repo.raw_db_7, repo.raw_db_dspace_5, repo.metadatas)
+    repo.store_ids(repo.items)
     repo.diff(repo.items)
     repo.test(repo.items)
     _logger.info(import_sep)
 
-    # import bundle
+
+def import_bundles(env, repo, dspace_be):
     cache_file = env["cache"]["bundle"]
-    if deserialize(args.resume, repo.bundles, cache_file):
+    if deserialize(env["resume"], repo.bundles, cache_file):
         _logger.info(f"Resuming bundles [{repo.bundles.imported}]")
     else:
-        repo.bundles.import_to(dspace_be, repo.metadatas, repo.items)
+        repo.bundles.import_to(dspace_be, repo.metadatas, repo.items, repo.wal)
         repo.bundles.serialize(cache_file)
+    repo.store_ids(repo.bundles)
     repo.diff(repo.bundles)
     _logger.info(import_sep)
 
-    # import bitstreams
+
+def import_bitstreams(env, repo, dspace_be):
     cache_file = env["cache"]["bitstream"]
-    if deserialize(args.resume, repo.bitstreams, cache_file):
+    if deserialize(env["resume"], repo.bitstreams, cache_file):
         _logger.info(f"Resuming bitstreams [{repo.bitstreams.imported}]")
         repo.bitstreams.import_to(
-            env, cache_file, dspace_be, repo.metadatas, repo.bitstreamformatregistry, repo.bundles, repo.communities, repo.collections)
+            env, cache_file, dspace_be, repo.metadatas, repo.bitstreamformatregistry, repo.bundles, repo.communities, repo.collections,
+            repo.wal, repo.ids, env["shards"])
     else:
         repo.bitstreams.import_to(
-            env, cache_file, dspace_be, repo.metadatas, repo.bitstreamformatregistry, repo.bundles, repo.communities, repo.collections)
+            env, cache_file, dspace_be, repo.metadatas, repo.bitstreamformatregistry, repo.bundles, repo.communities, repo.collections,
+            repo.wal, repo.ids, env["shards"])
         repo.bitstreams.serialize(cache_file)
+    repo.store_ids(repo.bitstreams)
     repo.diff(repo.bitstreams)
     repo.test(repo.bitstreams)
     _logger.info(import_sep)
 
-    # import usermetadata
+
+def import_usermetadatas(env, repo, dspace_be):
     cache_file = env["cache"]["usermetadata"]
-    if deserialize(args.resume, repo.usermetadatas, cache_file):
+    if deserialize(env["resume"], repo.usermetadatas, cache_file):
         _logger.info(f"Resuming usermetadatas [{repo.usermetadatas.imported}]")
     else:
-        repo.usermetadatas.import_to(dspace_be, repo.bitstreams, repo.userregistrations)
+        repo.usermetadatas.import_to(dspace_be, repo.bitstreams, repo.userregistrations, repo.wal)
         repo.usermetadatas.serialize(cache_file)
     repo.diff(repo.usermetadatas)
     _logger.info(import_sep)
 
-    # import resourcepolicy
+
+def import_resourcepolicies(env, repo, dspace_be):
     cache_file = env["cache"]["resourcepolicy"]
-    if deserialize(args.resume, repo.resourcepolicies, cache_file):
+    if deserialize(env["resume"], repo.resourcepolicies, cache_file):
         _logger.info(f"Resuming resourcepolicies [{repo.resourcepolicies.imported}]")
     else:
         # before importing of resource policies we have to delete all
-        # created data
-        repo.raw_db_7.delete_resource_policy()
-        repo.resourcepolicies.import_to(env, dspace_be, repo)
+        # created data, unless we are resuming in the middle of this phase
+        if not repo.wal.records("resourcepolicy"):
+            repo.raw_db_7.delete_resource_policy()
+        repo.resourcepolicies.import_to(env, dspace_be, repo, repo.wal)
         repo.resourcepolicies.serialize(cache_file)
     repo.diff(repo.resourcepolicies)
     repo.test(repo.resourcepolicies)
     _logger.info(import_sep)
 
-    # migrate sequences
+
+def import_plan(env, repo, dspace_be):
+    """
+        Compile items, bundles and bitstreams into an operation spool and/or execute it,
+        the regular phases skip all objects created by the plan.
+    """
+    plan = pump.plan(env["cache"]["plan"])
+    mode = env["plan"]
+    if mode == "compile" or (mode == "run" and not (env["resume"] and plan.exists())):
+        plan.compile(env, repo, repo.wal)
+    if mode in ("execute", "run"):
+        plan.execute(dspace_be, repo.wal, env["plan_parallel"])
+    _logger.info(import_sep)
+
+
+def import_pipeline(env, repo, dspace_be):
+    """
+        Items, bundles, bitstreams and resource policies imported per item in a streaming pipeline,
+        validations of these phases run at the end.
+    """
+    objs = [
+        (repo.items, env["cache"]["item"]),
+        (repo.bundles, env["cache"]["bundle"]),
+        (repo.bitstreams, env["cache"]["bitstream"]),
+        (repo.resourcepolicies, env["cache"]["resourcepolicy"]),
+    ]
+    if env["resume"] and all(os.path.exists(cache_file) for _1, cache_file in objs):
+        for obj, cache_file in objs:
+            deserialize(env["resume"], obj, cache_file)
+        _logger.info(
+            f"Resuming pipeline [items:{repo.items.imported}] [bundles:{repo.bundles.imported}] "
+            f"[bitstreams:{repo.bitstreams.imported}] [resourcepolicies:{repo.resourcepolicies.imported}]")
+    else:
+        # partially finished phases, everything recorded in WAL is skipped
+        for obj, cache_file in objs:
+            if deserialize(env["resume"], obj, cache_file):
+                _logger.info(f"Resuming [{type(obj).__name__}] from [{cache_file}]")
+
+        # resource policies created by dspace for the streamed objects are deleted per object
+        pump.pipeline(env, dspace_be, repo).run(env["cache"]["item"])
+        repo.items.serialize(env["cache"]["item"])
+        repo.items.raw_after_import(
+            env, repo.raw_db_7, repo.raw_db_dspace_5, repo.metadatas)
+
+        # objects which do not belong to any item
+        repo.bundles.import_to(dspace_be, repo.metadatas, repo.items, repo.wal)
+        repo.bundles.serialize(env["cache"]["bundle"])
+        repo.bitstreams.import_to(
+            env, env["cache"]["bitstream"], dspace_be, repo.metadatas, repo.bitstreamformatregistry, repo.bundles,
+            repo.communities, repo.collections, repo.wal)
+        repo.bitstreams.serialize(env["cache"]["bitstream"])
+        # all objects exist now, policies created by dspace for objects not handled
+        # by the pipeline (communities, collections, logos, orphan bundles and bitstreams) are deleted
+        repo.resourcepolicies.delete_created(repo, repo.wal)
+        repo.resourcepolicies.import_to(env, dspace_be, repo, repo.wal)
+        repo.resourcepolicies.serialize(env["cache"]["resourcepolicy"])
+
+    for obj in (repo.items, repo.bundles, repo.bitstreams):
+        repo.store_ids(obj)
+    for obj, _1 in objs:
+        repo.diff(obj)
+    repo.test(repo.items)
+    repo.test(repo.bitstreams)
+    repo.test(repo.resourcepolicies)
+    _logger.info(import_sep)
+
+
+def migrate_delta(env, repo, dspace_be, delete: bool):
+    """
+        Migrate only v5 changes made since the last import (see `pump.delta`).
+    """
+    delta = pump.delta(env["cache"]["delta"], repo.fingerprints, repo.ids)
+    # only the changed rows are exported
+    repo.subset = delta
+    delta.compute(repo.raw_db_dspace_5)
+    delta.apply(env, dspace_be, repo, delete)
+    for obj in (repo.items, repo.bundles, repo.bitstreams):
+        repo.store_ids(obj)
+    delta.save(delta.next_state, repo.raw_db_dspace_5)
+    _logger.info(import_sep)
+
+
+def migrate_sequences(env, repo, dspace_be):
     repo.sequences.migrate(env, repo.raw_db_7, repo.raw_db_dspace_5,
                            repo.raw_db_utilities_5)
 
+
+# name, function, phases whose results are used (declaration order is the sequential order)
+phases = [
+    ("handles", import_handles, []),
+    ("metadatas", import_metadatas, []),
+    ("bitstreamformatregistry", import_bitstreamformatregistry, []),
+    ("communities", import_communities, ["handles", "metadatas"]),
+    ("collections", import_collections, ["handles", "metadatas", "communities"]),
+    ("registrationdatas", import_registrationdatas, []),
+    ("groups", import_groups, ["metadatas", "communities", "collections"]),
+    ("epersons", import_epersons, ["metadatas"]),
+    ("userregistrations", import_userregistrations, ["epersons"]),
+    ("egroups", import_egroups, ["groups", "epersons"]),
+    ("licenses", import_licenses, ["epersons"]),
+    # the backend maps licenses of items to their bitstreams when bitstreams are added
+    ("items", import_items, ["handles", "metadatas", "epersons", "collections", "licenses"]),
+    ("bundles", import_bundles, ["metadatas", "items"]),
+    ("bitstreams", import_bitstreams,
+     ["metadatas", "bitstreamformatregistry", "bundles", "communities", "collections"]),
+    ("usermetadatas", import_usermetadatas, ["bitstreams", "userregistrations", "licenses"]),
+    # all created resource policies are deleted first - every phase creating
+    # dspace objects (and their default policies) must be finished
+    ("resourcepolicies", import_resourcepolicies,
+     ["communities", "collections", "groups", "epersons", "egroups", "items", "bundles",
+      "bitstreams", "usermetadatas"]),
+]
+
+
+# phases replaced by `import_pipeline`
+pipeline_phases = ["items", "bundles", "bitstreams", "resourcepolicies"]
+
+
+def pipeline_mode(arr: list) -> list:
+    """
+        Replace item related phases by one streaming phase.
+    """
+    # phases using results of the replaced phases must run after the pipeline
+    after = set(pipeline_phases)
+    for name, fnc, phase_deps in arr:
+        if any(x in after for x in phase_deps):
+            after.add(name)
+    deps = []
+    for name, fnc, phase_deps in arr:
+        if name in pipeline_phases:
+            deps += [x for x in phase_deps if x not in after and x not in deps]
+    res = []
+    for name, fnc, phase_deps in arr:
+        if name == pipeline_phases[0]:
+            res.append(("pipeline", import_pipeline, deps))
+        if name in pipeline_phases:
+            continue
+        phase_deps = [x for x in phase_deps if x not in pipeline_phases] + \
+            (["pipeline"] if any(x in pipeline_phases for x in phase_deps) else [])
+        res.append((name, fnc, phase_deps))
+    return res
+
+
+def plan_mode(arr: list) -> list:
+    """
+        Add the plan phase before the items (or pipeline) phase.
+    """
+    res = []
+    for name, fnc, phase_deps in arr:
+        if name in ("items", "pipeline"):
+            res.append(("plan", import_plan,
+                        ["handles", "metadatas", "epersons", "collections", "communities",
+                         "bitstreamformatregistry", "licenses"]))
+            phase_deps = phase_deps + ["plan"]
+        res.append((name, fnc, phase_deps))
+    return res
+
+
+class finished_phases:
+    """
+        Scheduler hook recording finished phases into WAL, tables used only by
+        finished phases are not exported when resuming.
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+
+    def phase_end(self, p):
+        if p.error is not None:
+            return
+        names = pipeline_phases if p.name == "pipeline" else [p.name]
+        for name in names:
+            if name in self._repo.entities:
+                self._repo.mark_phase_done(name)
+
+
+def create_scheduler(env, repo, dspace_be, parallel: int = 1):
+    sched = pump.scheduler(parallel)
+    sched.add_hook(finished_phases(repo))
+    perf = pump.perf.instance()
+    perf.add_source("rest", lambda: dspace_be.get_cnt + dspace_be.post_cnt)
+    if "perf" in env["cache"]:
+        perf.store_into(env["cache"]["perf"])
+    sched.add_hook(perf)
+    if repo.metrics is not None:
+        sched.add_hook(repo.metrics)
+    if repo.memory is not None:
+        sched.add_hook(repo.memory)
+    if pump.tracer.active is not None:
+        sched.add_hook(pump.tracer.active)
+    prof = env.get("profile", None)
+    if prof is not None and len(prof["phases"]) > 0:
+        prof_phases = list(prof["phases"])
+        if env.get("pipeline", False) and any(x in pipeline_phases for x in prof_phases):
+            prof_phases.append("pipeline")
+        sched.add_hook(pump.profiler.from_log_file(env["log_file"], prof_phases, prof["kind"]))
+    arr = pipeline_mode(phases) if env.get("pipeline", False) else phases
+    if env.get("plan", None) is not None:
+        arr = plan_mode(arr)
+    for name, fnc, deps in arr:
+        sched.add(name, lambda fnc=fnc: fnc(env, repo, dspace_be), deps)
+    # sequences must reflect all imported data
+    sched.add("sequences", lambda: migrate_sequences(env, repo, dspace_be), sched.names())
+    return sched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Import data from previous version to current DSpace')
+    parser.add_argument('--resume',
+                        help='Resume by loading values into dictionary',
+                        required=False, type=bool, default=True)
+    parser.add_argument('--config',
+                        help='Update configs',
+                        required=False, type=str, action='append')
+    parser.add_argument('--assetstore',
+                        help='Location of assetstore folder',
+                        required=False, type=str, default="")
+    parser.add_argument('--tempdb',
+                        help='Tempdb export exists',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--test',
+                        help='Empty table test',
+                        required=False, nargs='*', default=[])
+    parser.add_argument('--parallel',
+                        help='Number of independent phases running concurrently',
+                        required=False, type=int, default=1)
+    parser.add_argument('--pipeline',
+                        help='Import items, bundles, bitstreams and policies per item in a streaming pipeline',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--plan',
+                        help='Compile items, bundles and bitstreams into an operation spool (compile), '
+                             'execute the compiled spool (execute) or both (run)',
+                        required=False, type=str, choices=["compile", "execute", "run"], default=None)
+    parser.add_argument('--plan-parallel',
+                        help='Number of concurrent operations when executing the plan',
+                        required=False, type=int, default=4)
+    parser.add_argument('--shards',
+                        help='Number of processes importing items and bitstreams',
+                        required=False, type=int, default=1)
+    parser.add_argument('--subset-handle',
+                        help='Import only the community/collection/item with this handle '
+                             '(and everything it needs), can be repeated',
+                        required=False, type=str, action='append', default=[])
+    parser.add_argument('--subset-item',
+                        help='Import only the item with this v5 id (and everything it needs), can be repeated',
+                        required=False, type=int, action='append', default=[])
+    parser.add_argument('--delta',
+                        help='Migrate only v5 changes made since the last import',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--delta-delete',
+                        help='Delete items deleted in v5 from v7 during delta migration',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--fingerprints',
+                        help='Store per row fingerprints of exported tables without timestamps '
+                             'and log their changes since the previous export',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--validate-mode',
+                        help='Compare tables by downloading all rows (rows), '
+                             'by hashes of row ranges computed in the databases (hash) '
+                             'or estimate mismatch rates from random samples (sample)',
+                        required=False, type=str, choices=["rows", "hash", "sample"], default="rows")
+    parser.add_argument('--sample-size',
+                        help='Number of sampled rows (objects) per table and resource type in sample mode',
+                        required=False, type=int, default=400)
+    parser.add_argument('--sample-seed',
+                        help='Seed of samples in sample mode',
+                        required=False, type=int, default=0)
+    parser.add_argument('--no-validate-pushdown',
+                        help='Normalize values of cross-version validations in Python instead of SQL',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--metrics-file',
+                        help='Write live metrics in Prometheus text format into this file periodically',
+                        required=False, type=str, default=None)
+    parser.add_argument('--metrics-port',
+                        help='Serve live metrics in Prometheus text format on this HTTP port',
+                        required=False, type=int, default=None)
+    parser.add_argument('--metrics-interval',
+                        help='Seconds between writes of the metrics file',
+                        required=False, type=float, default=15.)
+    parser.add_argument('--profile-phase',
+                        help='Profile this phase, can be repeated',
+                        required=False, type=str, action='append', default=[])
+    parser.add_argument('--profiler',
+                        help='Deterministic profile of the phase thread written as .pstats (cprofile) '
+                             'or stack samples of the phase threads written as collapsed stacks (sampling)',
+                        required=False, type=str, choices=["cprofile", "sampling"], default="cprofile")
+    parser.add_argument('--memory-profile',
+                        help='Trace memory allocations and report top allocation sites after every phase',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--memory-frames',
+                        help='Number of stack frames stored per traced allocation',
+                        required=False, type=int, default=1)
+    parser.add_argument('--trace',
+                        help='Write spans of phases, REST requests and SQL statements into a Chrome trace file',
+                        required=False, action="store_true", default=False)
+    parser.add_argument('--validate-workers',
+                        help='Number of background threads validating finished phases, '
+                             '0 validates synchronously after every phase',
+                        required=False, type=int, default=2)
+
+    args = parser.parse_args()
+    s = time.time()
+
+    for k, v in [x.split("=") for x in (args.config or [])]:
+        _logger.info(f"Updating [{k}]->[{v}]")
+        _1, prev_val = exists_key(k, env, True)
+        if isinstance(prev_val, bool):
+            new_val = str(v).lower() in ("true", "t", "1")
+        elif prev_val is None:
+            new_val = str(v)
+        else:
+            new_val = type(prev_val)(v)
+        set_key(k, new_val, env)
+
+    # add assetstore folder location to env
+    env["assetstore"] = args.assetstore
+
+    # just in case
+    # verify_disabled_mailserver()
+
+    # update based on env
+    for k, v in env["cache"].items():
+        env["cache"][k] = os.path.join(env["resume_dir"], v)
+
+    dspace_be = dspace.rest(
+        env["backend"]["endpoint"],
+        env["backend"]["user"],
+        env["backend"]["password"],
+        env["backend"]["authentication"]
+    )
+
+    env["tempdb"] = args.tempdb
+    env["test"] = args.test
+    env["resume"] = args.resume
+    env["shards"] = args.shards
+    env["pipeline"] = args.pipeline
+    env["plan"] = args.plan
+    env["plan_parallel"] = args.plan_parallel
+    env["fingerprints"] = args.fingerprints
+    env["validate_mode"] = args.validate_mode
+    env["validate_pushdown"] = not args.no_validate_pushdown
+    env["sample_size"] = args.sample_size
+    env["sample_seed"] = args.sample_seed
+    env["profile"] = {"phases": args.profile_phase, "kind": args.profiler}
+    env["subset"] = {"handles": args.subset_handle, "items": args.subset_item}
+    # started before repo objects are loaded
+    mem = None
+    if args.memory_profile:
+        mem = pump.memory(file_str=env["cache"]["memory"], frames=args.memory_frames)
+    trace = None
+    if args.trace:
+        trace = pump.tracer(env["cache"]["trace"]).start()
+        dspace_be.add_listener(trace)
+        pump.db.add_listener(trace)
+    _logger.info("Loading repo objects")
+    repo = pump.repo(env, dspace_be)
+    if mem is not None:
+        mem.set_repo(repo)
+        repo.memory = mem
+    if args.metrics_file is not None or args.metrics_port is not None:
+        repo.metrics = pump.metrics(
+            repo.wal, args.metrics_file, args.metrics_port, args.metrics_interval).start()
+        dspace_be.add_listener(repo.metrics)
+
+    ####
+    _logger.info("New instance database status:")
+    repo.raw_db_7.status()
+    _logger.info("Reference database dspace status:")
+    repo.raw_db_dspace_5.status()
+    _logger.info("Reference database dspace-utilities status:")
+    repo.raw_db_utilities_5.status()
+
+    if args.delta:
+        _logger.info("Starting delta migration")
+        migrate_delta(env, repo, dspace_be, args.delta_delete)
+    else:
+        _logger.info("Starting import")
+        # ids of a previous import would be taken as migrated by the next delta migration
+        if not env["resume"]:
+            repo.ids.clear()
+        # watermarks for the next delta migration are taken before importing
+        watermarks = pump.delta(env["cache"]["delta"], repo.fingerprints).snapshot(repo.raw_db_dspace_5)
+        if args.validate_workers > 0:
+            repo.validation = pump.validation_pool(env, repo, args.validate_workers)
+        sched = create_scheduler(env, repo, dspace_be, args.parallel)
+        # compile only - stop after the plan is written
+        try:
+            sched.run(until="plan" if args.plan == "compile" else None)
+        finally:
+            # reports of the validations are logged at the end
+            if repo.validation is not None:
+                repo.validation.close()
+                repo.validation = None
+        if args.plan == "compile":
+            repo.wal.close()
+            _logger.info(f"Plan compiled into [{env['cache']['plan']}], stopping.")
+            sys.exit(0)
+        pump.delta(env["cache"]["delta"], repo.fingerprints).save(watermarks, repo.raw_db_dspace_5)
+
+    repo.wal.close()
+
     took = time.time() - s
     _logger.info(f"Took [{round(took, 2)}] seconds to import all data")
     _logger.info(
         f"Made [{dspace_be.get_cnt}] GET requests, [{dspace_be.post_cnt}] POST requests.")
+    pump.perf.instance().log_summary()
 
     _logger.info("New instance database status:")
     repo.raw_db_7.status()
@@ -313,3 +677,12 @@ if __name__ == "__main__":
 
     _logger.info("Database test")
     repo.test()
+
+    if repo.metrics is not None:
+        dspace_be.remove_listener(repo.metrics)
+        repo.metrics.close()
+        repo.metrics = None
+    if trace is not None:
+        dspace_be.remove_listener(trace)
+        pump.db.remove_listener(trace)
+        trace.close()
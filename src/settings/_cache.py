@@ -22,4 +22,23 @@ settings = {
 
     "resourcepolicy": "resourcepolicy.json",
     "usermetadata": "user_metadata.json",
+
+    # write-ahead log of created objects, used to resume in the middle of a phase
+    "wal": "wal.jsonl",
+    # persistent id -> uuid mapping (sqlite), usable by tools
+    "idstore": "id2uuid.sqlite",
+    # spool of compiled item/bundle/bitstream operations
+    "plan": "plan.jsonl",
+    # watermarks of the last import used by delta migration
+    "delta": "delta.json",
+    # directory of per row fingerprints of v5 tables (see `pump.fingerprints`)
+    "fingerprints": "fingerprints",
+    # JSON reports of tests (`test_table`), one file per tested object
+    "test_report": "test_report.json",
+    # per phase performance report
+    "perf": "perf.json",
+    # per phase memory report (--memory-profile)
+    "memory": "memory.json",
+    # trace spans of phases, REST requests and SQL statements (--trace)
+    "trace": "trace.json",
 }
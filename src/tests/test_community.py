@@ -0,0 +1,103 @@
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pump._community import communities
+
+
+def _com(com_id: int, admin=None) -> dict:
+    return {"community_id": com_id, "admin": admin, "logo_bitstream_id": None}
+
+
+class _dspace:
+    """
+        Records created communities, uuids are random.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = []
+
+    def put_community(self, parent_d, data):
+        with self._lock:
+            self.created.append((data["handle"], (parent_d or {}).get("parent", None)))
+        return {"id": str(uuid.uuid4())}
+
+    def put_community_admin_group(self, com_uuid):
+        return {"id": str(uuid.uuid4())}
+
+
+class _handles:
+    def get(self, type_id, com_id):
+        return f"123456789/{com_id}"
+
+
+class _metadata:
+    def value(self, type_id, com_id):
+        return None
+
+
+class test_community_levels(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _communities(self, coms: list, com2com: list) -> communities:
+        com_file = os.path.join(self._dir, "community.json")
+        com2com_file = os.path.join(self._dir, "community2community.json")
+        with open(com_file, mode="w", encoding="utf-8") as fout:
+            json.dump(coms, fout)
+        with open(com2com_file, mode="w", encoding="utf-8") as fout:
+            json.dump([{"parent_comm_id": p, "child_comm_id": c} for p, c in com2com], fout)
+        return communities(com_file, com2com_file)
+
+    @staticmethod
+    def _ids(levels: list) -> list:
+        return [sorted(x["community_id"] for x in level) for level in levels]
+
+    def test_tree(self):
+        c = self._communities([_com(x) for x in range(1, 7)], [(1, 2), (1, 3), (2, 4), (4, 5)])
+        levels, parent_of = c._levels()
+        self.assertEqual(self._ids(levels), [[1, 6], [2, 3], [4], [5]])
+        self.assertEqual(parent_of, {2: 1, 3: 1, 4: 2, 5: 4})
+
+    def test_unknown_parent(self):
+        c = self._communities([_com(1), _com(2), _com(3)], [(99, 2), (2, 3)])
+        levels, parent_of = c._levels()
+        self.assertEqual(self._ids(levels), [[1, 2], [3]])
+        self.assertEqual(parent_of, {3: 2})
+
+    def test_cycle(self):
+        # 2 -> 3 -> 4 -> 2 is a cycle, 5 is below it
+        c = self._communities([_com(x) for x in range(1, 6)], [(1, 6), (2, 3), (3, 4), (4, 2), (4, 5)])
+        levels, parent_of = c._levels()
+        self.assertEqual(self._ids(levels), [[1]])
+
+    def test_more_parents(self):
+        c = self._communities([_com(1), _com(2), _com(3)], [(1, 3), (2, 3)])
+        levels, parent_of = c._levels()
+        self.assertEqual(parent_of, {3: 1})
+        self.assertEqual(self._ids(levels), [[1, 2], [3]])
+
+    def test_import_parents_first(self):
+        c = self._communities([_com(x) for x in range(1, 6)], [(1, 2), (2, 3), (1, 4), (4, 5)])
+        dspace = _dspace()
+        c.import_to(dspace, _handles(), _metadata(), workers=3)
+        self.assertEqual(c.imported_coms, 5)
+        created = [h for h, _1 in dspace.created]
+        for parent, child in [(1, 2), (2, 3), (1, 4), (4, 5)]:
+            self.assertLess(created.index(f"123456789/{parent}"), created.index(f"123456789/{child}"))
+        parents = {h: p for h, p in dspace.created}
+        self.assertIsNone(parents["123456789/1"])
+        self.assertEqual(parents["123456789/3"], c.uuid(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
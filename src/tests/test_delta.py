@@ -0,0 +1,157 @@
+import re
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import unittest
+
+from pump._delta import delta
+from pump._idstore import idstore
+from pump._fingerprint import fingerprints
+
+_SCHEMA = [
+    "CREATE TABLE item (item_id INTEGER PRIMARY KEY, last_modified TEXT)",
+    "CREATE TABLE workspaceitem (workspace_item_id INTEGER PRIMARY KEY, item_id INTEGER)",
+    "CREATE TABLE workflowitem (workflow_id INTEGER PRIMARY KEY, item_id INTEGER)",
+    "CREATE TABLE item2bundle (id INTEGER PRIMARY KEY, item_id INTEGER, bundle_id INTEGER)",
+    "CREATE TABLE bundle2bitstream (id INTEGER PRIMARY KEY, bundle_id INTEGER, bitstream_id INTEGER)",
+    "CREATE TABLE resourcepolicy (policy_id INTEGER PRIMARY KEY, resource_type_id INTEGER, "
+    "resource_id INTEGER, action_id INTEGER)",
+]
+
+_any = re.compile(r"(\w+) = ANY\(ARRAY\[([^\]]*)\](?:::integer\[\])?\)")
+_fp = re.compile(r'SELECT (\w+), md5\(row_to_json\(t\)::text\) FROM "(\w+)" t(.*) ORDER BY')
+
+
+def _sqlite(sql: str) -> str:
+    return _any.sub(r"\1 IN (\2)", sql)
+
+
+class _db:
+    """
+        v5 database in SQLite, PostgreSQL specific parts of the delta queries are translated.
+    """
+
+    def __init__(self):
+        self._conn = sqlite3.connect(":memory:")
+        for sql in _SCHEMA:
+            self._conn.execute(sql)
+
+    def exe(self, sql: str, rows: list = None):
+        if rows is None:
+            self._conn.execute(sql)
+        else:
+            self._conn.executemany(sql, rows)
+
+    def fetch_all(self, sql: str, col_names: list = None):
+        return self._conn.execute(_sqlite(sql)).fetchall()
+
+    def fetch_iter(self, sql: str, batch: int = 10000):
+        pk, table_name, where = _fp.match(sql).groups()
+        cur = self._conn.execute(f"SELECT * FROM {table_name} t{_sqlite(where)} ORDER BY {pk}")
+        idx = [x[0] for x in cur.description].index(pk)
+        for row in cur:
+            yield row[idx], hashlib.md5(repr(row).encode("utf-8")).hexdigest()
+
+
+class test_delta(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._ids = idstore(f"{self._dir}/ids.sqlite")
+        self.db5 = _db()
+        self.db5.exe("INSERT INTO item VALUES (?, ?)", [(i, f"2024-01-0{i} 10:00:00") for i in range(1, 8)])
+        self.db5.exe("INSERT INTO workspaceitem VALUES (1, 6)")
+        self.db5.exe("INSERT INTO workflowitem VALUES (1, 7)")
+        self.db5.exe("INSERT INTO item2bundle VALUES (?, ?, ?)", [(i, i, 10 + i) for i in range(1, 8)])
+        self.db5.exe("INSERT INTO bundle2bitstream VALUES (?, ?, ?)", [(i, 10 + i, 100 + i) for i in range(1, 8)])
+        self.db5.exe("INSERT INTO resourcepolicy VALUES (?, 2, ?, 0)", [(i, i) for i in range(1, 8)])
+
+        # full import - archived items 1..5 migrated
+        d = self._delta()
+        state = d.snapshot(self.db5)
+        self._ids.upsert_many("item", {i: f"uuid-{i}" for i in range(1, 6)})
+        d.save(state, self.db5)
+
+    def tearDown(self):
+        self._ids.close()
+        shutil.rmtree(self._dir)
+
+    def _delta(self) -> delta:
+        # one `fingerprints` per run
+        return delta(f"{self._dir}/delta/watermarks.json", fingerprints(f"{self._dir}/fingerprints"), self._ids)
+
+    def test_watermarks(self):
+        d = self._delta()
+        self.assertTrue(d.exists())
+        self.assertEqual(d.load()["item"], {"max_id": 7, "last_modified": "2024-01-07 10:00:00"})
+
+    def test_missing_watermarks(self):
+        d = delta(f"{self._dir}/other/watermarks.json", fingerprints(f"{self._dir}/fingerprints"), self._ids)
+        with self.assertRaises(FileNotFoundError):
+            d.compute(self.db5)
+
+    def test_not_computed(self):
+        with self.assertRaises(RuntimeError):
+            self._delta().where("item")
+
+    def test_nothing_changed(self):
+        d = self._delta()
+        changes = d.compute(self.db5)
+        # workspace and workflow items older than the watermark are not new
+        self.assertEqual(changes["new_items"], [])
+        self.assertEqual(changes["changed_items"], [])
+        self.assertEqual(changes["deleted_items"], [])
+        self.assertEqual(changes["new_bitstreams"], [])
+        for v in changes["tables"].values():
+            self.assertEqual(v, {"added": [], "changed": [], "deleted": []})
+        self.assertEqual(d.where("item"), "item_id = ANY(ARRAY[]::integer[])")
+        self.assertIsNone(d.where("metadatafieldregistry"))
+        self.assertEqual(d.where("eperson"), "FALSE")
+
+    def test_changes(self):
+        # new item after the watermark, item 3 modified, item 5 deleted
+        self.db5.exe("INSERT INTO item VALUES (8, '2024-02-01 10:00:00')")
+        self.db5.exe("INSERT INTO item2bundle VALUES (8, 8, 18)")
+        self.db5.exe("UPDATE item SET last_modified = '2024-02-02 10:00:00' WHERE item_id = 3")
+        self.db5.exe("DELETE FROM item WHERE item_id = 5")
+        # item 6 is still in workspace, item 7 was archived in the meantime but not migrated yet
+        self.db5.exe("DELETE FROM workflowitem")
+        # new bitstream of item 1, new policy of item 2, changed policy of item 4
+        self.db5.exe("INSERT INTO bundle2bitstream VALUES (20, 11, 120)")
+        self.db5.exe("INSERT INTO resourcepolicy VALUES (20, 2, 2, 1)")
+        self.db5.exe("UPDATE resourcepolicy SET action_id = 3 WHERE policy_id = 4")
+
+        d = self._delta()
+        changes = d.compute(self.db5)
+        self.assertEqual(changes["new_items"], [7, 8])
+        self.assertEqual(changes["changed_items"], [3])
+        self.assertEqual(changes["deleted_items"], [5])
+        self.assertEqual(changes["new_bitstreams"], [120])
+        self.assertEqual(changes["new_policies"], [(20, 2, 2)])
+        self.assertEqual(changes["tables"]["resourcepolicy"], {"added": [20], "changed": [4], "deleted": []})
+        self.assertEqual(changes["tables"]["bundle2bitstream"], {"added": [20], "changed": [], "deleted": []})
+
+        self.assertEqual(d.ids[2], {3, 7, 8})
+        self.assertEqual(d.ids[1], {11, 13, 17, 18})
+        self.assertEqual(d.ids[0], {101, 103, 107, 120})
+        self.assertEqual(d.where("item"), "item_id = ANY(ARRAY[3,7,8])")
+        self.assertEqual(d.where("bundle"), "bundle_id = ANY(ARRAY[11,13,17,18])")
+        self.assertTrue(d.where("resourcepolicy").endswith(" OR policy_id = ANY(ARRAY[20])"))
+
+        # watermarks of the next run
+        self.assertEqual(d.next_state["item"], {"max_id": 8, "last_modified": "2024-02-02 10:00:00"})
+
+    def test_next_run(self):
+        self.db5.exe("INSERT INTO resourcepolicy VALUES (20, 2, 2, 1)")
+        d = self._delta()
+        self.assertEqual(d.compute(self.db5)["tables"]["resourcepolicy"]["added"], [20])
+        d.save(d.next_state, self.db5)
+
+        # changes are relative to the stored watermarks
+        d = self._delta()
+        self.assertEqual(d.compute(self.db5)["tables"]["resourcepolicy"]["added"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import re
+import hashlib
+import unittest
+
+from pump._db import differ
+
+
+def _md5(s: str) -> str:
+    return hashlib.md5(s.encode("utf-8")).hexdigest()
+
+
+class _db:
+    """
+        Answers the queries of `differ` in `rows` and `hash` mode over one table in memory.
+    """
+
+    def __init__(self, cols: list, rows: list):
+        self.cols = cols
+        self.rows = rows
+        self.sqls = []
+
+    def _r(self, rows_sql: str) -> set:
+        names = re.findall(r'coalesce\("(\w+)"::text', rows_sql)
+        idxs = [self.cols.index(x) for x in names]
+        return {"|".join("None" if row[i] is None else str(row[i]) for i in idxs) for row in self.rows}
+
+    def fetch_all(self, sql: str, col_names: list = None):
+        self.sqls.append(sql)
+        if sql.startswith("SELECT * FROM"):
+            if col_names is not None:
+                col_names.extend(self.cols)
+            return list(self.rows)
+
+        rows_sql = re.search(r"\((SELECT DISTINCT .*? FROM \w+)\) rs", sql).group(1)
+        hs = sorted(_md5(x) for x in self._r(rows_sql))
+
+        m = re.search(r"LIKE ANY\(ARRAY\[(.*)\]\)", sql)
+        if m is not None:
+            prefixes = [x.strip("'%") for x in m.group(1).split(",")]
+            return [(x,) for x in self._r(rows_sql) if any(_md5(x).startswith(p) for p in prefixes)]
+
+        depth = int(re.search(r"substr\(h, 1, (\d+)\) AS p", sql).group(1))
+        m = re.search(r"WHERE substr\(h, 1, (\d+)\) = ANY\(ARRAY\[(.*?)\]\)", sql)
+        if m is not None:
+            n, prefixes = int(m.group(1)), {x.strip("'") for x in m.group(2).split(",")}
+            hs = [x for x in hs if x[:n] in prefixes]
+        ranges = {}
+        for h in hs:
+            ranges.setdefault(h[:depth], []).append(h)
+        return [(p, len(v), _md5("".join(v))) for p, v in ranges.items()]
+
+
+class _differ(differ):
+    """
+        Records the differences instead of logging them.
+    """
+
+    def __init__(self, db5, db7, mode: str):
+        super().__init__(db5, None, db7, mode=mode)
+        self.found = None
+
+    def _cmp_values(self, table_name, vals5, only_in_5, vals7, only_in_7, do_not_show, counts=None):
+        self.found = (sorted(only_in_5), sorted(only_in_7), counts)
+
+
+class test_differ_hash(unittest.TestCase):
+
+    COLS = ["eperson_id", "email", "netid"]
+
+    def setUp(self):
+        self._step, self._limit = differ.HASH_STEP, differ.HASH_FETCH_LIMIT
+
+    def tearDown(self):
+        differ.HASH_STEP, differ.HASH_FETCH_LIMIT = self._step, self._limit
+
+    def _diff(self, mode: str, rows5: list, rows7: list) -> tuple:
+        db5 = _db(test_differ_hash.COLS, rows5)
+        db7 = _db(test_differ_hash.COLS, rows7)
+        d = _differ(db5, db7, mode)
+        if mode == "rows":
+            d.diff_table_cmp_cols(db5, "eperson", ["email", "netid"], gdpr=False)
+        else:
+            d.diff_table_cmp_cols_hash(db5, "eperson", ["email", "netid"], gdpr=False)
+        return d.found, db5
+
+    def _both(self, rows5: list, rows7: list):
+        found_rows, _1 = self._diff("rows", rows5, rows7)
+        found_hash, db5 = self._diff("hash", rows5, rows7)
+        if found_rows is None:
+            self.assertIsNone(found_hash)
+        else:
+            self.assertEqual(found_hash[:2], found_rows[:2])
+        return found_hash, db5
+
+    @staticmethod
+    def _rows(n: int, start: int = 0) -> list:
+        return [(i, f"user{i}@example.com", None if i % 3 else f"net{i}") for i in range(start, start + n)]
+
+    def test_same(self):
+        rows = self._rows(50)
+        found, db5 = self._both(rows, list(reversed(rows)))
+        self.assertIsNone(found)
+        # only the top level ranges are compared, no rows are fetched
+        self.assertEqual(len(db5.sqls), 1)
+
+    def test_ids_are_not_compared(self):
+        rows5 = self._rows(20)
+        rows7 = [(i + 100,) + tuple(x[1:]) for i, x in enumerate(rows5)]
+        self.assertIsNone(self._both(rows5, rows7)[0])
+
+    def test_differences(self):
+        rows5 = self._rows(50)
+        rows7 = [x for x in self._rows(48, 2) if x[0] != 7] + [(7, "user7@example.com", "changed"),
+                                                                (50, "new@example.com", None)]
+        found, _1 = self._both(rows5, rows7)
+        self.assertEqual(found[0], ["user0@example.com|net0", "user1@example.com|None", "user7@example.com|None"])
+        self.assertEqual(found[1], ["new@example.com|None", "user7@example.com|changed"])
+        self.assertEqual(found[2], (50, 49))
+
+    def test_drill_down(self):
+        differ.HASH_STEP, differ.HASH_FETCH_LIMIT = 1, 2
+        rows5 = self._rows(200)
+        rows7 = rows5[:100] + rows5[101:] + [(1000, "new@example.com", None)]
+        found, db5 = self._both(rows5, rows7)
+        self.assertEqual(found[0], ["user100@example.com|None"])
+        self.assertEqual(found[1], ["new@example.com|None"])
+        # mismatching ranges were split before fetching
+        self.assertTrue(any("substr(h, 1, 2) AS p" in x for x in db5.sqls))
+
+    def test_empty(self):
+        found, _1 = self._both([], self._rows(3))
+        self.assertEqual(len(found[1]), 3)
+        self.assertIsNone(self._both([], [])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
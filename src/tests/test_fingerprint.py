@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pump._fingerprint import fingerprint, fingerprints
+
+
+class _db:
+    """
+        Returns the given (pk, hash) rows, counts scans.
+    """
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.sqls = []
+
+    def fetch_iter(self, sql: str, batch: int = 10000):
+        self.sqls.append(sql)
+        return iter(self.rows)
+
+
+class test_fingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _fp(self, name: str, rows: list) -> fingerprint:
+        return fingerprint.export(_db(rows), "resourcepolicy", os.path.join(self._dir, name))
+
+    def test_diff(self):
+        old = self._fp("old", [(1, "a"), (2, "b"), (4, "d"), (6, "f")])
+        new = self._fp("new", [(2, "b"), (3, "c"), (4, "x"), (6, "f"), (7, "g")])
+        self.assertEqual(old.diff(new), {"insert": [3, 7], "update": [4], "delete": [1]})
+        self.assertEqual(new.diff(old), {"insert": [1], "update": [4], "delete": [3, 7]})
+        self.assertTrue(old.changed(new))
+
+    def test_diff_empty(self):
+        old = self._fp("old", [])
+        new = self._fp("new", [(1, "a")])
+        self.assertEqual(old.diff(new), {"insert": [1], "update": [], "delete": []})
+        self.assertEqual(new.diff(new), {"insert": [], "update": [], "delete": []})
+        self.assertFalse(new.changed(new))
+        # missing fingerprint has no rows
+        missing = fingerprint(os.path.join(self._dir, "missing"))
+        self.assertEqual(missing.diff(new)["insert"], [1])
+        self.assertTrue(missing.changed(new))
+
+    def test_export_sql(self):
+        db = _db([])
+        fingerprint.export(db, "bundle2bitstream", os.path.join(self._dir, "b2b"), "bundle_id IN (1)")
+        self.assertIn("ORDER BY id", db.sqls[0])
+        self.assertIn("WHERE bundle_id IN (1)", db.sqls[0])
+
+    def test_take_once_per_run(self):
+        fps_dir = os.path.join(self._dir, "fingerprints")
+        db = _db([(1, "a"), (2, "b")])
+        fps = fingerprints(fps_dir)
+        fp = fps.take(db, "resourcepolicy")
+        self.assertIs(fps.take(db, "resourcepolicy"), fp)
+        self.assertEqual(len(db.sqls), 1)
+        # filtered rows have their own file
+        filtered = fps.take(db, "resourcepolicy", "policy_id > 1")
+        self.assertNotEqual(filtered.file_str, fp.file_str)
+        self.assertEqual(len(db.sqls), 2)
+
+        # the next run keeps the previous fingerprint
+        db = _db([(1, "a"), (2, "x"), (3, "c")])
+        fp = fingerprints(fps_dir).take(db, "resourcepolicy")
+        prev = fingerprint(fp.file_str + ".prev")
+        self.assertEqual(prev.diff(fp), {"insert": [3], "update": [2], "delete": []})
+
+    def test_keep(self):
+        fp = self._fp("cur", [(1, "a")])
+        kept = fingerprints.keep(fp, os.path.join(self._dir, "kept"))
+        self.assertFalse(fp.changed(kept))
+        self.assertEqual(list(kept.rows()), [(1, "a")])
+
+
+if __name__ == "__main__":
+    unittest.main()
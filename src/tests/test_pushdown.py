@@ -0,0 +1,82 @@
+import unittest
+
+from pump._pushdown import pushdown, literal
+
+
+class test_pushdown(unittest.TestCase):
+
+    BASE = "SELECT name, email FROM eperson"
+
+    def test_literal(self):
+        self.assertEqual(literal(None), "NULL")
+        self.assertEqual(literal(5), "'5'")
+        self.assertEqual(literal("O'Brien"), "'O''Brien'")
+
+    def test_no_steps(self):
+        p = pushdown(["name", "email"], [])
+        self.assertEqual(
+            p.compile(test_pushdown.BASE),
+            'SELECT q."name", q."email" FROM (SELECT * FROM (SELECT name, email FROM eperson) s0("name", "email")) q')
+
+    def test_expr_filter(self):
+        p = pushdown(["name", "email"], [
+            ["filter", "{email} IS NOT NULL"],
+            ["expr", "email", "lower({email})"],
+            ["expr", "domain", "split_part({email}, '@', 2)"],
+        ], output=["name", "domain"])
+        self.assertEqual(
+            p.compile(test_pushdown.BASE),
+            'SELECT q."name", q."domain" FROM ('
+            'SELECT s3."name", s3."email", (split_part(s3."email", \'@\', 2)) AS "domain" FROM ('
+            'SELECT s2."name", (lower(s2."email")) AS "email" FROM ('
+            'SELECT * FROM (SELECT * FROM (SELECT name, email FROM eperson) s0("name", "email")) s1 '
+            'WHERE s1."email" IS NOT NULL) s2) s3) q')
+
+    def test_unknown_column_is_kept(self):
+        p = pushdown(["name"], [["filter", "{name} ~ '^a{2}'"], ["filter", "{other} = 1"]])
+        sql = p.compile("SELECT name FROM g")
+        self.assertIn("s1.\"name\" ~ '^a{2}'", sql)
+        self.assertIn("{other} = 1", sql)
+
+    def test_unnest(self):
+        p = pushdown(["name"], [["unnest", "name", "ARRAY[{name}, {name} || '_2']"]])
+        self.assertEqual(
+            p.compile("SELECT name FROM g"),
+            'SELECT q."name" FROM (SELECT u1.v AS "name" FROM ('
+            'SELECT * FROM (SELECT name FROM g) s0("name")) s1 '
+            'CROSS JOIN LATERAL unnest(ARRAY[s1."name", s1."name" || \'_2\']) AS u1(v)) q')
+
+    def test_lookup(self):
+        repos = []
+
+        def fnc(repo):
+            repos.append(repo)
+            return {1: "a-uuid", "it's": None}
+
+        p = pushdown(["id"], [["expr", "id", "{id} + 0"], ["lookup", "uuid", "{id}", fnc]], output=["uuid"])
+        repo = object()
+        sql = p.compile("SELECT id FROM item", repo)
+        self.assertEqual(repos, [repo])
+        self.assertTrue(sql.startswith("WITH lk2(k, v) AS (VALUES ('1', 'a-uuid'), ('it''s', NULL)) SELECT q.\"uuid\""))
+        self.assertIn('s2."id", lk2.v AS "uuid" FROM (', sql)
+        self.assertTrue(sql.endswith(' s2 LEFT JOIN lk2 ON lk2.k = (s2."id")::text) q'))
+
+    def test_lookup_empty(self):
+        p = pushdown(["id"], [["lookup", "a", "{id}", lambda repo: {}], ["lookup", "b", "{a}", lambda repo: {2: 3}]])
+        sql = p.compile("SELECT id FROM item")
+        self.assertTrue(sql.startswith(
+            "WITH lk1(k, v) AS (SELECT NULL::text AS k, NULL::text AS v WHERE FALSE), "
+            "lk2(k, v) AS (VALUES ('2', '3')) SELECT q.\"id\", q.\"a\", q.\"b\" FROM ("))
+        self.assertIn('LEFT JOIN lk2 ON lk2.k = (s2."a")::text', sql)
+
+    def test_unknown_step(self):
+        with self.assertRaises(ValueError):
+            pushdown(["id"], [["join", "id"]]).compile("SELECT id FROM item")
+
+    def test_compile_twice(self):
+        p = pushdown(["id"], [["expr", "x", "{id}"]])
+        self.assertEqual(p.compile("SELECT id FROM item"), p.compile("SELECT id FROM item"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import unittest
+
+from pump._wal import wal
+from pump._bundle import bundles
+from pump._bitstream import bitstreams
+from pump._resourcepolicy import resourcepolicies
+
+
+def _uuid(name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, name))
+
+
+def _bs(b_id: int) -> dict:
+    return {
+        "bitstream_id": b_id, "deleted": False, "size_bytes": 10, "checksum_algorithm": "MD5",
+        "checksum": f"checksum-{b_id}", "bitstream_format_id": 1, "internal_id": f"{b_id:038d}",
+        "store_number": 0, "sequence_id": 1,
+    }
+
+
+class _dspace:
+    def __init__(self):
+        self.bundles = []
+        self.bitstreams = []
+
+    def put_bundle(self, item_uuid, data):
+        self.bundles.append(item_uuid)
+        return {"uuid": _uuid(f"bundle-{len(self.bundles)}")}
+
+    def put_bitstream(self, params, data):
+        self.bitstreams.append(params)
+        return {"id": _uuid(params["internal_id"])}
+
+    def put_resourcepolicy(self, params, data):
+        return {}
+
+
+class _metadatas:
+    def value(self, type_id, res_id, log_missing: bool = True):
+        return None
+
+    def filter_res_d(self, res_d, ignored):
+        return {}
+
+
+class _items:
+    def uuid(self, item_id):
+        return f"item-uuid-{item_id}"
+
+
+class _formats:
+    unknown_format_id = 0
+
+    def mimetype(self, format_id):
+        return "text/plain"
+
+
+class _logos:
+    logos = {}
+
+
+class _repo:
+    class items:
+        TYPE = 2
+
+    class bundles:
+        TYPE = 1
+
+    class epersons:
+        @staticmethod
+        def uuid(e_id):
+            return _uuid(f"eperson-{e_id}")
+
+    @staticmethod
+    def uuid(res_type_id, res_id):
+        return _uuid(f"{res_type_id}-{res_id}")
+
+
+def _policy(p_id: int, res_id: int) -> dict:
+    return {
+        "policy_id": p_id, "resource_type_id": 2, "resource_id": res_id, "action_id": 0,
+        "start_date": None, "end_date": None, "rpname": None, "rptype": None, "rpdescription": None,
+        "eperson_id": 1, "epersongroup_id": None,
+    }
+
+
+class _db7:
+    def delete_resource_policy_of(self, uuids: list):
+        pass
+
+
+class test_pipeline_resume(unittest.TestCase):
+    """
+        Bundles and bitstreams of one item imported by the pipeline stages after a crash.
+    """
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._wal = os.path.join(self._dir, "wal.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _json(self, name: str, data: list) -> str:
+        file_str = os.path.join(self._dir, name)
+        with open(file_str, mode="w", encoding="utf-8") as fout:
+            json.dump(data, fout)
+        return file_str
+
+    def _import(self, w, dspace):
+        # the cache files are written after the pipeline, objects start empty
+        bu = bundles(self._json("bundle.json", [{"bundle_id": 10, "primary_bitstream_id": 101},
+                                                {"bundle_id": 11, "primary_bitstream_id": None}]),
+                     self._json("item2bundle.json", [{"item_id": 1, "bundle_id": 10},
+                                                     {"item_id": 1, "bundle_id": 11}]))
+        bs = bitstreams(self._json("bitstream.json", [_bs(100), _bs(101), _bs(110)]),
+                        self._json("bundle2bitstream.json", [{"bundle_id": 10, "bitstream_id": 100},
+                                                             {"bundle_id": 10, "bitstream_id": 101},
+                                                             {"bundle_id": 11, "bitstream_id": 110}]))
+        env = {"backend": {}, "assetstore": ""}
+        bundle_ids = bu.import_item(1, dspace, _metadatas(), _items(), w)
+        bs_ids = bs.import_bundles(bundle_ids, env, dspace, _metadatas(), _formats(), bu, _logos(), _logos(), w)
+        return bu, bs, bundle_ids, bs_ids
+
+    def test_resume(self):
+        w = wal(self._wal, resume=False)
+        w.append("bundle", 10, _uuid("bundle-10"))
+        w.append("bitstream", 100, _uuid("bs-100"))
+        w.close()
+
+        w = wal(self._wal, resume=True)
+        dspace = _dspace()
+        bu, bs, bundle_ids, bs_ids = self._import(w, dspace)
+        w.close()
+
+        self.assertEqual(dspace.bundles, ["item-uuid-1"])
+        self.assertEqual(bundle_ids, [10, 11])
+        self.assertEqual(bu.uuid(10), _uuid("bundle-10"))
+        self.assertEqual(bu.imported, 2)
+
+        self.assertEqual(bs_ids, [100, 101, 110])
+        params = {int(x["internal_id"]): x for x in dspace.bitstreams}
+        self.assertEqual(sorted(params.keys()), [101, 110])
+        self.assertEqual(params[101]["bundle_id"], _uuid("bundle-10"))
+        self.assertEqual(params[101]["primaryBundle_id"], _uuid("bundle-10"))
+        self.assertEqual(params[110]["bundle_id"], bu.uuid(11))
+        # policies of the bitstream created before are imported too
+        self.assertEqual(bs.uuid(100), _uuid("bs-100"))
+        self.assertEqual(bs.imported, 3)
+
+    def test_replay_is_not_counted_twice(self):
+        w = wal(self._wal, resume=False)
+        w.append("bundle", 10, _uuid("bundle-10"))
+        w.close()
+
+        w = wal(self._wal, resume=True)
+        bu, _1, _2, _3 = self._import(w, _dspace())
+        # the regular phase replays the WAL after the pipeline
+        self.assertEqual(w.replay_into("bundle", bu.id2uuid), 0)
+        self.assertEqual(bu.imported, 2)
+        w.close()
+
+
+    def test_policies_counted_once(self):
+        w = wal(self._wal, resume=False)
+        w.append("resourcepolicy", 1)
+        w.close()
+
+        w = wal(self._wal, resume=True)
+        rp = resourcepolicies(self._json("resourcepolicy.json", [_policy(x, x) for x in range(1, 6)]))
+        env = {"dspace": {"actions": ["READ"]}}
+        # pipeline imports policies of items 1..3, the policy phase the rest
+        self.assertEqual(rp.import_objects(env, _dspace(), _repo(), [(2, 1), (2, 2), (2, 3)], w, _db7()), 0)
+        self.assertEqual(rp.imported, 2)
+        rp.import_to(env, _dspace(), _repo(), w)
+        self.assertEqual(rp.imported, 5)
+        w.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from pump._wal import wal
+
+
+class test_wal(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._file = os.path.join(self._dir, "wal.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_replay_after_resume(self):
+        w = wal(self._file, resume=False)
+        w.append("item", 1, "uuid-1")
+        w.append("item", 2, "uuid-2", ws_id=7)
+        w.close()
+
+        w = wal(self._file, resume=True)
+        self.assertTrue(w.done("item", "1"))
+        self.assertTrue(w.done("item", 2))
+        self.assertFalse(w.done("bundle", 1))
+        self.assertEqual(w.get("item", 2)["x"], {"ws_id": 7})
+
+        id2uuid = {"1": "uuid-1"}
+        self.assertEqual(w.replay_into("item", id2uuid), 1)
+        self.assertEqual(id2uuid, {"1": "uuid-1", "2": "uuid-2"})
+        w.close()
+
+    def test_broken_last_line(self):
+        w = wal(self._file, resume=False)
+        w.append("item", 1, "uuid-1")
+        w.close()
+        # crash in the middle of a write
+        with open(self._file, mode="a", encoding="utf-8") as fout:
+            fout.write('{"t": "item", "id": "2", "uu')
+
+        w = wal(self._file, resume=True)
+        self.assertEqual(len(w), 1)
+        w.append("item", 3, "uuid-3")
+        w.close()
+
+        w = wal(self._file, resume=True)
+        self.assertEqual(sorted(w.records("item").keys()), ["1", "3"])
+        w.close()
+
+    def test_not_resuming_truncates(self):
+        w = wal(self._file, resume=False)
+        w.append("item", 1, "uuid-1")
+        w.close()
+
+        w = wal(self._file, resume=False)
+        self.assertEqual(len(w), 0)
+        w.close()
+        w = wal(self._file, resume=True)
+        self.assertEqual(len(w), 0)
+        w.close()
+
+    def test_merge_shards(self):
+        w = wal(self._file, resume=False)
+        w.append("item", 1, "uuid-1")
+        shard = wal(f"{self._file}.shard-items-0", resume=False)
+        shard.append("item", 1, "uuid-1")
+        shard.append("item", 2, "uuid-2")
+        shard.close()
+
+        self.assertEqual(w.merge_shards(), 1)
+        self.assertFalse(os.path.exists(f"{self._file}.shard-items-0"))
+        w.close()
+        with open(self._file, mode="r", encoding="utf-8") as fin:
+            self.assertEqual([json.loads(x)["id"] for x in fin], ["1", "2"])
+
+    def test_in_memory(self):
+        w = wal(None)
+        w.append("bundle", 5, "uuid-5")
+        self.assertTrue(w.done("bundle", 5))
+        self.assertIsNone(w.file_str)
+        self.assertEqual(w.merge_shards(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,13 +23,16 @@ if __name__ == "__main__":
         description='Resource policies checker of anonymous view of items')
     parser.add_argument('--temp-item-dict', help='item_dict.json', type=str, default=os.path.join(
         _this_dir, "../../src/__temp/resume/item.json"))
+    parser.add_argument('--id-store', help='id2uuid.sqlite, used instead of item_dict.json if it exists',
+                        type=str, default=os.path.join(_this_dir, "../../src/__temp/resume/id2uuid.sqlite"))
     parser.add_argument('--input-handle-json', help='handle.json', type=str, default=os.path.join(
         _this_dir, "../../input/data/handle.json"))
     args = parser.parse_args()
 
     _logger.info('Resource policies checker of anonymous view of items')
 
-    if not os.path.exists(args.temp_item_dict):
+    use_id_store = os.path.exists(args.id_store)
+    if not use_id_store and not os.path.exists(args.temp_item_dict):
         _logger.critical(f"File {args.temp_item_dict} does not exist - cannot import.")
         sys.exit(1)
 
@@ -43,7 +46,10 @@ if __name__ == "__main__":
     db_env = settings["db_dspace_5"]
     db5 = pump.db(db_env)
 
-    items_id2uuid = read_json(args.temp_item_dict)["data"]["id2uuid"]
+    if use_id_store:
+        items_id2uuid = pump.idstore(args.id_store, readonly=True).id2uuid("item")
+    else:
+        items_id2uuid = read_json(args.temp_item_dict)["data"]["id2uuid"]
 
     # create select
     # we want all resource_ids for items
@@ -53,6 +53,12 @@ def table_diff(old_db_d: dict, new_db_d: dict):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Diff databases before/after import')
     parser.add_argument('--use', help='Instance to diff', required=True, type=str)
+    parser.add_argument('--mode', help='Compare all rows (rows) or hashes of row ranges in the databases (hash)',
+                        required=False, type=str, choices=["rows", "hash"], default="rows")
+    parser.add_argument('--profile-phase', help='Profile this part (table_diff or validated object), can be repeated',
+                        required=False, type=str, action='append', default=[])
+    parser.add_argument('--profiler', help='Profile using cprofile (.pstats) or sampling (collapsed stacks)',
+                        required=False, type=str, choices=["cprofile", "sampling"], default="cprofile")
     args = parser.parse_args()
 
     # update settings with selected one from the command line
@@ -70,6 +76,7 @@ if __name__ == "__main__":
     env.update(use_env)
 
     from pump._db import db, differ
+    from pump._profiler import profiler
     from pump._handle import handles
     from pump._bitstreamformatregistry import bitstreamformatregistry
     from pump._community import communities
@@ -85,19 +92,16 @@ if __name__ == "__main__":
         "db_dspace_5"
     raw_db_dspace_old = db(env[raw_db_old_key])
 
+    prof = profiler.from_log_file(env["log_file"], args.profile_phase, args.profiler)
+
     # table diff
-    table_diff(raw_db_dspace_old.table_count(), raw_db_7.table_count())
+    with prof.section("table_diff"):
+        table_diff(raw_db_dspace_old.table_count(), raw_db_7.table_count())
 
     # value/count diff
-    diff = differ(raw_db_dspace_old, None, raw_db_7)
-
-    diff.validate([handles.validate_table])
-    diff.validate([bitstreamformatregistry.validate_table])
-    diff.validate([communities.validate_table])
-    diff.validate([collections.validate_table])
-    diff.validate([registrationdatas.validate_table])
-    diff.validate([userregistrations.validate_table])
-
-    diff.validate([items.validate_table])
-    diff.validate([bundles.validate_table])
-    diff.validate([bitstreams.validate_table])
+    diff = differ(raw_db_dspace_old, None, raw_db_7, mode=args.mode)
+
+    for obj in [handles, bitstreamformatregistry, communities, collections, registrationdatas,
+                userregistrations, items, bundles, bitstreams]:
+        with prof.section(obj.__name__):
+            diff.validate([obj.validate_table])